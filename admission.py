@@ -0,0 +1,119 @@
+"""Контроль допуска запросов к инференсу.
+
+Одновременно в модели не больше ADMISSION_MAX_CONCURRENT запросов,
+остальные ждут в очереди FIFO длиной ADMISSION_MAX_QUEUE. Запрос, которому
+не хватило места в очереди или который прождал в ней дольше
+ADMISSION_MAX_QUEUE_WAIT_MS, сразу получает 503 с Retry-After: лучше быстро
+отказать части клиентов, чем отвечать всем с растущей задержкой.
+
+Клиент может передать бюджет запроса в заголовке X-Request-Timeout-Ms.
+Запрос с истекшим сроком не ждет в очереди и отбрасывается до запуска
+энкодера: в микробатчере и в воркере пула перед прогоном модели.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT_SECONDS
+from workers import DeadlineExceededError, PoolOverloadedError
+
+DEADLINE_HEADER = 'X-Request-Timeout-Ms'
+
+
+class AdmissionRejectedError(PoolOverloadedError):
+    """Запрос не допущен: очередь полна или ожидание в ней слишком долгое"""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def deadline_from_timeout(timeout_ms: float | None) -> float | None:
+    """Срок по time.monotonic из бюджета в миллисекундах; без бюджета — ADMISSION_DEFAULT_TIMEOUT_MS"""
+    if timeout_ms is None:
+        timeout_ms = float(os.environ.get('ADMISSION_DEFAULT_TIMEOUT_MS', 0)) or None
+    if timeout_ms is None:
+        return None
+    return time.monotonic() + timeout_ms / 1000
+
+
+class AdmissionController:
+    """Ограничение числа запросов в инференсе и очередь ожидания перед ним"""
+
+    def __init__(self, max_concurrent: int | None = None, max_queue: int | None = None,
+                 max_queue_wait_ms: float | None = None, retry_after: float | None = None):
+        self.max_concurrent = max_concurrent or int(os.environ.get('ADMISSION_MAX_CONCURRENT', 64))
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get('ADMISSION_MAX_QUEUE', 128))
+        if max_queue_wait_ms is None:
+            max_queue_wait_ms = float(os.environ.get('ADMISSION_MAX_QUEUE_WAIT_MS', 1000))
+        self.max_queue_wait = max_queue_wait_ms / 1000
+        self.retry_after = retry_after or float(os.environ.get('ADMISSION_RETRY_AFTER_S', 1))
+
+        self.in_flight = 0
+        # Ожидающие запросы; освободившийся слот передается первому из них
+        self._waiters: deque[asyncio.Future] = deque()
+
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def admit(self, deadline: float | None = None):
+        """Занимает слот на время блока или бросает AdmissionRejectedError / DeadlineExceededError"""
+        await self._acquire(deadline)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, deadline: float | None):
+        now = time.monotonic()
+        if deadline is not None and deadline <= now:
+            raise DeadlineExceededError('Срок запроса истек до постановки в очередь')
+
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            ADMISSION_QUEUE_WAIT_SECONDS.observe(0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise AdmissionRejectedError('Очередь запросов переполнена', 'queue_full')
+
+        timeout, deadline_first = self.max_queue_wait, False
+        if deadline is not None and deadline - now < timeout:
+            timeout, deadline_first = deadline - now, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # Отмененное ожидание мог уже выбросить из очереди _release
+            if future in self._waiters:
+                self._waiters.remove(future)
+            if deadline_first:
+                raise DeadlineExceededError('Срок запроса истек в очереди')
+            raise AdmissionRejectedError('Слишком долгое ожидание в очереди', 'queue_timeout')
+        except asyncio.CancelledError:
+            # Клиент ушел: если слот уже передан нам, возвращаем его следующему
+            if future in self._waiters:
+                self._waiters.remove(future)
+            elif future.done() and not future.cancelled():
+                self._release()
+            raise
+        finally:
+            ADMISSION_QUEUE_WAIT_SECONDS.observe(time.monotonic() - now)
+
+    def _release(self):
+        # Слот не освобождается, а переходит ожидающему: новый запрос не обгонит очередь
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+admission = AdmissionController()
+ADMISSION_IN_FLIGHT.set_function(lambda: admission.in_flight)
+ADMISSION_QUEUE_DEPTH.set_function(admission.queue_depth)
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable
+
+from workers import DeadlineExceededError, PoolOverloadedError
+
+
+class MicroBatcher:
+    """Собирает конкурентные запросы в батчи и прогоняет их через модель одним вызовом"""
+
+    def __init__(self, predict_batch: Callable[..., Awaitable[list[str]]],
+                 max_batch_size: int | None = None, max_wait_ms: float | None = None,
+                 max_concurrent_batches: int = 1, max_queued_batches: int | None = None,
+                 timeout: float | None = None):
+        self.predict_batch = predict_batch
+        self.max_concurrent_batches = max_concurrent_batches
+        self.max_batch_size = max_batch_size or int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 32))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5))
+        self.max_wait = max_wait_ms / 1000
+        # Очередь ограничена, как очередь пула: при переполнении запрос сразу получает PoolOverloadedError
+        self.max_queue = max_queued_batches * self.max_batch_size if max_queued_batches is not None else 0
+        # Полное время ответа, включая ожидание в очереди батчера, а не только прогон в пуле
+        self.timeout = timeout
+
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._in_flight: set[asyncio.Task] = set()
+
+    def _ensure_started(self):
+        """Запускает фоновую задачу сборки батчей в текущем event loop"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = asyncio.create_task(self._run())
+
+    async def predict(self, text: str, deadline: float | None = None) -> str:
+        """Ставит текст в очередь и ждет предсказание для него.
+
+        Текст, срок которого (deadline по time.monotonic) истек до сборки батча,
+        в модель не попадает: ожидающий получает DeadlineExceededError.
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((text, future, deadline))
+        except asyncio.QueueFull:
+            raise PoolOverloadedError('Очередь микробатчера переполнена')
+        if self.timeout is None:
+            return await future
+        # По таймауту future отменяется, и _process не включит текст в батч
+        return await asyncio.wait_for(future, self.timeout)
+
+    async def _collect(self) -> list[tuple[str, asyncio.Future, float | None]]:
+        """Ждет первый запрос, затем добирает батч до max_batch_size или до истечения max_wait"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Сначала забираем все, что уже лежит в очереди, без ожидания
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _process(self, batch: list[tuple[str, asyncio.Future, float | None]]):
+        """Прогоняет батч через модель и раздает результаты вызывающим"""
+        now = time.monotonic()
+        alive = []
+        for text, future, deadline in batch:
+            # Клиенты, которые уже отключились или чей срок истек, не должны занимать место в батче
+            if future.done():
+                continue
+            if deadline is not None and deadline <= now:
+                future.set_exception(DeadlineExceededError('Срок запроса истек до сборки батча'))
+                continue
+            alive.append((text, future, deadline))
+        batch = alive
+        if not batch:
+            return
+
+        texts = [text for text, _, _ in batch]
+        deadlines = [deadline for _, _, deadline in batch]
+        try:
+            if None in deadlines:
+                predictions = await self.predict_batch(texts)
+            else:
+                # Батч отбрасывается в пуле, только когда истек срок у всех его текстов
+                predictions = await self.predict_batch(texts, deadline=max(deadlines))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), prediction in zip(batch, predictions):
+            if not future.done():
+                future.set_result(prediction)
+
+    async def _run(self):
+        # Пока все слоты заняты, в очереди копится следующий батч
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._process(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._on_batch_done)
+
+    def _on_batch_done(self, task: asyncio.Task):
+        self._in_flight.discard(task)
+        self._slots.release()
+
+    async def close(self):
+        """Останавливает фоновую задачу и отменяет ожидающие запросы"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        for task in list(self._in_flight):
+            task.cancel()
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            future.cancel()
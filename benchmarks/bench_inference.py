@@ -0,0 +1,74 @@
+"""Микробенчмарки этапов Inference: нормализация, энкодер, прогон ONNX и весь predict_batch.
+
+Пример:
+    python benchmarks/bench_inference.py --batch-sizes 1 8 32 --repeats 50
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+os.chdir(ROOT)
+# Кэш отключен: измеряем сами этапы, а не попадания в него
+os.environ.setdefault('INFERENCE_CACHE_MODE', 'off')
+
+import numpy as np
+
+from benchmarks.common import latency_summary, load_texts, write_results
+from inference import Inference
+
+
+def measure(function, batches: list, warmup: int) -> list[float]:
+    for batch in batches[:warmup]:
+        function(batch)
+    timings = []
+    for batch in batches:
+        start = time.perf_counter()
+        function(batch)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_stage(function, batches: list, batch_size: int, warmup: int) -> dict:
+    timings = measure(function, batches, warmup)
+    return latency_summary(timings, total_seconds=sum(timings), items=batch_size * len(batches))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки этапов Inference')
+    parser.add_argument('--texts', default=None, help='JSONL с полем text; по умолчанию синтетические тексты')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--repeats', type=int, default=50, help='Батчей на каждый размер')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Файл JSON; по умолчанию benchmarks/results/')
+    args = parser.parse_args()
+
+    inference = Inference()
+    results = {}
+
+    for batch_size in args.batch_sizes:
+        texts = load_texts(args.texts, batch_size * args.repeats, seed=args.seed)
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        normalized = [inference.normalize_batch(batch) for batch in batches]
+        embeddings = [np.asarray(inference.encode(batch), dtype=np.float32) for batch in normalized]
+
+        stages = {
+            'normalize': run_stage(inference.normalize_batch, batches, batch_size, args.warmup),
+            'encode': run_stage(inference.encode, normalized, batch_size, args.warmup),
+            'onnx_run': run_stage(lambda batch: inference.NN.run(None, {'inputs': batch}), embeddings,
+                                  batch_size, args.warmup),
+            'predict_batch': run_stage(inference.predict_batch, batches, batch_size, args.warmup),
+        }
+        for stage, summary in stages.items():
+            results[f'{stage}/batch_{batch_size}'] = summary
+            print(f"{stage:>14} batch={batch_size:<4} p50={summary['p50_ms']:.3f} мс "
+                  f"p99={summary['p99_ms']:.3f} мс {summary['throughput']:.0f} текстов/с")
+
+    write_results('inference', vars(args), results, args.output)
+
+
+if __name__ == '__main__':
+    main()
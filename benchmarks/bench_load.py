@@ -0,0 +1,132 @@
+"""Нагрузочный бенчмарк приложения из run.py: пропускная способность и p50/p95/p99.
+
+По умолчанию поднимает uvicorn в этом же процессе с FakeClickHouse вместо
+базы, поэтому работает без сети. С --url нагружает уже запущенный сервер.
+
+Пример:
+    python benchmarks/bench_load.py --concurrency 1 8 32 --requests 2000
+"""
+import argparse
+import asyncio
+import collections
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+os.chdir(ROOT)
+
+import httpx
+
+from benchmarks.common import latency_summary, load_texts, write_results
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(insert_latency: float):
+    """Запускает run.app в фоновом потоке с поддельным ClickHouse"""
+    from benchmarks import fake_clickhouse
+    fake_clickhouse.install(insert_latency)
+    # Журнал логов бенчмарка не должен смешиваться с журналом сервиса
+    os.environ.setdefault('LOG_WAL_DIR', tempfile.mkdtemp(prefix='bench_wal_'))
+
+    import uvicorn
+    import run
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(run.app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{port}'
+    # Модель грузится в фоне после старта сервера: ждем готовности, а не только открытого порта
+    while not server.started or httpx.get(f'{url}/health/ready').status_code != 200:
+        if not thread.is_alive():
+            raise RuntimeError('Сервер не запустился')
+        time.sleep(0.05)
+    return server, thread, url
+
+
+async def run_load(url: str, endpoint: str, texts: list[str], concurrency: int, batch_size: int) -> dict:
+    """Держит concurrency одновременных запросов, пока не будут отправлены все тексты"""
+    path = '/predict' if endpoint == 'predict' else '/predict_batch'
+    if endpoint == 'predict':
+        payloads = [{'text': text} for text in texts]
+    else:
+        payloads = [{'texts': texts[i:i + batch_size]} for i in range(0, len(texts), batch_size)]
+
+    queue = collections.deque(payloads)
+    latencies, statuses = [], collections.Counter()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        async def worker():
+            while queue:
+                payload = queue.popleft()
+                start = time.perf_counter()
+                try:
+                    response = await client.post(path, json=payload)
+                    statuses[str(response.status_code)] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        total = time.perf_counter() - start
+
+    summary = latency_summary(latencies, total_seconds=total, items=len(texts))
+    summary['requests_per_second'] = len(payloads) / total
+    summary['statuses'] = dict(statuses)
+    summary['error_rate'] = 1 - statuses.get('200', 0) / len(payloads)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный бенчмарк FastAPI-приложения')
+    parser.add_argument('--url', default=None, help='Адрес запущенного сервера; по умолчанию поднимается локально')
+    parser.add_argument('--endpoint', choices=['predict', 'predict_batch'], default='predict')
+    parser.add_argument('--batch-size', type=int, default=16, help='Текстов в запросе для predict_batch')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=2000, help='Текстов на каждый уровень конкурентности')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--texts', default=None, help='JSONL с полем text; по умолчанию синтетические тексты')
+    parser.add_argument('--insert-latency-ms', type=float, default=0.0, help='Задержка вставки в FakeClickHouse')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Файл JSON; по умолчанию benchmarks/results/')
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server, thread, url = start_local_server(args.insert_latency_ms / 1000)
+
+    results = {}
+    try:
+        warmup = load_texts(args.texts, args.warmup, seed=args.seed + 1)
+        asyncio.run(run_load(url, args.endpoint, warmup, 4, args.batch_size))
+
+        for concurrency in args.concurrency:
+            texts = load_texts(args.texts, args.requests, seed=args.seed)
+            summary = asyncio.run(run_load(url, args.endpoint, texts, concurrency, args.batch_size))
+            results[f'{args.endpoint}/concurrency_{concurrency}'] = summary
+            print(f"{args.endpoint} c={concurrency:<4} {summary['throughput']:.0f} текстов/с "
+                  f"p50={summary['p50_ms']:.2f} p95={summary['p95_ms']:.2f} p99={summary['p99_ms']:.2f} мс "
+                  f"ошибки={summary['error_rate']:.2%}")
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join(timeout=30)
+
+    write_results('load', vars(args), results, args.output)
+
+
+if __name__ == '__main__':
+    main()
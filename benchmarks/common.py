@@ -0,0 +1,94 @@
+"""Общие части бенчмарков: тексты, перцентили и запись результатов в JSON"""
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+WORDS = [
+    'i', 'feel', 'so', 'really', 'today', 'happy', 'sad', 'angry', 'afraid', 'scared', 'lonely', 'love',
+    'the', 'day', 'was', 'not', 'what', 'will', 'happen', 'tomorrow', 'about', 'my', 'friends', 'work',
+    "i'm", "don't", "can't", 'it', 'and', 'but', 'just', 'know', 'anymore', 'like', 'this', 'that',
+]
+NOISE = ['!', '?', '...', ',', 'http://t.co/abc', '42', '`', '😊']
+
+
+def generate_texts(count: int, median_words: float = 14, sigma: float = 0.7, seed: int = 0) -> list[str]:
+    """Синтетические тексты с логнормальным распределением длины, как у коротких постов"""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        length = max(1, min(int(rng.lognormvariate(np.log(median_words), sigma)), 300))
+        tokens = [rng.choice(NOISE) if rng.random() < 0.05 else rng.choice(WORDS) for _ in range(length)]
+        texts.append(' '.join(tokens))
+    return texts
+
+
+def read_texts(path: str) -> list[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)['text'] for line in f if line.strip()]
+
+
+def load_texts(path: str | None, count: int, seed: int = 0) -> list[str]:
+    if path is None:
+        return generate_texts(count, seed=seed)
+    texts = read_texts(path)
+    return [texts[i % len(texts)] for i in range(count)]
+
+
+def latency_summary(seconds: list[float], total_seconds: float | None = None, items: int | None = None) -> dict:
+    """Перцентили в миллисекундах и пропускная способность (элементов в секунду)"""
+    values = np.asarray(seconds, dtype=np.float64) * 1000
+    summary = {
+        'count': int(values.size),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max()),
+    }
+    if total_seconds:
+        summary['throughput'] = (items if items is not None else values.size) / total_seconds
+    return summary
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(benchmark: str, args: dict) -> dict:
+    return {
+        'benchmark': benchmark,
+        'commit': git_commit(),
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': args,
+        # Настройки сервиса влияют на результат не меньше кода
+        'env': {key: value for key, value in sorted(os.environ.items())
+                if key.startswith(('INFERENCE_', 'LOG_SHIPPER_', 'OMP_'))},
+    }
+
+
+def write_results(benchmark: str, args: dict, results: dict, output: str | None) -> str:
+    meta = metadata(benchmark, args)
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = (meta['commit'] or 'nocommit')[:12]
+        output = os.path.join(RESULTS_DIR, f'{benchmark}-{commit}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результаты сохранены в: {output}")
+    return output
@@ -0,0 +1,75 @@
+"""Сравнение двух JSON с результатами бенчмарков и проверка на регрессию.
+
+Метрики *_ms сравниваются как "меньше — лучше", throughput и
+requests_per_second — как "больше — лучше". Код выхода 1, если хотя бы одна
+метрика хуже базовой больше чем на --threshold.
+
+Пример:
+    python benchmarks/compare.py results/load-base.json results/load-new.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+
+HIGHER_IS_BETTER = ('throughput', 'requests_per_second')
+
+
+def lower_is_better(metric: str) -> bool:
+    # Любая задержка (p50_ms, mean_ms, max_ms, ...) растет при регрессии
+    return metric.endswith('_ms')
+
+
+def load(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(baseline: dict, candidate: dict, threshold: float, metrics: list[str]) -> list[dict]:
+    rows = []
+    for case, base_values in baseline['results'].items():
+        new_values = candidate['results'].get(case)
+        if new_values is None:
+            continue
+        for metric in metrics:
+            if metric not in base_values or metric not in new_values or not base_values[metric]:
+                continue
+            change = new_values[metric] / base_values[metric] - 1
+            # Для "больше — лучше" регрессия — это падение значения
+            regression = change > threshold if lower_is_better(metric) else -change > threshold
+            rows.append({
+                'case': case,
+                'metric': metric,
+                'baseline': base_values[metric],
+                'candidate': new_values[metric],
+                'change': change,
+                'regression': regression,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение результатов бенчмарков')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Допустимое ухудшение, доля')
+    parser.add_argument('--metrics', nargs='+', default=['p50_ms', 'p95_ms', 'p99_ms', 'throughput'])
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    rows = compare(baseline, candidate, args.threshold, args.metrics)
+
+    print(f"Базовый коммит: {baseline['meta'].get('commit')}, новый: {candidate['meta'].get('commit')}")
+    for row in rows:
+        mark = '❌' if row['regression'] else '✅'
+        print(f"{mark} {row['case']:<32} {row['metric']:<12} {row['baseline']:>12.3f} -> "
+              f"{row['candidate']:>12.3f} ({row['change']:+.1%})")
+
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print(f"❌ Регрессий: {len(regressions)} (порог {args.threshold:.0%})")
+        sys.exit(1)
+    print("✅ Регрессий нет")
+
+
+if __name__ == '__main__':
+    main()
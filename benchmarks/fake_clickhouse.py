@@ -0,0 +1,47 @@
+"""Замена database.ClickHouse внутри процесса, чтобы бенчмарки работали без сервера"""
+import asyncio
+import threading
+import time
+from typing import Any
+
+import database.database
+
+
+class FakeClickHouse:
+    """Принимает вставки в память, опционально с задержкой, как у сетевого вызова"""
+
+    insert_latency = 0.0
+
+    def __init__(self, create_tables_on_init: bool = True, connect_on_init: bool = True):
+        self.database_name = 'benchmark'
+        self.rows: list[list[Any]] = []
+        self.inserts = 0
+        self._lock = threading.Lock()
+
+    def prepare(self) -> bool:
+        return True
+
+    def create_tables(self) -> bool:
+        return True
+
+    def insert_data(self, table_name: str, columns: list[str], data_rows: list[list[Any]]):
+        if self.insert_latency:
+            time.sleep(self.insert_latency)
+        with self._lock:
+            self.rows.extend(data_rows)
+            self.inserts += 1
+
+    async def async_insert_data(self, table_name: str, columns: list[str], data_rows: list[list[Any]]):
+        await asyncio.to_thread(self.insert_data, table_name, columns, data_rows)
+
+    def execute_query(self, sql_query: str, parameters: dict = None):
+        return None
+
+    async def async_execute_query(self, sql_query: str, parameters: dict = None):
+        return None
+
+
+def install(insert_latency: float = 0.0):
+    """Подменяет ClickHouse; вызывать до импорта run, routers и database.logger"""
+    FakeClickHouse.insert_latency = insert_latency
+    database.database.ClickHouse = FakeClickHouse
@@ -0,0 +1,97 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+def _default_sizeof(value: Any) -> int:
+    # У numpy-массивов берем размер буфера, у остального — размер объекта
+    nbytes = getattr(value, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш с ограничением по числу записей, объему памяти и опциональным TTL"""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int | None = None, ttl: float | None = None,
+                 sizeof: Callable[[Any], int] = _default_sizeof):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+
+        # key -> (value, size, expires_at)
+        self._data: OrderedDict[Hashable, tuple[Any, int, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            value, size, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Вытесняет самые давно использованные записи, пока кэш не влезет в лимиты"""
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            _, (_, size, _) = self._data.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, int | float]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / requests if requests else 0.0,
+            }
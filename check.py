@@ -1,7 +1,14 @@
-import pickle
-with open('logs.pickle', 'rb') as f:
-    logs_data = pickle.load(f)
+import os
+import sys
 
-print(f"Всего записей в логах: {len(logs_data)}")
-for i, log in enumerate(logs_data):
-    print(f"Запись {i+1}: {log}")
\ No newline at end of file
+from database.wal import read_records
+
+# Читаем журнал потоково, не загружая все записи в память
+wal_directory = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('LOG_WAL_DIR', 'logs_wal')
+
+total = 0
+for segment_id, log in read_records(wal_directory):
+    total += 1
+    print(f"Запись {total} (сегмент {segment_id}): {log}")
+
+print(f"Всего записей в логах: {total}")
\ No newline at end of file
@@ -24,13 +24,21 @@ class Entity(ABC, Enum, metaclass=AutoRegisterMeta):
     def get_concrete_classes(cls):
         return cls._registered_classes
 
+    @classmethod
+    def column_definitions(cls) -> dict[str, str]:
+        """Объявленные столбцы: имя -> тип вместе с CODEC"""
+        return {
+            attribute_name: attribute_type
+            for attribute_name, attribute_type in cls.__dict__.items()
+            if not attribute_name.startswith("_")
+        }
+
     @classmethod
     def generate_create_table_schema(cls):
         column_definitions = []
         
-        for attribute_name, attribute_type in cls.__dict__.items():
-            if not attribute_name.startswith("_"):
-                column_definitions.append(f'{attribute_name} {attribute_type}')
+        for attribute_name, attribute_type in cls.column_definitions().items():
+            column_definitions.append(f'{attribute_name} {attribute_type}')
         
         columns_sql = ', '.join(column_definitions)
         return f'({columns_sql})'
@@ -42,4 +50,99 @@ class Entity(ABC, Enum, metaclass=AutoRegisterMeta):
 
     @staticmethod
     def _engine():
-        return "MergeTree"
\ No newline at end of file
+        return "MergeTree"
+
+    @staticmethod
+    def _partition_by():
+        """Выражение PARTITION BY, например toYYYYMM(datetime); None — без партиций"""
+        return None
+
+    @staticmethod
+    def _ttl():
+        """Выражение TTL для удаления старых строк; None — хранить всегда"""
+        return None
+
+    @staticmethod
+    def _settings():
+        """SETTINGS движка, например index_granularity = 8192; None — по умолчанию"""
+        return None
+
+    @classmethod
+    def generate_create_table_sql(cls):
+        """Полный CREATE TABLE: единственный источник DDL для таблицы сущности.
+
+        Части идут в порядке, который требует ClickHouse:
+        ENGINE, PARTITION BY, ORDER BY (из _after_engine), TTL, SETTINGS.
+        """
+        parts = [
+            f'CREATE TABLE IF NOT EXISTS `{cls.__name__}` {cls.generate_create_table_schema()}',
+            f'ENGINE = {cls._engine()}',
+        ]
+        if cls._partition_by():
+            parts.append(f'PARTITION BY {cls._partition_by()}')
+        parts.append(cls._after_engine())
+        if cls._ttl():
+            parts.append(f'TTL {cls._ttl()}')
+        if cls._settings():
+            parts.append(f'SETTINGS {cls._settings()}')
+        return ' '.join(parts)
+
+    @classmethod
+    def generate_modify_column_sql(cls, column: str):
+        """ALTER, который приводит тип и CODEC существующего столбца к объявленным"""
+        return f'ALTER TABLE `{cls.__name__}` MODIFY COLUMN {column} {cls.column_definitions()[column]}'
+
+    @classmethod
+    def generate_add_column_sql(cls, column: str):
+        return f'ALTER TABLE `{cls.__name__}` ADD COLUMN {column} {cls.column_definitions()[column]}'
+
+    @classmethod
+    def generate_modify_settings_sql(cls):
+        return f'ALTER TABLE `{cls.__name__}` MODIFY SETTING {cls._settings()}'
+
+    @classmethod
+    def generate_modify_ttl_sql(cls):
+        """ALTER, который приводит TTL существующей таблицы к _ttl()"""
+        if cls._ttl():
+            return f'ALTER TABLE `{cls.__name__}` MODIFY TTL {cls._ttl()}'
+        return f'ALTER TABLE `{cls.__name__}` REMOVE TTL'
+
+    @staticmethod
+    def _source_table():
+        """Таблица, из которой материализованное представление наполняет эту таблицу"""
+        return None
+
+    @staticmethod
+    def _source_query():
+        """SELECT для материализованного представления; {source} заменяется на _source_table().
+
+        None — обычная таблица без представления.
+        """
+        return None
+
+    @classmethod
+    def view_name(cls):
+        return f'{cls.__name__}_mv'
+
+    @classmethod
+    def generate_create_view_sql(cls):
+        source_query = cls._source_query()
+        if source_query is None:
+            return None
+
+        select_sql = source_query.format(source=f'`{cls._source_table()}`')
+        return (
+            f'CREATE MATERIALIZED VIEW `{cls.view_name()}` '
+            f'TO `{cls.__name__}` AS {select_sql}'
+        )
+
+    @classmethod
+    def generate_backfill_cutoff_sql(cls):
+        """Граница досчета из самих данных: последний datetime в источнике"""
+        return f'SELECT toString(max(datetime)) FROM `{cls._source_table()}`'
+
+    @classmethod
+    def generate_backfill_sql(cls, cutoff: str):
+        """INSERT, который досчитывает таблицу по строкам источника с datetime не позже cutoff"""
+        source = f"(SELECT * FROM `{cls._source_table()}` WHERE datetime <= '{cutoff}')"
+        return f'INSERT INTO `{cls.__name__}` {cls._source_query().format(source=source)}'
\ No newline at end of file
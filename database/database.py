@@ -1,17 +1,118 @@
+import asyncio
 import os
+import queue
+import re
 import threading
-from typing import Any
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
 from database.Entity import Entity
+import database.model_logs  # noqa: F401 — регистрирует сущности ModelLogs
 import clickhouse_connect
+from clickhouse_connect.driver.client import Client
+from clickhouse_connect.driver.exceptions import DatabaseError
 from dotenv import load_dotenv
 
 
+def _normalize_sql(fragment: str | None) -> str:
+    """Фрагмент DDL без пробелов: system.columns и объявления форматируют их по-разному"""
+    return re.sub(r'\s+', '', fragment or '')
+
+
+def _table_ttl(create_query: str) -> str | None:
+    """Выражение TTL из create_table_query таблицы"""
+    match = re.search(r'\sTTL\s(.+?)(?:\sSETTINGS\s|$)', create_query)
+    return match.group(1) if match else None
+
+
+def _normalize_ttl(ttl: str | None) -> str:
+    # ClickHouse хранит INTERVAL 30 DAY как toIntervalDay(30) и опускает DELETE по умолчанию
+    ttl = re.sub(r'INTERVAL\s+(\d+)\s+(\w+)',
+                 lambda m: f'toInterval{m.group(2).capitalize()}({m.group(1)})', ttl or '')
+    return _normalize_sql(re.sub(r'\s+DELETE$', '', ttl))
+
+
+class ConnectionPool:
+    """Пул клиентов clickhouse_connect с проверкой соединений.
+
+    Клиенты создаются лениво до size штук. Клиент, простоявший дольше
+    health_check_interval, перед выдачей проверяется через ping(); клиент,
+    на котором запрос упал, закрывается и заменяется новым.
+    """
+
+    def __init__(self, connect_kwargs: dict[str, Any], size: int, health_check_interval: float, timeout: float):
+        self.connect_kwargs = connect_kwargs
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+
+        # (клиент, время последнего использования); LIFO держит горячими последние клиенты
+        self._idle: queue.LifoQueue[tuple[Client, float]] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _create_client(self) -> Client:
+        # Без сессии: ClickHouse не запрещает параллельные запросы разных клиентов
+        return clickhouse_connect.get_client(autogenerate_session_id=False, **self.connect_kwargs)
+
+    def _checkout(self) -> Client:
+        while True:
+            try:
+                client, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._create_client()
+
+            if time.monotonic() - last_used < self.health_check_interval:
+                return client
+            try:
+                if client.ping():
+                    return client
+            except Exception:
+                pass
+            self._discard(client)
+
+    @staticmethod
+    def _discard(client: Client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self) -> Iterator[Client]:
+        """Выдает клиента из пула на время запроса"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError('Нет свободных соединений с ClickHouse')
+        client = None
+        try:
+            client = self._checkout()
+            yield client
+        except Exception:
+            if client is not None:
+                self._discard(client)
+                client = None
+            raise
+        finally:
+            if client is not None:
+                self._idle.put((client, time.monotonic()))
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                client, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(client)
+
+
 class ClickHouse:
     """Клиент для работы с базой данных ClickHouse"""
-    
-    _query_lock = threading.Lock()
 
-    def __init__(self, create_tables_on_init: bool = True):
+    # Пулы общие для всех экземпляров с одинаковыми параметрами подключения
+    _pools: dict[tuple, ConnectionPool] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, create_tables_on_init: bool = True, connect_on_init: bool = True):
         load_dotenv()
 
         self.host = os.environ.get('CLICKHOUSE_HOST', 'localhost')
@@ -19,24 +120,52 @@ class ClickHouse:
         self.username = os.environ.get('CLICKHOUSE_USERNAME', 'default')
         self.password = os.environ.get('CLICKHOUSE_PASSWORD', '')
         self.database_name = os.environ.get('CLICKHOUSE_DATABASE', 'default')
-        
-        # Создаем базу данных если нужно
-        self._create_database_if_missing()
-        
-        # Подключаемся к базе данных
-        self.db_client = clickhouse_connect.get_client(
-            host=self.host,
-            port=self.port,
-            username=self.username,
-            password=self.password,
-            database=self.database_name
-        )
+
+        self._pool, created = self._get_pool()
+
+        # Без connect_on_init конструктор не ходит в сеть: подключение и схему делает prepare()
+        if not connect_on_init:
+            return
+
+        # База создается один раз на пул, а не при каждом создании клиента
+        if created:
+            self._create_database_if_missing()
 
         if create_tables_on_init:
             self.create_tables()
 
-    def _create_database_if_missing(self):
-        """Создает базу данных и таблицу если они не существуют"""
+    def prepare(self) -> bool:
+        """Создает базу и таблицы; False, если ClickHouse недоступен"""
+        return self._create_database_if_missing() and self.create_tables()
+
+    def _get_pool(self) -> tuple[ConnectionPool, bool]:
+        key = (self.host, self.port, self.username, self.database_name)
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is not None:
+                return pool, False
+
+            pool = ConnectionPool(
+                connect_kwargs=dict(
+                    host=self.host,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    database=self.database_name
+                ),
+                size=int(os.environ.get('CLICKHOUSE_POOL_SIZE', 8)),
+                health_check_interval=float(os.environ.get('CLICKHOUSE_HEALTH_CHECK_INTERVAL_S', 30)),
+                timeout=float(os.environ.get('CLICKHOUSE_POOL_TIMEOUT_S', 10))
+            )
+            self._pools[key] = pool
+            return pool, True
+
+    def connection(self):
+        """Контекстный менеджер с клиентом из общего пула"""
+        return self._pool.connection()
+
+    def _create_database_if_missing(self) -> bool:
+        """Создает базу данных если она не существует; таблицы создает create_tables()"""
         try:
             temp_client = clickhouse_connect.get_client(
                 host=self.host,
@@ -49,22 +178,11 @@ class ClickHouse:
             temp_client.command(f'CREATE DATABASE IF NOT EXISTS `{self.database_name}`')
             print(f"✅ База данных '{self.database_name}' создана или уже существует")
             
-            # Создаем таблицу ModelLogs если не существует
-            create_table_sql = f"""
-            CREATE TABLE IF NOT EXISTS `{self.database_name}`.`ModelLogs`
-            (
-                predicted_tip String,
-                words_count Int32,
-                datetime DateTime
-            ) ENGINE = MergeTree()
-            ORDER BY datetime
-            """
-            temp_client.command(create_table_sql)
-            print(f"✅ Таблица '{self.database_name}.ModelLogs' создана или уже существует")
-            
             temp_client.close()
+            return True
         except Exception as e:
-            print(f"❌ Ошибка при создании базы данных/таблицы: {e}")
+            print(f"❌ Ошибка при создании базы данных: {e}")
+            return False
 
     @staticmethod
     def sanitize_sql_value(input_value: Any) -> str:
@@ -80,32 +198,118 @@ class ClickHouse:
         )
         return safe_value
 
-    def create_tables(self):
+    def create_tables(self) -> bool:
         """Создает все таблицы на основе моделей Entity"""
         try:
             entity_classes = Entity.get_concrete_classes()
 
             for entity_class in entity_classes:
-                table_schema = entity_class.generate_create_table_schema()
-                table_engine = entity_class._engine()
-                table_options = entity_class._after_engine()
-
-                create_table_sql = (
-                    f'CREATE TABLE IF NOT EXISTS `{entity_class.__name__}` '
-                    f'{table_schema} ENGINE {table_engine} {table_options}'
-                )
-                
-                self.db_client.command(create_table_sql)
+                with self.connection() as client:
+                    client.command(entity_class.generate_create_table_sql())
                 print(f"✅ Таблица '{entity_class.__name__}' создана")
+                self._check_schema(entity_class)
+
+            # Представления создаются после всех таблиц: им нужны и источник, и целевая таблица
+            for entity_class in entity_classes:
+                self._create_materialized_view(entity_class)
+            return True
         except Exception as e:
             print(f"❌ Ошибка при создании таблиц: {e}")
+            return False
+
+    def _check_schema(self, entity_class):
+        """Сверяет существующую таблицу с сущностью.
+
+        CREATE TABLE IF NOT EXISTS не трогает уже созданную таблицу, поэтому новые
+        типы, CODEC и TTL до нее сами не доходят. С CLICKHOUSE_MIGRATE=1 расхождения
+        столбцов и TTL исправляются через ALTER (данные переписываются мутацией в фоне),
+        иначе только печатаются нужные команды. PARTITION BY через ALTER не меняется:
+        создайте таблицу с новым ключом под временным именем, перелейте данные
+        (INSERT INTO new SELECT * FROM old) и поменяйте таблицы местами через
+        EXCHANGE TABLES, после чего удалите старую.
+        """
+        table_name = entity_class.__name__
+        migrate = os.environ.get('CLICKHOUSE_MIGRATE', '0') == '1'
+        parameters = {'table': table_name}
+        with self.connection() as client:
+            existing = {
+                name: _normalize_sql(f'{column_type} {codec}')
+                for name, column_type, codec in client.query(
+                    'SELECT name, type, compression_codec FROM system.columns '
+                    'WHERE database = currentDatabase() AND table = {table:String}',
+                    parameters=parameters
+                ).result_rows
+            }
+            partition_key, create_query = client.query(
+                'SELECT partition_key, create_table_query FROM system.tables '
+                'WHERE database = currentDatabase() AND name = {table:String}',
+                parameters=parameters
+            ).result_rows[0]
+
+            statements = []
+            for name, definition in entity_class.column_definitions().items():
+                if name not in existing:
+                    statements.append(entity_class.generate_add_column_sql(name))
+                elif existing[name] != _normalize_sql(definition):
+                    statements.append(entity_class.generate_modify_column_sql(name))
+            if _normalize_ttl(_table_ttl(create_query)) != _normalize_ttl(entity_class._ttl()):
+                statements.append(entity_class.generate_modify_ttl_sql())
+            # Настройки, которые таблица получила при создании, ClickHouse перечисляет в SETTINGS
+            if entity_class._settings() and not all(
+                _normalize_sql(setting) in _normalize_sql(create_query)
+                for setting in entity_class._settings().split(',')
+            ):
+                statements.append(entity_class.generate_modify_settings_sql())
+
+            for statement in statements:
+                if not migrate:
+                    print(f"❌ Схема '{table_name}' устарела, выполните или включите CLICKHOUSE_MIGRATE=1: {statement}")
+                    continue
+                try:
+                    client.command(statement)
+                    print(f"✅ Схема '{table_name}' обновлена: {statement}")
+                except Exception as e:
+                    # Логи пишутся и в старую схему: неудачная миграция не мешает запуску
+                    print(f"❌ Не удалось обновить схему '{table_name}': {statement}: {e}")
+
+        if _normalize_sql(partition_key) != _normalize_sql(entity_class._partition_by()):
+            print(f"❌ PARTITION BY '{table_name}' ({partition_key or 'нет'}) не совпадает с "
+                  f"{entity_class._partition_by() or 'нет'}: нужна перезаливка таблицы, см. ClickHouse._check_schema")
+
+    def _create_materialized_view(self, entity_class):
+        """Создает материализованное представление для rollup-таблицы и досчитывает старые строки"""
+        create_view_sql = entity_class.generate_create_view_sql()
+        if create_view_sql is None:
+            return
+
+        with self.connection() as client:
+            # Представление создается без IF NOT EXISTS: prefork-воркеры готовят схему
+            # одновременно, и досчет должен выполнить только тот процесс, чей CREATE
+            # действительно создал представление. Остальные получат TABLE_ALREADY_EXISTS
+            try:
+                client.command(create_view_sql)
+            except DatabaseError as e:
+                if 'TABLE_ALREADY_EXISTS' not in str(e):
+                    raise
+                return
+
+            # Сначала представление: все, что вставлено после него, оно посчитает само.
+            # Граница досчета берется из данных, а не из часов сервера или клиента:
+            # каждая строка, вставленная до представления, имеет datetime не позже нее.
+            # Строки с datetime не позже границы, вставленные в доли секунды между
+            # созданием представления и INSERT ... SELECT, посчитаются дважды; для точных
+            # агрегатов при первом запуске остановите запись логов на время миграции
+            cutoff = client.command(entity_class.generate_backfill_cutoff_sql())
+            client.command(entity_class.generate_backfill_sql(cutoff))
+        print(f"✅ Представление '{entity_class.view_name()}' создано")
 
     def insert_data(self, table_name: str, columns: list[str], data_rows: list[list[Any]]):
         """Вставляет данные в указанную таблицу"""
         try:
             # Добавляем имя базы данных к имени таблицы
             full_table_name = f"`{self.database_name}`.`{table_name}`"
-            self.db_client.insert(full_table_name, data_rows, column_names=columns)
+            with self.connection() as client:
+                client.insert(full_table_name, data_rows, column_names=columns)
             print(f"✅ Данные вставлены в таблицу {full_table_name}")
         except Exception as e:
             print(f"❌ Ошибка при вставке данных: {e}")
@@ -113,11 +317,17 @@ class ClickHouse:
 
     def execute_query(self, sql_query: str, parameters: dict = None) -> Any:
         """Выполняет SQL запрос и возвращает результат"""
-        with self._query_lock:
-            try:
-                
-                query_result = self.db_client.query_df(sql_query, parameters)
-                return query_result
-            except Exception as e:
-                print(f"❌ Ошибка при выполнении запроса: {e}")
-                return None
\ No newline at end of file
+        try:
+            with self.connection() as client:
+                return client.query_df(sql_query, parameters)
+        except Exception as e:
+            print(f"❌ Ошибка при выполнении запроса: {e}")
+            return None
+
+    async def async_insert_data(self, table_name: str, columns: list[str], data_rows: list[list[Any]]):
+        """Асинхронная вставка: блокирующий вызов выполняется в отдельном потоке"""
+        await asyncio.to_thread(self.insert_data, table_name, columns, data_rows)
+
+    async def async_execute_query(self, sql_query: str, parameters: dict = None) -> Any:
+        """Асинхронный запрос для FastAPI и async-колбэков Dash"""
+        return await asyncio.to_thread(self.execute_query, sql_query, parameters)
\ No newline at end of file
@@ -0,0 +1,250 @@
+import asyncio
+import itertools
+import os
+from typing import Any, Callable, Iterator
+
+from database.database import ClickHouse
+from database.wal import SegmentedLog
+from metrics import CLICKHOUSE_INSERT_BATCH_SIZE, CLICKHOUSE_INSERT_FAILURES, CLICKHOUSE_INSERT_SECONDS
+
+
+# Элемент очереди: [номер сегмента журнала, запись]; номер None, пока запись не дописана в журнал
+Entry = list[Any]
+
+
+class LogShipper:
+    """Фоновая отправка логов предсказаний в ClickHouse пачками.
+
+    Обработчик запроса только кладет запись в ограниченную очередь. В журнал
+    (SegmentedLog) записи дописываются пачками вне event loop, вставка в базу
+    идет в фоновой задаче: по размеру
+    пачки или по интервалу, с повторами и экспоненциальной задержкой.
+    Доставленные записи подтверждаются в журнале, недоставленные после
+    перезапуска читаются из него заново.
+    """
+
+    def __init__(self, database: ClickHouse | None, table_name: str, columns: list[str],
+                 batch_size: int | None = None, flush_interval: float | None = None,
+                 queue_size: int | None = None, overflow_policy: str | None = None,
+                 max_retries: int | None = None, backoff: float | None = None,
+                 wal: SegmentedLog | None = None, wal_factory: Callable[[], SegmentedLog] | None = None):
+        self.database = database
+        self.table_name = table_name
+        self.columns = columns
+        self.batch_size = batch_size or int(os.environ.get('LOG_SHIPPER_BATCH_SIZE', 500))
+        self.flush_interval = flush_interval or float(os.environ.get('LOG_SHIPPER_FLUSH_INTERVAL_S', 1.0))
+        self.queue_size = queue_size or int(os.environ.get('LOG_SHIPPER_QUEUE_SIZE', 10000))
+        # drop — отбрасывать новые записи при переполнении, block — ждать места в очереди
+        self.overflow_policy = overflow_policy or os.environ.get('LOG_SHIPPER_OVERFLOW', 'drop')
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('LOG_SHIPPER_MAX_RETRIES', 5))
+        self.backoff = backoff or float(os.environ.get('LOG_SHIPPER_BACKOFF_S', 0.5))
+        # Общий срок досылки при остановке: то, что не успело уйти, остается в журнале
+        self.stop_timeout = float(os.environ.get('LOG_SHIPPER_STOP_TIMEOUT_S', 10.0))
+        self.wal = wal
+        # Журнал, который открывается в start(): в serve.py у каждого воркера свой каталог
+        self.wal_factory = wal_factory
+
+        if self.overflow_policy not in ('drop', 'block'):
+            raise ValueError(f"Неизвестная политика переполнения: {self.overflow_policy}")
+
+        # Элементы очереди: (номер сегмента журнала, запись)
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        # Пачка, которую фоновая задача собирает прямо сейчас, и идущая вставка:
+        # при остановке их нельзя потерять или вставить дважды
+        self._collecting: list[Entry] = []
+        self._flushing: asyncio.Task | None = None
+        # Записи из журнала прошлого запуска и пачки, которые не удалось вставить
+        self._replay: Iterator[tuple[int, list[Any]]] = iter(())
+        self._backlog: list[Entry] = []
+        # Записи, которые еще не дописаны в журнал, и задача, которая их дописывает
+        self._unlogged: list[Entry] = []
+        self._logging: asyncio.Task | None = None
+        # После stop() записи не принимаются: журнал закрыт
+        self._stopped = False
+
+        self.shipped = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+    def pending(self) -> int:
+        """Записи, ожидающие отправки: очередь и недоставленные пачки"""
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + len(self._collecting) + len(self._backlog)
+
+    async def start(self):
+        if self._worker is not None:
+            if not self._worker.done():
+                return
+            # Фоновая задача упала: перезапускаем ее с той же очередью, собранной пачкой
+            # и журналом, иначе уже принятые записи потеряются или уйдут дважды
+            if not self._worker.cancelled() and self._worker.exception() is not None:
+                print(f"❌ Фоновая отправка логов остановилась с ошибкой: {self._worker.exception()}")
+            self._worker = asyncio.create_task(self._run())
+            return
+        self._stopped = False
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        if self.wal is None and self.wal_factory is not None:
+            self.wal = self.wal_factory()
+        if self.wal is not None:
+            self._replay = self.wal.replay()
+        self._worker = asyncio.create_task(self._run())
+
+    async def enqueue(self, record: list[Any]) -> bool:
+        """Кладет запись в очередь отправки. Возвращает False, если запись отброшена"""
+        if self._stopped:
+            return False
+        await self.start()
+        if self.overflow_policy == 'drop' and self._queue.full():
+            self.dropped += 1
+            return False
+        entry = [None, record]
+        self._log(entry)
+        if self.overflow_policy == 'block':
+            await self._queue.put(entry)
+        else:
+            self._queue.put_nowait(entry)
+        return True
+
+    def _log(self, entry: Entry):
+        # Дозапись в журнал идет в фоне пачками: файловый ввод-вывод не блокирует event loop
+        if self.wal is None:
+            return
+        self._unlogged.append(entry)
+        if self._logging is None or self._logging.done():
+            self._logging = asyncio.create_task(self._write_log())
+
+    async def _write_log(self):
+        """Дописывает накопленные записи в журнал без fsync: на диск он сбрасывается перед вставкой"""
+        loop = asyncio.get_running_loop()
+        while self._unlogged:
+            entries, self._unlogged = self._unlogged, []
+            try:
+                segment_ids = await loop.run_in_executor(None, self.wal.append_many, [record for _, record in entries])
+            except Exception as e:
+                # Записи все равно уйдут в базу из памяти, но перезапуск они не переживут
+                print(f"❌ Не удалось дописать {len(entries)} записей в журнал: {e}")
+                continue
+            for entry, segment_id in zip(entries, segment_ids):
+                entry[0] = segment_id
+
+    async def _wait_logged(self):
+        # Пачку можно вставлять и подтверждать, только когда ее записи уже в журнале
+        if self._logging is not None:
+            await asyncio.shield(self._logging)
+
+    def _take_pending(self, limit: int) -> list[Entry]:
+        """Забирает до limit записей из недоставленных пачек и журнала прошлого запуска"""
+        taken = self._backlog[:limit]
+        del self._backlog[:limit]
+        if len(taken) < limit:
+            taken.extend(itertools.islice(self._replay, limit - len(taken)))
+        return taken
+
+    async def _collect(self) -> list[Entry]:
+        """Ждет первую запись и добирает пачку до batch_size или до истечения flush_interval"""
+        loop = asyncio.get_running_loop()
+        batch = self._collecting
+        batch.extend(self._take_pending(self.batch_size))
+        if not batch:
+            batch.append(await self._queue.get())
+        deadline = loop.time() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        self._collecting = []
+        return batch
+
+    async def _insert(self, batch: list[Entry]):
+        # База подключается в фоне: до этого пачка идет по обычному пути повторов
+        if self.database is None:
+            raise ConnectionError('ClickHouse еще не подключен')
+        records = [record for _, record in batch]
+        CLICKHOUSE_INSERT_BATCH_SIZE.observe(len(records))
+        with CLICKHOUSE_INSERT_SECONDS.time():
+            await self.database.async_insert_data(self.table_name, self.columns, records)
+
+    async def _flush(self, batch: list[Entry]) -> bool:
+        """Вставляет пачку с повторами, при неудаче оставляет ее в журнале до следующей попытки"""
+        loop = asyncio.get_running_loop()
+        if self.wal is not None:
+            await self._wait_logged()
+            try:
+                await loop.run_in_executor(None, self.wal.sync)
+            except Exception as e:
+                print(f"❌ Не удалось сбросить журнал на диск: {e}")
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._insert(batch)
+                self.shipped += len(batch)
+                if self.wal is not None:
+                    # Записи, которые не удалось дописать в журнал, подтверждать нечего
+                    self.wal.confirm([segment_id for segment_id, _ in batch if segment_id is not None])
+                return True
+            except Exception as e:
+                CLICKHOUSE_INSERT_FAILURES.inc()
+                if attempt == self.max_retries:
+                    print(f"❌ Не удалось вставить {len(batch)} записей после {attempt + 1} попыток: {e}")
+                    break
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+        self.failed_batches += 1
+        # Записи остаются в журнале неподтвержденными; в памяти держим не больше queue_size,
+        # остальное дочитается из журнала после перезапуска
+        self._backlog.extend(batch[:max(self.queue_size - len(self._backlog), 0)])
+        return False
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            self._flushing = asyncio.create_task(self._flush(batch))
+            await asyncio.shield(self._flushing)
+
+    async def _drain(self, remaining: list[Entry]):
+        if self._flushing is not None and not self._flushing.done():
+            await self._flushing
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def stop(self):
+        """Останавливает фоновую задачу и отправляет все, что осталось в очереди"""
+        if self._worker is None:
+            return
+        self._stopped = True
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        remaining, self._collecting = self._collecting, []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+
+        # Каждая пачка повторяется с задержками десятки секунд; при недоступной базе
+        # остановка не должна ждать их все, недоставленное дочитается из журнала
+        try:
+            await asyncio.wait_for(self._drain(remaining), self.stop_timeout)
+        except asyncio.TimeoutError:
+            print(f"❌ Досылка логов не уложилась в {self.stop_timeout} с, остаток остается в журнале")
+
+        # Недоставленное остается в журнале и будет прочитано при следующем запуске
+        await self._wait_logged()
+        self._backlog.clear()
+        self._replay = iter(())
+        if self.wal is not None:
+            self.wal.close()
+            if self.wal_factory is not None:
+                self.wal = None
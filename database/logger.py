@@ -1,14 +1,17 @@
+import asyncio
 import datetime
-import json
 import threading
 import os
 import pickle
 import yaml
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+from fastapi import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from database.database import ClickHouse
+from database.log_shipper import LogShipper
+from database.model_logs import LOGS_TABLE_COLUMNS, MAX_WORDS_COUNT
+from database.wal import SegmentedLog
+from metrics import LOG_MIDDLEWARE_SECONDS, LOG_SHIPPER_QUEUE_DEPTH
 
 def write_file(file, path):
     extension = os.path.splitext(path)[1]
@@ -33,129 +36,76 @@ def read_file(path):
         return None
     return file
 
-database = ClickHouse()
+# Подключение создается в lifespan приложения (connect_database), а не при импорте
+database: ClickHouse | None = None
 
-logs = []
-log_lock = threading.Lock()
+# Журнал открывается при старте отправки, а не при импорте
+log_shipper = LogShipper(None, 'ModelLogs', LOGS_TABLE_COLUMNS, wal_factory=SegmentedLog)
+LOG_SHIPPER_QUEUE_DEPTH.set_function(log_shipper.pending)
 
 prediction_logs = []
 prediction_lock = threading.Lock()
 
-class LogMiddleware(BaseHTTPMiddleware):
-    """Middleware для логирования запросов и ответов API."""
-
-    def __init__(self, app):
-        super().__init__(app)
-        global logs
-        logs = self._read_logs()
-        self.logs_table_columns = ['predicted_tip', 'words_count', 'datetime']
-
-    @staticmethod
-    def _read_logs():
-        """Читает и возвращает существующие логи из файла."""
-        logs_from_file = read_file('logs.pickle')
-        if logs_from_file is None:
-            return []
-        return logs_from_file
-
-    def _extract_prediction_data(self, request_body: str, response_body: str) -> tuple:
-        """Извлекает predicted_tip и words_count из запроса и ответа."""
-        try:
-            # Парсим тело запроса
-            request_data = json.loads(request_body)
-            
-            # Парсим тело ответа
-            response_data = json.loads(response_body)
-            
-            # Извлекаем predicted_tip из ответа
-            predicted_tip = ""
-            if 'predicted_tip' in response_data:
-                predicted_tip = str(response_data['predicted_tip'])
-            elif 'tip' in response_data:
-                predicted_tip = str(response_data['tip'])
-            elif 'prediction' in response_data:
-                predicted_tip = str(response_data['prediction'])
-            elif 'result' in response_data:
-                predicted_tip = str(response_data['result'])
-            
-            # Извлекаем words_count из запроса
-            words_count = 0
-            if 'text' in request_data:
-                text = str(request_data['text'])
-                words_count = len(text.split())
-            elif 'message' in request_data:
-                text = str(request_data['message'])
-                words_count = len(text.split())
-            elif 'input' in request_data:
-                text = str(request_data['input'])
-                words_count = len(text.split())
-            elif 'prompt' in request_data:
-                text = str(request_data['prompt'])
-                words_count = len(text.split())
-            
-            return predicted_tip, words_count
-            
-        except (json.JSONDecodeError, KeyError, AttributeError) as e:
-            print(f"Ошибка при извлечении данных предсказания: {e}")
-            return "", 0
-
-    async def dispatch(self, request: Request, call_next):
-        """Обрабатывает запрос и логирует информацию."""
-        if request.url.path != "/predict":
-            return await call_next(request)
-
-        request_body = await request.body()
-
-        try:
-            json.loads(request_body)
-        except json.JSONDecodeError:
-            print("Не удалось распарсить тело запроса как JSON")
-            return JSONResponse(content={"error": "Неверный JSON"}, status_code=400)
-
-        async def receive():
-            return {'type': 'http.request', 'body': request_body}
-
-        request = Request(scope=request.scope, receive=receive)
-        response = await call_next(request)
-        response_body = b""
-
-        async for chunk in response.body_iterator:
-            response_body += chunk
-
-        # Восстанавливаем итератор тела ответа
-        response = Response(
-            content=response_body,
-            status_code=response.status_code,
-            headers=dict(response.headers),
-            media_type=response.media_type
-        )
-
-        # Извлекаем данные для логирования
-        predicted_tip, words_count = self._extract_prediction_data(
-            request_body.decode("utf-8"), 
-            response_body.decode("utf-8")
-        )
-
-        # Создаем лог запись в соответствии с ModelLogs
-        log_entry = [
-            predicted_tip,           # predicted_tip: str
-            words_count,             # words_count: int (будет преобразован в Int32)
-            datetime.datetime.now()  # datetime: DateTime
-        ]
-
-        with log_lock:
-            logs.append(log_entry)
-            write_file(logs, 'logs.pickle')
-
-            # Вставляем логи в базу при достижении лимита
-            if len(logs) >= 5:
-                logs_to_insert = logs.copy()
-                try:
-                    database.insert_data('ModelLogs', self.logs_table_columns, logs_to_insert)
-                    logs.clear()
-                    write_file(logs, 'logs.pickle')
-                    print(f"Вставлено {len(logs_to_insert)} записей в базу данных")
-                except Exception as e:
-                    print(f"Ошибка при вставке логовввв в базу данных: {e}")
-
-        return response
\ No newline at end of file
+# Ключ в scope['state'], через который обработчик передает данные для ModelLogs
+PREDICTION_LOG_KEY = 'prediction_log'
+
+
+async def connect_database(retry_interval: float | None = None) -> ClickHouse:
+    """Подключается к ClickHouse в фоне и повторяет, пока база недоступна.
+
+    До подключения логи копятся в журнале и очереди LogShipper, запуск
+    приложения и ответы на запросы подключения не ждут.
+    """
+    global database
+    retry_interval = retry_interval or float(os.environ.get('CLICKHOUSE_CONNECT_RETRY_S', 5))
+    candidate = ClickHouse(connect_on_init=False)
+    while not await asyncio.to_thread(candidate.prepare):
+        print(f"❌ ClickHouse недоступен, повтор через {retry_interval} с")
+        await asyncio.sleep(retry_interval)
+
+    database = candidate
+    log_shipper.database = candidate
+    print("✅ ClickHouse подключен")
+    return candidate
+
+
+def log_prediction(request: Request, predicted_tip: str, text: str):
+    """Передает LogMiddleware предсказание и длину текста без повторного разбора тел"""
+    setattr(request.state, PREDICTION_LOG_KEY, (predicted_tip, min(len(text.split()), MAX_WORDS_COUNT)))
+
+
+class LogMiddleware:
+    """ASGI middleware для логирования предсказаний.
+
+    Не читает и не копирует тела запроса и ответа: обработчик сам кладет
+    predicted_tip и words_count в состояние запроса через log_prediction.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.logs_table_columns = LOGS_TABLE_COLUMNS
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        # Общий словарь состояния: Request.state обработчика пишет в него же
+        state = scope.setdefault('state', {})
+        await self.app(scope, receive, send)
+
+        prediction_log = state.pop(PREDICTION_LOG_KEY, None)
+        if prediction_log is None:
+            return
+
+        with LOG_MIDDLEWARE_SECONDS.time():
+            predicted_tip, words_count = prediction_log
+            # Создаем лог запись в соответствии с ModelLogs
+            log_entry = [
+                predicted_tip,           # predicted_tip: str
+                words_count,             # words_count: int (будет преобразован в UInt16)
+                datetime.datetime.now()  # datetime: DateTime
+            ]
+
+            # Вставка в базу идет в фоне пачками, на пути запроса только постановка в очередь
+            await log_shipper.enqueue(log_entry)
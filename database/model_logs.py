@@ -1,12 +1,105 @@
-from Entity import Entity
+import os
+
+from database.Entity import Entity
+
+# Сколько дней хранить сырые логи; 0 — хранить всегда
+MODEL_LOGS_TTL_DAYS = int(os.environ.get('MODEL_LOGS_TTL_DAYS', 0))
+
+# Столбцы, которые пишут сервис и functions/bulk_score.py
+LOGS_TABLE_COLUMNS = ['predicted_tip', 'words_count', 'datetime']
+# Верхняя граница UInt16 для ModelLogs.words_count
+MAX_WORDS_COUNT = 65535
+
 
 class ModelLogs(Entity):
     
-    predicted_tip: str = 'String'
-    words_count: str = 'Int32'
-    datetime: str = 'DateTime'
+    # Меток всего несколько: словарное кодирование вместо строки в каждой строке
+    predicted_tip: str = 'LowCardinality(String)'
+    # Длина запроса в словах, ограничивается в log_prediction
+    words_count: str = 'UInt16 CODEC(T64, ZSTD(1))'
+    # Время почти монотонно растет: DoubleDelta сжимает его до нескольких бит на строку
+    datetime: str = 'DateTime CODEC(DoubleDelta, ZSTD(1))'
+
+    @staticmethod
+    def _partition_by() -> str:
+        return 'toYYYYMM(datetime)'
 
     @staticmethod
     def _after_engine() -> str:
         
-        return 'ORDER BY datetime'
\ No newline at end of file
+        return 'ORDER BY datetime'
+
+    @staticmethod
+    def _ttl():
+        if MODEL_LOGS_TTL_DAYS <= 0:
+            return None
+        return f'datetime + INTERVAL {MODEL_LOGS_TTL_DAYS} DAY DELETE'
+
+    @staticmethod
+    def _settings():
+        # Партиции по месяцам удаляются целиком, без переписывания кусков
+        if MODEL_LOGS_TTL_DAYS <= 0:
+            return None
+        return 'ttl_only_drop_parts = 1'
+
+
+class ModelLogsLabelsPerMinute(Entity):
+    """Число предсказаний каждой метки по минутам"""
+
+    minute: str = 'DateTime CODEC(DoubleDelta, ZSTD(1))'
+    predicted_tip: str = 'LowCardinality(String)'
+    requests: str = 'UInt64'
+
+    @staticmethod
+    def _engine() -> str:
+        return 'SummingMergeTree'
+
+    @staticmethod
+    def _partition_by() -> str:
+        return 'toYYYYMM(minute)'
+
+    @staticmethod
+    def _after_engine() -> str:
+        return 'ORDER BY (minute, predicted_tip)'
+
+    @staticmethod
+    def _source_table() -> str:
+        return 'ModelLogs'
+
+    @staticmethod
+    def _source_query() -> str:
+        return (
+            'SELECT toStartOfMinute(datetime) AS minute, predicted_tip, count() AS requests '
+            'FROM {source} GROUP BY minute, predicted_tip'
+        )
+
+
+class ModelLogsWordsCountPerMinute(Entity):
+    """Гистограмма длины запросов по минутам: корзина — точное число слов"""
+
+    minute: str = 'DateTime CODEC(DoubleDelta, ZSTD(1))'
+    words_count: str = 'UInt16'
+    requests: str = 'UInt64'
+
+    @staticmethod
+    def _engine() -> str:
+        return 'SummingMergeTree'
+
+    @staticmethod
+    def _partition_by() -> str:
+        return 'toYYYYMM(minute)'
+
+    @staticmethod
+    def _after_engine() -> str:
+        return 'ORDER BY (minute, words_count)'
+
+    @staticmethod
+    def _source_table() -> str:
+        return 'ModelLogs'
+
+    @staticmethod
+    def _source_query() -> str:
+        return (
+            'SELECT toStartOfMinute(datetime) AS minute, words_count, count() AS requests '
+            'FROM {source} GROUP BY minute, words_count'
+        )
\ No newline at end of file
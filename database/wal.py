@@ -0,0 +1,174 @@
+import os
+import pickle
+import struct
+import threading
+import zlib
+from typing import Any, Iterator
+
+# Заголовок записи: длина полезной нагрузки и ее crc32
+_HEADER = struct.Struct('>II')
+_SEGMENT_SUFFIX = '.log'
+
+
+def _segment_name(segment_id: int) -> str:
+    return f'{segment_id:016d}{_SEGMENT_SUFFIX}'
+
+
+def list_segments(directory: str) -> list[int]:
+    """Возвращает номера сегментов в каталоге по возрастанию"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        int(name[:-len(_SEGMENT_SUFFIX)])
+        for name in os.listdir(directory)
+        if name.endswith(_SEGMENT_SUFFIX) and name[:-len(_SEGMENT_SUFFIX)].isdigit()
+    )
+
+
+def read_segment(path: str) -> Iterator[Any]:
+    """Потоково читает записи сегмента.
+
+    Оборванная или поврежденная запись в хвосте (падение посреди записи)
+    завершает чтение сегмента: все, что до нее, считается валидным.
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            length, checksum = _HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                print(f"❌ Поврежденная запись в {path}, остаток сегмента пропущен")
+                return
+            yield pickle.loads(payload)
+
+
+def read_records(directory: str) -> Iterator[tuple[int, Any]]:
+    """Потоково читает все записи всех сегментов: (номер сегмента, запись)"""
+    for segment_id in list_segments(directory):
+        for record in read_segment(os.path.join(directory, _segment_name(segment_id))):
+            yield segment_id, record
+
+
+class SegmentedLog:
+    """Append-only журнал записей, разбитый на сегменты.
+
+    Каждая запись пишется как длина + crc32 + pickle, файл никогда не
+    переписывается целиком. fsync делается пачками через sync(). Сегмент
+    удаляется, когда он закрыт и все его записи подтверждены через confirm().
+    """
+
+    def __init__(self, directory: str | None = None, segment_bytes: int | None = None):
+        self.directory = directory or os.environ.get('LOG_WAL_DIR', 'logs_wal')
+        self.segment_bytes = segment_bytes or int(float(os.environ.get('LOG_WAL_SEGMENT_MB', 16)) * 1024 * 1024)
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Сегменты, оставшиеся с прошлого запуска, только читаются; запись всегда идет в новый
+        self._recovered = list_segments(self.directory)
+        self._appended: dict[int, int] = {}
+        self._confirmed: dict[int, int] = {}
+        self._sealed: set[int] = set()
+
+        self._segment_id = (self._recovered[-1] + 1) if self._recovered else 0
+        self._file = None
+        self._size = 0
+        self._dirty = False
+        self._open_segment()
+
+    def _path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, _segment_name(segment_id))
+
+    def _open_segment(self):
+        self._file = open(self._path(self._segment_id), 'ab')
+        self._size = self._file.tell()
+        self._appended.setdefault(self._segment_id, 0)
+
+    def _rotate(self):
+        """Закрывает текущий сегмент и открывает следующий"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._sealed.add(self._segment_id)
+        self._delete_if_done(self._segment_id)
+        self._segment_id += 1
+        self._open_segment()
+
+    def append(self, record: Any) -> int:
+        """Дописывает запись в текущий сегмент и возвращает номер сегмента"""
+        return self.append_many([record])[0]
+
+    def append_many(self, records: list[Any]) -> list[int]:
+        """Дописывает пачку записей под одной блокировкой; номера сегментов по одному на запись"""
+        payloads = [pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL) for record in records]
+        segment_ids = []
+        with self._lock:
+            for payload in payloads:
+                if self._size >= self.segment_bytes:
+                    self._rotate()
+                self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+                self._file.write(payload)
+                self._size += _HEADER.size + len(payload)
+                self._appended[self._segment_id] += 1
+                segment_ids.append(self._segment_id)
+            self._dirty = True
+        return segment_ids
+
+    def sync(self):
+        """Сбрасывает накопленные записи на диск одним fsync"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def replay(self) -> Iterator[tuple[int, Any]]:
+        """Потоково отдает неподтвержденные записи сегментов прошлого запуска"""
+        while self._recovered:
+            segment_id = self._recovered[0]
+            with self._lock:
+                self._appended.setdefault(segment_id, 0)
+            for record in read_segment(self._path(segment_id)):
+                with self._lock:
+                    self._appended[segment_id] += 1
+                yield segment_id, record
+            with self._lock:
+                self._recovered.pop(0)
+                self._sealed.add(segment_id)
+                self._delete_if_done(segment_id)
+
+    def confirm(self, segment_ids: list[int]):
+        """Отмечает записи как доставленные в ClickHouse (по одному номеру сегмента на запись)"""
+        with self._lock:
+            for segment_id in segment_ids:
+                self._confirmed[segment_id] = self._confirmed.get(segment_id, 0) + 1
+            for segment_id in set(segment_ids):
+                self._delete_if_done(segment_id)
+
+    def _delete_if_done(self, segment_id: int):
+        if segment_id not in self._sealed:
+            return
+        if self._confirmed.get(segment_id, 0) < self._appended.get(segment_id, 0):
+            return
+        try:
+            os.remove(self._path(segment_id))
+        except FileNotFoundError:
+            pass
+        self._sealed.discard(segment_id)
+        self._appended.pop(segment_id, None)
+        self._confirmed.pop(segment_id, None)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            # Пустой сегмент без записей не нужен при следующем запуске
+            if self._appended.get(self._segment_id, 0) == self._confirmed.get(self._segment_id, 0):
+                self._sealed.add(self._segment_id)
+                self._delete_if_done(self._segment_id)
@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+
+from onnx_session import BoundSession, create_session, io_binding_enabled, preload_shared_weights, resolve_model_path
+
+
+class SentenceTransformerEncoder:
+    """Энкодер на sentence-transformers (torch): исходный путь инференса"""
+
+    def __init__(self, model_name: str | None = None):
+        # Импорт внутри, чтобы ONNX-бэкенд не тянул torch в процесс
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name or os.environ.get('INFERENCE_ENCODER_NAME', 'all-MiniLM-L6-v2')
+        self.model = SentenceTransformer(self.model_name)
+
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size)
+
+
+class OnnxEncoder:
+    """Энкодер MiniLM, экспортированный в ONNX вместе с mean pooling и нормализацией.
+
+    Нужны только быстрый токенизатор и onnxruntime, torch не используется.
+    Модель готовится скриптом functions/export_encoder.py.
+    """
+
+    def __init__(self, model_path: str | None = None, tokenizer_path: str | None = None):
+        from tokenizers import Tokenizer
+
+        if model_path is None:
+            model_path = resolve_model_path(os.environ.get('INFERENCE_ENCODER_PATH', 'encoder/encoder.onnx'), 'encoder')
+        self.model_path = model_path
+        self.tokenizer_path = tokenizer_path or os.environ.get(
+            'INFERENCE_TOKENIZER_PATH', os.path.join(os.path.dirname(self.model_path), 'tokenizer.json')
+        )
+
+        # Усечение до max_seq_length сохранено в tokenizer.json при экспорте
+        self.tokenizer = Tokenizer.from_file(self.tokenizer_path)
+        self.tokenizer.enable_padding()
+
+        self.session = create_session(self.model_path)
+        self.input_names = {graph_input.name for graph_input in self.session.get_inputs()}
+        embedding_width = self.session.get_outputs()[0].shape[-1]
+        self.bound_session = (
+            BoundSession(self.session, 'sentence_embedding', embedding_width)
+            if io_binding_enabled() and isinstance(embedding_width, int) else None
+        )
+
+    def _encode_chunk(self, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        feed = {
+            'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+        }
+        if 'token_type_ids' in self.input_names:
+            feed['token_type_ids'] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        if self.bound_session is not None:
+            # Буфер IOBinding переиспользуется, поэтому результат копируется
+            return self.bound_session.run(feed).copy()
+        return self.session.run(['sentence_embedding'], feed)[0]
+
+    def encode(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        # Режем на чанки, чтобы паддинг шел до самого длинного текста в чанке, а не во всем списке
+        chunks = [self._encode_chunk(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        return np.concatenate(chunks, axis=0)
+
+
+# Энкодер sentence-transformers, загруженный до fork в serve.py: воркеры делят его веса
+_preloaded_encoder: SentenceTransformerEncoder | None = None
+
+
+def preload_encoder(backend: str | None = None):
+    """Загружает веса энкодера заранее, в родительском процессе serve.py.
+
+    Для onnx загружаются только веса: сессию ONNX Runtime нельзя переносить
+    через fork, она создается в воркере поверх общих буферов.
+    """
+    global _preloaded_encoder
+    backend = backend or os.environ.get('INFERENCE_BACKEND', 'sentence_transformers')
+    if backend == 'sentence_transformers':
+        _preloaded_encoder = SentenceTransformerEncoder()
+    elif backend == 'onnx':
+        preload_shared_weights(resolve_model_path(os.environ.get('INFERENCE_ENCODER_PATH', 'encoder/encoder.onnx'), 'encoder'))
+    else:
+        raise ValueError(f"Неизвестный бэкенд энкодера: {backend}")
+
+
+def create_encoder(backend: str | None = None, model: str | None = None, tokenizer_path: str | None = None):
+    """Создает энкодер по INFERENCE_BACKEND: sentence_transformers или onnx.
+
+    model — имя или каталог модели sentence-transformers либо путь к ONNX-энкодеру;
+    по умолчанию берется из INFERENCE_ENCODER_NAME / INFERENCE_ENCODER_PATH.
+    """
+    backend = backend or os.environ.get('INFERENCE_BACKEND', 'sentence_transformers')
+    if backend == 'sentence_transformers':
+        if _preloaded_encoder is not None and model in (None, _preloaded_encoder.model_name):
+            return _preloaded_encoder
+        return SentenceTransformerEncoder(model)
+    if backend == 'onnx':
+        return OnnxEncoder(resolve_model_path(model, 'encoder') if model else None, tokenizer_path)
+    raise ValueError(f"Неизвестный бэкенд энкодера: {backend}")
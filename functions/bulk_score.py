@@ -0,0 +1,353 @@
+"""Пакетная разметка больших файлов без HTTP.
+
+Вход — JSONL или Parquet с текстами. Он читается кусками по --chunk-size
+строк, куски распределяются по пулу процессов (в каждом своя модель и своя
+сессия ONNX Runtime). Результат каждого куска сразу пишется отдельным файлом
+part-NNNNNN.parquet (или .arrow) в каталог вывода; каталог читается как
+один набор данных (pandas.read_parquet, pyarrow.dataset).
+
+После прерывания повторный запуск с теми же аргументами пропускает готовые
+куски. С --clickhouse результаты дополнительно загружаются в ModelLogs;
+загруженный кусок отмечается файлом в _loaded/ (служебные имена с _
+pyarrow при чтении каталога пропускает).
+
+    python functions/bulk_score.py texts.jsonl scored/ --workers 4 --clickhouse
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Iterator
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+from database.model_logs import LOGS_TABLE_COLUMNS, MAX_WORDS_COUNT
+
+META_FILE = '_bulk_score.json'
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Модель внутри процесса-воркера
+_worker_inference = None
+
+
+def _init_worker():
+    global _worker_inference
+    from inference import Inference
+
+    # Ctrl+C из терминала приходит всей группе процессов: останавливает работу только родитель
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    _worker_inference = Inference()
+    _worker_inference.warmup()
+
+
+def _score_chunk(index: int, texts: list[str | None]) -> tuple[int, list[str | None]]:
+    """Размечает кусок; строки без текста остаются без метки"""
+    valid = [text for text in texts if text]
+    labels = iter(_worker_inference.predict_batch(valid))
+    return index, [next(labels) if text else None for text in texts]
+
+
+class Chunk:
+    """Кусок входа: номера строк, идентификаторы и тексты"""
+
+    def __init__(self, index: int, first_row: int, texts: list[str | None], ids: list | None):
+        self.index = index
+        self.first_row = first_row
+        self.texts = texts
+        self.ids = ids
+
+
+def _as_text(value) -> str | None:
+    if isinstance(value, str) and value.strip():
+        return value
+    return None
+
+
+def read_jsonl(path: str, chunk_size: int, text_field: str, id_field: str | None) -> Iterator[Chunk]:
+    index, row = 0, 0
+    texts, ids = [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = {}
+            if not isinstance(item, dict):
+                item = {}
+            texts.append(_as_text(item.get(text_field)))
+            ids.append(item.get(id_field))
+            if len(texts) == chunk_size:
+                yield Chunk(index, row, texts, ids if id_field else None)
+                index, row = index + 1, row + len(texts)
+                texts, ids = [], []
+    if texts:
+        yield Chunk(index, row, texts, ids if id_field else None)
+
+
+def read_parquet(path: str, chunk_size: int, text_field: str, id_field: str | None) -> Iterator[Chunk]:
+    columns = [text_field] + ([id_field] if id_field else [])
+    row = 0
+    for index, batch in enumerate(pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns)):
+        texts = [_as_text(value) for value in batch.column(text_field).to_pylist()]
+        ids = batch.column(id_field).to_pylist() if id_field else None
+        yield Chunk(index, row, texts, ids)
+        row += len(texts)
+
+
+def read_input(path: str, chunk_size: int, text_field: str, id_field: str | None) -> Iterator[Chunk]:
+    if path.endswith('.parquet'):
+        return read_parquet(path, chunk_size, text_field, id_field)
+    return read_jsonl(path, chunk_size, text_field, id_field)
+
+
+def count_rows(path: str) -> int | None:
+    """Число строк для процентов прогресса; для JSONL без полного прохода неизвестно"""
+    if path.endswith('.parquet'):
+        return pq.ParquetFile(path).metadata.num_rows
+    return None
+
+
+def build_table(chunk: Chunk, labels: list[str | None]) -> pa.Table:
+    columns = {'row': pa.array(range(chunk.first_row, chunk.first_row + len(labels)), type=pa.int64())}
+    if chunk.ids is not None:
+        # Идентификаторы из JSONL бывают и числами, и строками: храним единым типом
+        columns['id'] = pa.array([None if value is None else str(value) for value in chunk.ids], type=pa.string())
+    columns['predicted_tip'] = pa.array(labels, type=pa.string())
+    columns['words_count'] = pa.array(
+        [min(len(text.split()), MAX_WORDS_COUNT) if text else None for text in chunk.texts], type=pa.uint16())
+    return pa.table(columns)
+
+
+class PartWriter:
+    """Файлы результатов по кускам в каталоге вывода"""
+
+    def __init__(self, output_dir: str, output_format: str):
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.extension = FORMATS[output_format]
+        self.loaded_dir = os.path.join(output_dir, '_loaded')
+
+    def part_path(self, index: int) -> str:
+        return os.path.join(self.output_dir, f'part-{index:06d}{self.extension}')
+
+    def loaded_path(self, index: int) -> str:
+        return os.path.join(self.loaded_dir, f'part-{index:06d}')
+
+    def done(self, index: int) -> bool:
+        return os.path.exists(self.part_path(index))
+
+    def write(self, index: int, table: pa.Table):
+        # Временный файл и переименование: прерванная запись не оставит полкуска
+        fd, temp_path = tempfile.mkstemp(suffix=self.extension, dir=self.output_dir)
+        os.close(fd)
+        try:
+            if self.output_format == 'parquet':
+                pq.write_table(table, temp_path, compression='zstd')
+            else:
+                with pa.ipc.new_file(temp_path, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(temp_path, self.part_path(index))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def read(self, index: int) -> pa.Table:
+        if self.output_format == 'parquet':
+            return pq.read_table(self.part_path(index))
+        with pa.ipc.open_file(self.part_path(index)) as reader:
+            return reader.read_all()
+
+    def not_loaded(self) -> list[int]:
+        """Готовые куски, которые еще не загружены в ClickHouse"""
+        indexes = []
+        for name in sorted(os.listdir(self.output_dir)):
+            if name.startswith('part-') and name.endswith(self.extension):
+                index = int(name[len('part-'):-len(self.extension)])
+                if not os.path.exists(self.loaded_path(index)):
+                    indexes.append(index)
+        return indexes
+
+
+class ModelLogsLoader:
+    """Загрузка результатов в ModelLogs через ClickHouse.insert_data"""
+
+    def __init__(self):
+        from database.database import ClickHouse
+
+        self.database = ClickHouse()
+
+    def load(self, writer: PartWriter, index: int, table: pa.Table):
+        now = datetime.datetime.now()
+        rows = [[label, words_count, now]
+                for label, words_count in zip(table.column('predicted_tip').to_pylist(),
+                                              table.column('words_count').to_pylist())
+                if label is not None]
+        if rows:
+            self.database.insert_data('ModelLogs', LOGS_TABLE_COLUMNS, rows)
+        os.makedirs(writer.loaded_dir, exist_ok=True)
+        # Отметка после вставки: при сбое между ними кусок загрузится повторно, но не потеряется
+        open(writer.loaded_path(index), 'w').close()
+
+
+def check_meta(output_dir: str, meta: dict):
+    """Продолжать можно только с теми же параметрами: иначе номера кусков значат другое"""
+    path = os.path.join(output_dir, META_FILE)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous != meta:
+            raise SystemExit(f"❌ Каталог {output_dir} создан с другими параметрами: {previous}")
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+class Progress:
+    def __init__(self, total_rows: int | None, interval: float):
+        self.total_rows = total_rows
+        self.interval = interval
+        self.rows = 0
+        self.skipped_rows = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def add(self, rows: int, force: bool = False):
+        self.rows += rows
+        now = time.perf_counter()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        rate = self.rows / max(now - self.start, 1e-9)
+        done = self.rows + self.skipped_rows
+        line = f"📈 {done} строк, {rate:.0f} строк/с"
+        if self.total_rows:
+            line += f", {100 * done / self.total_rows:.1f}%"
+            if rate > 0:
+                line += f", осталось ~{(self.total_rows - done) / rate:.0f} с"
+        print(line, flush=True)
+
+
+class StopRequest:
+    """Первый SIGINT просит дописать куски в работе и выйти, второй прерывает сразу"""
+
+    def __init__(self):
+        self.requested = False
+
+    def __call__(self, signum, frame):
+        if self.requested:
+            raise KeyboardInterrupt
+        self.requested = True
+        print("❌ Остановка: дописываем куски в работе, повторный Ctrl+C прервет сразу", flush=True)
+
+
+def score(args, stop: StopRequest) -> Progress:
+    writer = PartWriter(args.output, args.format)
+    loader = ModelLogsLoader() if args.clickhouse else None
+
+    if loader is not None:
+        # Куски, записанные прошлым запуском, но не дошедшие до базы
+        for index in writer.not_loaded():
+            loader.load(writer, index, writer.read(index))
+
+    progress = Progress(count_rows(args.input), args.progress_interval)
+    max_in_flight = args.max_in_flight or 2 * args.workers
+    in_flight: dict[Future, Chunk] = {}
+
+    def collect(done: set[Future]):
+        for future in done:
+            chunk = in_flight.pop(future)
+            index, labels = future.result()
+            table = build_table(chunk, labels)
+            writer.write(index, table)
+            if loader is not None:
+                loader.load(writer, index, table)
+            progress.add(len(labels))
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as executor:
+        try:
+            for chunk in read_input(args.input, args.chunk_size, args.text_field, args.id_field):
+                if stop.requested:
+                    break
+                if writer.done(chunk.index):
+                    progress.skipped_rows += len(chunk.texts)
+                    continue
+                # Скользящее окно: читаем вход не дальше, чем успевают воркеры
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight[executor.submit(_score_chunk, chunk.index, chunk.texts)] = chunk
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        except BaseException:
+            # Воркеры не ждем: их куски не записаны и будут посчитаны при следующем запуске
+            # Кроме процессов пула дочерних процессов у скрипта нет
+            for process in multiprocessing.active_children():
+                process.terminate()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    progress.add(0, force=True)
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пакетная разметка JSONL или Parquet с продолжением после прерывания')
+    parser.add_argument('input', help='Файл .jsonl или .parquet')
+    parser.add_argument('output', help='Каталог для файлов результатов')
+    parser.add_argument('--text-field', default='text')
+    parser.add_argument('--id-field', default=None, help='Поле-идентификатор, переносится в результат')
+    parser.add_argument('--format', choices=list(FORMATS), default='parquet')
+    parser.add_argument('--chunk-size', type=int, default=2048, help='Строк в куске и в одном файле результата')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-in-flight', type=int, default=None, help='Кусков в работе, по умолчанию 2 * workers')
+    parser.add_argument('--clickhouse', action='store_true', help='Загрузить результаты в ModelLogs')
+    parser.add_argument('--progress-interval', type=float, default=5.0)
+    args = parser.parse_args()
+
+    # Ядра делятся между процессами, иначе каждая сессия займет их все
+    os.environ.setdefault('ORT_INTRA_OP_THREADS', str(max(1, (os.cpu_count() or 1) // args.workers)))
+    # Тексты в выгрузках редко повторяются, а кэш меток занимал бы память в каждом воркере
+    os.environ.setdefault('INFERENCE_CACHE_MODE', 'off')
+
+    os.makedirs(args.output, exist_ok=True)
+    # Размер и время изменения: измененный на месте вход не смешается со старыми кусками
+    input_stat = os.stat(args.input)
+    check_meta(args.output, {
+        'input': os.path.abspath(args.input),
+        'input_size': input_stat.st_size,
+        'input_mtime_ns': input_stat.st_mtime_ns,
+        'chunk_size': args.chunk_size,
+        'text_field': args.text_field,
+        'id_field': args.id_field,
+        'format': args.format,
+    })
+
+    stop = StopRequest()
+    signal.signal(signal.SIGINT, stop)
+    try:
+        progress = score(args, stop)
+    except KeyboardInterrupt:
+        stop.requested = True
+    if stop.requested:
+        print(f"❌ Прервано, готовые куски сохранены в {args.output}; повторный запуск продолжит с места остановки")
+        sys.exit(130)
+    print(f"✅ Размечено {progress.rows} строк (пропущено готовых: {progress.skipped_rows}), результат в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contractions
+
+import normalizer
+
+
+def legacy_normalize(text) -> str:
+    """Прежняя цепочка из Inference: эталон для сравнения"""
+    text = str(text)
+    text = re.sub("`", "'", text)
+    text = contractions.fix(text)
+    text = re.sub(r'[^a-zA-Z]|https?://\S+|www\.\S+|<.*?|0-9>', " ", text)
+    text = re.sub(r'\s+', ' ', text)
+    return text.lower()
+
+
+# Символы, у которых lower() меняет длину или дает латинскую букву, и их соседи по регистру.
+# На них прежняя цепочка ведет себя непоследовательно (см. normalizer.py): расхождения
+# печатаются отдельно, но проверку не валят; новая цепочка не должна на них падать
+CASE_FOLDING = ('İ', 'ẞ', '\u212a', 'ß', 'ſ')
+
+
+def legacy_or_none(text) -> str | None:
+    """Прежняя цепочка падает на части текстов, где lower() меняет длину: с ними сравнивать не с чем"""
+    try:
+        return legacy_normalize(text)
+    except IndexError:
+        return None
+
+
+def generate_corpus(size: int, seed: int = 0) -> list[str]:
+    """Синтетические тексты с сокращениями, сленгом, ссылками, цифрами и разметкой"""
+    rng = random.Random(seed)
+    keys = list(contractions.contractions_dict) + list(contractions.leftovers_dict) + list(contractions.slang_dict)
+    words = ['i', 'feel', 'so', 'happy', 'sad', 'angry', 'today', 'really', 'Afraid', 'LOVE', 'the', 'day']
+    noise = ['!', '?', '...', ',', ' 42 ', '`', "'", '’', '<b>', '</b>', '0-9>', '  ', '\t', '\n', '😊', 'ё']
+    case_folding = list(CASE_FOLDING)
+    urls = ['http://example.com/a?b=1', 'https://t.co/xyz', 'www.site.org/page', 'HTTP://UPPER.COM']
+
+    corpus = []
+    for _ in range(size):
+        tokens = []
+        for _ in range(rng.randint(1, 30)):
+            roll = rng.random()
+            if roll < 0.25:
+                key = rng.choice(keys)
+                tokens.append(rng.choice([key, key.upper(), key.title()]))
+            elif roll < 0.27:
+                # Сокращение, приклеенное к такому символу или начинающееся с него
+                key = rng.choice(keys)
+                tokens.append(rng.choice(case_folding) + rng.choice([key, key[1:], key.upper()]))
+            elif roll < 0.3:
+                tokens.append(rng.choice(urls))
+            elif roll < 0.45:
+                tokens.append(rng.choice(noise))
+            else:
+                tokens.append(rng.choice(words))
+        corpus.append(rng.choice([' ', '', ' ']).join(tokens))
+    return corpus
+
+
+def read_texts(path: str) -> list[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)['text'] for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение normalizer с прежней цепочкой нормализации')
+    parser.add_argument('--texts', default=None, help='JSONL с полем text; по умолчанию синтетический корпус')
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--show', type=int, default=10, help='Сколько расхождений напечатать')
+    args = parser.parse_args()
+
+    texts = read_texts(args.texts) if args.texts else generate_corpus(args.size)
+
+    start = time.perf_counter()
+    expected = [legacy_or_none(text) for text in texts]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = normalizer.normalize_batch(texts)
+    new_seconds = time.perf_counter() - start
+
+    # Новая цепочка не должна падать ни на одном тексте; сравниваются только тексты, где не упала прежняя
+    mismatches, case_folding_mismatches = [], []
+    for text, e, a in zip(texts, expected, actual):
+        if e is None or e == a:
+            continue
+        known = any(char in text for char in CASE_FOLDING)
+        (case_folding_mismatches if known else mismatches).append((text, e, a))
+    for text, e, a in case_folding_mismatches[:args.show]:
+        print(f"📋 {text!r}\n   прежняя:   {e!r}\n   получено:  {a!r}")
+    for text, e, a in mismatches[:args.show]:
+        print(f"❌ {text!r}\n   ожидалось: {e!r}\n   получено:  {a!r}")
+
+    print(json.dumps({
+        'texts': len(texts),
+        'mismatches': len(mismatches),
+        'case_folding_mismatches': len(case_folding_mismatches),
+        'legacy_errors': sum(e is None for e in expected),
+        'legacy_seconds': round(legacy_seconds, 4),
+        'normalizer_seconds': round(new_seconds, 4),
+        'speedup': round(legacy_seconds / new_seconds, 2) if new_seconds else None,
+    }, ensure_ascii=False, indent=2))
+
+    if mismatches:
+        sys.exit(1)
+    print("✅ Результаты совпадают")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Эталонные метки считает сам классификатор, без семантического кэша
+os.environ['INFERENCE_SEMANTIC_CACHE'] = '0'
+
+import numpy as np
+
+from inference import Inference
+from semantic_cache import SemanticCache
+
+DEFAULT_THRESHOLDS = [0.80, 0.85, 0.90, 0.92, 0.94, 0.96, 0.98]
+
+
+def read_texts(path: str, labels: list[str]) -> tuple[list[str], np.ndarray | None]:
+    """JSONL с полем text и необязательным label (имя метки или ее номер) в порядке трафика"""
+    texts, gold = [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            texts.append(item['text'])
+            label = item.get('label')
+            gold.append(labels.index(label) if isinstance(label, str) else label)
+    if any(label is None for label in gold):
+        return texts, None
+    return texts, np.array(gold)
+
+
+def measure_classifier(inference: Inference, embeddings: np.ndarray, batch_size: int) -> float:
+    """Время классификатора на батч, мс: столько кэш экономит на каждом попадании"""
+    batches = [embeddings[start:start + batch_size] for start in range(0, len(embeddings), batch_size)]
+    began = time.perf_counter()
+    for batch in batches:
+        inference.classify(batch)
+    return 1000 * (time.perf_counter() - began) / len(batches)
+
+
+def simulate(embeddings: np.ndarray, reference: np.ndarray, gold: np.ndarray | None, threshold: float,
+             max_entries: int, batch_size: int) -> dict:
+    """Прогоняет тексты через кэш батчами, как в сервисе: промахи размечает классификатор и кладут в кэш"""
+    cache = SemanticCache(dim=embeddings.shape[1], max_entries=max_entries, threshold=threshold)
+    predicted = np.empty(len(reference), dtype=np.int64)
+    hit_mask = np.zeros(len(reference), dtype=bool)
+    lookup_seconds = 0.0
+
+    for start in range(0, len(embeddings), batch_size):
+        batch = embeddings[start:start + batch_size]
+        began = time.perf_counter()
+        cached = cache.lookup(batch)
+        lookup_seconds += time.perf_counter() - began
+
+        hits = cached >= 0
+        indexes = np.arange(start, start + len(batch))
+        predicted[indexes] = np.where(hits, cached, reference[indexes])
+        hit_mask[indexes] = hits
+        cache.add(batch[~hits], reference[indexes[~hits]].tolist())
+
+    hits = int(hit_mask.sum())
+    report = {
+        'threshold': threshold,
+        'hit_rate': hits / len(reference),
+        # Доля попаданий, где метка из кэша совпала с меткой классификатора
+        'hit_agreement': float(np.mean(predicted[hit_mask] == reference[hit_mask])) if hits else None,
+        'label_agreement': float(np.mean(predicted == reference)),
+        'evictions': cache.evictions,
+        'lookup_ms_per_batch': 1000 * lookup_seconds / max(1, -(-len(embeddings) // batch_size)),
+    }
+    if gold is not None:
+        report['accuracy'] = float(np.mean(predicted == gold))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Согласие меток семантического кэша с классификатором по порогам')
+    parser.add_argument('--texts', required=True, help='JSONL с полем text (и label) в порядке поступления')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=DEFAULT_THRESHOLDS)
+    parser.add_argument('--max-entries', type=int, default=int(os.environ.get('INFERENCE_SEMANTIC_CACHE_SIZE', 10000)))
+    parser.add_argument('--batch-size', type=int, default=32, help='Размер батча, как у микробатчера сервиса')
+    parser.add_argument('--min-agreement', type=float, default=0.99, help='Минимальное согласие меток для рекомендации')
+    parser.add_argument('--report', default=None, help='Куда сохранить отчет JSON')
+    args = parser.parse_args()
+
+    inference = Inference()
+    labels = [inference.number_to_word[number] for number in sorted(inference.number_to_word)]
+    texts, gold = read_texts(args.texts, labels)
+
+    embeddings = np.asarray(inference.encode(inference.normalize_batch(texts)), dtype=np.float32)
+    reference = np.array([inference.word_to_number[label] for label in inference.classify(embeddings)])
+    classifier_ms = measure_classifier(inference, embeddings, args.batch_size)
+
+    results = [simulate(embeddings, reference, gold, threshold, args.max_entries, args.batch_size)
+               for threshold in sorted(args.thresholds)]
+    if gold is not None:
+        baseline = float(np.mean(reference == gold))
+        print(f"Точность классификатора без кэша: {baseline:.4f}")
+
+    print(f"Классификатор без кэша: {classifier_ms:.3f} мс/батч")
+    print(f"{'порог':>6} {'попадания':>10} {'согласие':>9} {'на попаданиях':>14} {'поиск мс/батч':>14}")
+    for result in results:
+        hit_agreement = '-' if result['hit_agreement'] is None else f"{result['hit_agreement']:.4f}"
+        print(f"{result['threshold']:>6.2f} {result['hit_rate']:>10.2%} {result['label_agreement']:>9.4f} "
+              f"{hit_agreement:>14} {result['lookup_ms_per_batch']:>14.3f}")
+
+    # Самый низкий порог, то есть больше всего попаданий, при допустимом согласии
+    passing = [result for result in results if result['label_agreement'] >= args.min_agreement]
+    # Поиск идет на каждом батче, а экономит классификатор только на доле попаданий
+    passing = [result for result in passing if result['lookup_ms_per_batch'] < result['hit_rate'] * classifier_ms]
+    recommended = passing[0]['threshold'] if passing else None
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'texts': len(texts), 'max_entries': args.max_entries, 'batch_size': args.batch_size,
+                       'classifier_ms_per_batch': classifier_ms, 'min_agreement': args.min_agreement, 'recommended_threshold': recommended,
+                       'results': results}, f, ensure_ascii=False, indent=2)
+
+    if recommended is None:
+        print(f"❌ Ни один порог не дает согласия {args.min_agreement} с поиском дешевле сэкономленного "
+              f"классификатора, семантический кэш включать не стоит")
+        sys.exit(1)
+    print(f"✅ Рекомендуемый порог: INFERENCE_SEMANTIC_CACHE_THRESHOLD={recommended}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import onnxruntime
+import torch
+from sentence_transformers import SentenceTransformer
+
+from encoders import OnnxEncoder
+from save_model import model_path, save_model
+
+SAMPLE_TEXTS = [
+    "i am so happy today",
+    "i feel really lonely and sad",
+    "i am scared of what will happen tomorrow",
+    "this makes me so angry i could scream",
+    "ok",
+    "i did not expect the meeting to go this well and now i can not stop smiling about it",
+]
+
+
+class EncoderWithPooling(torch.nn.Module):
+    """Трансформер + mean pooling по маске + L2-нормализация, как в пайплайне sentence-transformers"""
+
+    def __init__(self, transformer: torch.nn.Module):
+        super().__init__()
+        self.transformer = transformer
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        token_embeddings = self.transformer(
+            input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+        )[0]
+        mask = attention_mask.unsqueeze(-1).to(token_embeddings.dtype)
+        summed = (token_embeddings * mask).sum(dim=1)
+        counts = mask.sum(dim=1).clamp(min=1e-9)
+        return torch.nn.functional.normalize(summed / counts, p=2, dim=1)
+
+
+def load_sentence_transformer(path: str) -> SentenceTransformer:
+    if os.path.isdir(path):
+        return SentenceTransformer(path)
+    return save_model(path=path)
+
+
+def export(st_model: SentenceTransformer, output_dir: str, opset: int = 14) -> str:
+    """Экспортирует энкодер в encoder.onnx и токенизатор с усечением в tokenizer.json"""
+    os.makedirs(output_dir, exist_ok=True)
+    onnx_path = os.path.join(output_dir, 'encoder.onnx')
+
+    wrapper = EncoderWithPooling(st_model[0].auto_model).eval()
+    tokenizer = st_model.tokenizer
+    dummy = tokenizer(["example text for export"], return_tensors='pt')
+
+    dynamic_axes = {name: {0: 'batch_size', 1: 'sequence'} for name in ('input_ids', 'attention_mask', 'token_type_ids')}
+    dynamic_axes['sentence_embedding'] = {0: 'batch_size'}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            (dummy['input_ids'], dummy['attention_mask'], dummy['token_type_ids']),
+            onnx_path,
+            input_names=['input_ids', 'attention_mask', 'token_type_ids'],
+            output_names=['sentence_embedding'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+    print(f"✅ Энкодер сохранен в: {onnx_path}")
+
+    # Сохраняем быстрый токенизатор с тем же max_seq_length, что и у sentence-transformers
+    fast_tokenizer = tokenizer.backend_tokenizer
+    fast_tokenizer.enable_truncation(st_model.max_seq_length)
+    tokenizer_path = os.path.join(output_dir, 'tokenizer.json')
+    fast_tokenizer.save(tokenizer_path)
+    print(f"✅ Токенизатор сохранен в: {tokenizer_path}")
+
+    return onnx_path
+
+
+def check_parity(st_model: SentenceTransformer, onnx_path: str, classifier_path: str, texts: list[str],
+                 min_cosine: float) -> dict:
+    """Сравнивает эмбеддинги и метки ONNX-энкодера с текущим путем через sentence-transformers"""
+    reference = st_model.encode(texts, batch_size=32)
+    exported = OnnxEncoder(onnx_path).encode(texts, batch_size=32)
+
+    cosine = np.sum(reference * exported, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(exported, axis=1)
+    )
+
+    classifier = onnxruntime.InferenceSession(classifier_path)
+    reference_labels = np.argmax(classifier.run(None, {'inputs': reference.astype(np.float32)})[0], axis=1)
+    exported_labels = np.argmax(classifier.run(None, {'inputs': exported.astype(np.float32)})[0], axis=1)
+
+    report = {
+        'texts': len(texts),
+        'min_cosine': float(cosine.min()),
+        'max_abs_diff': float(np.abs(reference - exported).max()),
+        'label_agreement': float(np.mean(reference_labels == exported_labels)),
+    }
+    report['passed'] = report['min_cosine'] >= min_cosine and report['label_agreement'] == 1.0
+    return report
+
+
+def read_texts(path: str | None) -> list[str]:
+    if path is None:
+        return SAMPLE_TEXTS
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line)['text'] for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Экспорт MiniLM-энкодера в ONNX и проверка паритета')
+    parser.add_argument('--model', default=model_path, help='Каталог модели из save_model.py')
+    parser.add_argument('--output-dir', default='encoder')
+    parser.add_argument('--classifier', default='model.onnx')
+    parser.add_argument('--texts', default=None, help='JSONL с полем text для проверки паритета')
+    parser.add_argument('--min-cosine', type=float, default=0.9999)
+    parser.add_argument('--opset', type=int, default=14)
+    args = parser.parse_args()
+
+    st_model = load_sentence_transformer(args.model)
+    onnx_path = export(st_model, args.output_dir, args.opset)
+
+    report = check_parity(st_model, onnx_path, args.classifier, read_texts(args.texts), args.min_cosine)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not report['passed']:
+        print("❌ ONNX-энкодер расходится с sentence-transformers")
+        sys.exit(1)
+    print("✅ Паритет с sentence-transformers подтвержден")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Временные модели не должны попадать в кэш оптимизированных графов сервиса
+os.environ['ORT_OPTIMIZED_MODEL_DIR'] = ''
+
+import numpy as np
+import onnxruntime
+from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic,
+                                      quantize_static)
+
+import normalizer
+from encoders import OnnxEncoder, create_encoder
+from inference import DEFAULT_LABELS
+from onnx_session import quantized_path
+from registry import ModelBundle
+
+class FeedReader(CalibrationDataReader):
+    """Отдает калибровочные входы модели по одному батчу"""
+
+    def __init__(self, feeds: list[dict[str, np.ndarray]]):
+        self.feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self.feeds, None)
+
+
+def classifier_feeds(embeddings: np.ndarray, batch_size: int = 32) -> list[dict[str, np.ndarray]]:
+    return [{'inputs': embeddings[i:i + batch_size]} for i in range(0, len(embeddings), batch_size)]
+
+
+def encoder_feeds(encoder: OnnxEncoder, texts: list[str]) -> list[dict[str, np.ndarray]]:
+    # Статическая калибровка по одному тексту: без паддинга длины последовательностей не смешиваются
+    feeds = []
+    for encoding in encoder.tokenizer.encode_batch(texts):
+        feed = {
+            'input_ids': np.array([encoding.ids], dtype=np.int64),
+            'attention_mask': np.array([encoding.attention_mask], dtype=np.int64),
+        }
+        if 'token_type_ids' in encoder.input_names:
+            feed['token_type_ids'] = np.array([encoding.type_ids], dtype=np.int64)
+        feeds.append(feed)
+    return feeds
+
+
+def quantize(model_path: str, output_path: str, mode: str, feeds: list[dict[str, np.ndarray]] | None = None):
+    """Динамическая (веса INT8, активации квантуются на лету) или статическая (QDQ) квантизация"""
+    if mode == 'dynamic':
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8)
+    else:
+        quantize_static(
+            model_path, output_path, FeedReader(feeds),
+            quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        )
+    print(f"✅ {model_path} -> {output_path} ({mode})")
+
+
+def classify(session: onnxruntime.InferenceSession, embeddings: np.ndarray) -> np.ndarray:
+    return np.argmax(session.run(None, {'inputs': embeddings.astype(np.float32)})[0], axis=1)
+
+
+def evaluate(reference: np.ndarray, candidate: np.ndarray, gold: np.ndarray | None, labels: list[str]) -> dict:
+    """Согласие меток INT8 с FP32 в целом и по классам, точность по классам при наличии разметки"""
+    report = {'texts': int(len(reference)), 'label_agreement': float(np.mean(reference == candidate)), 'per_class': {}}
+    for number, label in enumerate(labels):
+        mask = reference == number
+        per_class = {'fp32_count': int(mask.sum())}
+        if mask.any():
+            per_class['agreement'] = float(np.mean(candidate[mask] == number))
+        if gold is not None and (gold == number).any():
+            gold_mask = gold == number
+            per_class['fp32_accuracy'] = float(np.mean(reference[gold_mask] == number))
+            per_class['int8_accuracy'] = float(np.mean(candidate[gold_mask] == number))
+        report['per_class'][label] = per_class
+    if gold is not None:
+        report['fp32_accuracy'] = float(np.mean(reference == gold))
+        report['int8_accuracy'] = float(np.mean(candidate == gold))
+    return report
+
+
+def read_dataset(path: str, labels: list[str] | None = None) -> tuple[list[str], np.ndarray | None]:
+    """JSONL с полем text и необязательным label (имя метки или ее номер).
+
+    Без labels разметка не читается. Строки с меткой, которой нет среди labels,
+    пропускаются: сравнивать их с предсказаниями модели не с чем.
+    """
+    texts, gold, unknown = [], [], {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            label = item.get('label')
+            if labels is not None and label is not None:
+                number = labels.index(label) if label in labels else label
+                if isinstance(number, str) or not 0 <= number < len(labels):
+                    unknown[label] = unknown.get(label, 0) + 1
+                    continue
+                label = number
+            texts.append(item['text'])
+            gold.append(label)
+    if unknown:
+        print(f"❌ В {path} пропущено {sum(unknown.values())} строк с метками не из {labels}: {unknown}")
+    if labels is None or any(label is None for label in gold):
+        return texts, None
+    return texts, np.array(gold)
+
+
+def model_size_mb(path: str) -> float:
+    return os.path.getsize(path) / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='INT8-квантизация классификатора и энкодера с проверкой точности')
+    parser.add_argument('--target', choices=['classifier', 'encoder', 'both'], default='classifier')
+    parser.add_argument('--mode', choices=['dynamic', 'static'], default='dynamic')
+    parser.add_argument('--bundle', default=None, help='Каталог бандла из registry.py: метки и классификатор берутся из bundle.yaml')
+    parser.add_argument('--classifier', default=None, help='По умолчанию классификатор бандла или model.onnx')
+    parser.add_argument('--encoder', default='encoder/encoder.onnx', help='Энкодер из functions/export_encoder.py')
+    parser.add_argument('--texts', required=True, help='Размеченный JSONL с полями text и label для оценки')
+    parser.add_argument('--min-texts', type=int, default=500, help='Минимум размеченных текстов для проверки точности')
+    parser.add_argument('--calibration-texts', default=None, help='JSONL с полем text для статической калибровки')
+    parser.add_argument('--calibration-size', type=int, default=256)
+    parser.add_argument('--min-agreement', type=float, default=0.99, help='Минимальное согласие меток с FP32')
+    parser.add_argument('--min-class-agreement', type=float, default=0.97, help='Минимальное согласие по каждому классу')
+    parser.add_argument('--report', default=None, help='Куда сохранить отчет JSON')
+    args = parser.parse_args()
+
+    quantize_classifier = args.target in ('classifier', 'both')
+    quantize_encoder = args.target in ('encoder', 'both')
+
+    # Метки в порядке выходов классификатора: из бандла или те же, что у сервиса по умолчанию
+    bundle = ModelBundle.from_dir(args.bundle, '', '') if args.bundle else None
+    labels = (bundle.labels if bundle else None) or DEFAULT_LABELS
+    args.classifier = args.classifier or (bundle.classifier if bundle else None) or 'model.onnx'
+    classes = onnxruntime.InferenceSession(args.classifier).get_outputs()[0].shape[-1]
+    if isinstance(classes, int) and classes != len(labels):
+        parser.error(f"У {args.classifier} {classes} выходов, а меток {len(labels)}: {labels}")
+
+    texts, gold = read_dataset(args.texts, labels)
+    # На горстке текстов согласие почти всегда 100%: такая проверка ничего не гарантирует
+    if gold is None:
+        parser.error(f"В {args.texts} не у всех строк есть label: проверка точности требует разметки")
+    if len(texts) < args.min_texts:
+        parser.error(f"В {args.texts} {len(texts)} текстов, для проверки нужно не меньше {args.min_texts}")
+    calibration_texts = read_dataset(args.calibration_texts)[0] if args.calibration_texts else texts
+    calibration_texts = normalizer.normalize_batch(calibration_texts[:args.calibration_size])
+    normalized = normalizer.normalize_batch(texts)
+
+    # FP32-путь: ONNX-энкодер, если квантуем его, иначе энкодер сервиса по INFERENCE_BACKEND
+    fp32_encoder = OnnxEncoder(args.encoder) if quantize_encoder else create_encoder()
+    tokenizer_path = getattr(fp32_encoder, 'tokenizer_path', None)
+
+    work_dir = tempfile.mkdtemp(prefix='quantize_')
+    outputs = {}
+    try:
+        if quantize_encoder:
+            output = os.path.join(work_dir, 'encoder.int8.onnx')
+            feeds = encoder_feeds(fp32_encoder, calibration_texts) if args.mode == 'static' else None
+            quantize(args.encoder, output, args.mode, feeds)
+            outputs[output] = quantized_path(args.encoder)
+
+        if quantize_classifier:
+            output = os.path.join(work_dir, 'model.int8.onnx')
+            feeds = None
+            if args.mode == 'static':
+                feeds = classifier_feeds(np.asarray(fp32_encoder.encode(calibration_texts), dtype=np.float32))
+            quantize(args.classifier, output, args.mode, feeds)
+            outputs[output] = quantized_path(args.classifier)
+
+        int8_encoder = OnnxEncoder(os.path.join(work_dir, 'encoder.int8.onnx'), tokenizer_path) \
+            if quantize_encoder else fp32_encoder
+        fp32_classifier = onnxruntime.InferenceSession(args.classifier)
+        int8_classifier = onnxruntime.InferenceSession(os.path.join(work_dir, 'model.int8.onnx')) \
+            if quantize_classifier else fp32_classifier
+
+        start = time.perf_counter()
+        reference = classify(fp32_classifier, np.asarray(fp32_encoder.encode(normalized), dtype=np.float32))
+        fp32_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        candidate = classify(int8_classifier, np.asarray(int8_encoder.encode(normalized), dtype=np.float32))
+        int8_seconds = time.perf_counter() - start
+
+        report = evaluate(reference, candidate, gold, labels)
+        report.update({
+            'target': args.target,
+            'mode': args.mode,
+            'fp32_seconds': round(fp32_seconds, 4),
+            'int8_seconds': round(int8_seconds, 4),
+            'sizes_mb': {
+                destination: {'fp32': round(model_size_mb(destination.replace('.int8', '')), 2),
+                              'int8': round(model_size_mb(source), 2)}
+                for source, destination in outputs.items()
+            },
+        })
+        class_agreements = [value['agreement'] for value in report['per_class'].values() if 'agreement' in value]
+        report['passed'] = (report['label_agreement'] >= args.min_agreement
+                            and all(value >= args.min_class_agreement for value in class_agreements))
+
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        if not report['passed']:
+            print("❌ INT8-модель расходится с FP32 сильнее допустимого, файлы не сохранены")
+            sys.exit(1)
+
+        for source, destination in outputs.items():
+            shutil.move(source, destination)
+            print(f"✅ INT8-модель сохранена в: {destination}")
+        if quantize_classifier:
+            print("✅ Классификатор включается через INFERENCE_PRECISION=int8")
+        if quantize_encoder:
+            print("✅ Энкодер включается через INFERENCE_ENCODER_PRECISION=int8")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,16 @@ from sentence_transformers import SentenceTransformer
 import os
 
 
-model_path = "E:/pet/Inference_models_using_FastAPI/functions/all-MiniLM-L6-v2"
+model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "all-MiniLM-L6-v2")
 
 
-print("Скачивание модели...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-model.save(model_path)
-print(f"Модель сохранена в: {model_path}")
\ No newline at end of file
+def save_model(model_name: str = 'all-MiniLM-L6-v2', path: str = model_path) -> SentenceTransformer:
+    print("Скачивание модели...")
+    model = SentenceTransformer(model_name)
+    model.save(path)
+    print(f"Модель сохранена в: {path}")
+    return model
+
+
+if __name__ == '__main__':
+    save_model()
\ No newline at end of file
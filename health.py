@@ -0,0 +1,32 @@
+import os
+
+from fastapi import APIRouter
+from starlette.responses import JSONResponse
+
+import database.logger
+from routers import registry
+
+router = APIRouter(prefix='/health')
+
+# Ждать ли ClickHouse для готовности: без него логи копятся в журнале, предсказания работают
+READY_REQUIRES_DATABASE = os.environ.get('HEALTH_READY_REQUIRES_DATABASE', '0') == '1'
+
+
+@router.get('/live')
+async def live_endpoint():
+    """Процесс жив и event loop отвечает"""
+    return {'status': 'alive'}
+
+
+@router.get('/ready')
+async def ready_endpoint():
+    """Модель по умолчанию загружена и прогрета, можно принимать трафик"""
+    database_connected = database.logger.database is not None
+    model_ready = registry.ready
+    ready = model_ready and (database_connected or not READY_REQUIRES_DATABASE)
+    content = {
+        'status': 'ready' if ready else 'starting',
+        'model': 'ready' if model_ready else 'loading',
+        'database': 'connected' if database_connected else 'connecting',
+    }
+    return JSONResponse(content=content, status_code=200 if ready else 503)
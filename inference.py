@@ -1,58 +1,184 @@
-import re
-import contractions
-from sentence_transformers import SentenceTransformer
 import onnx
 import onnxruntime
 import numpy as np
+import os
+import normalizer
+from onnx_session import BoundSession, create_session, io_binding_enabled, resolve_model_path
+from cache import LRUCache
+from encoders import create_encoder
+from metrics import (INFERENCE_BATCH_SIZE, INFERENCE_STAGE_SECONDS, SEMANTIC_CACHE_EVICTIONS_TOTAL,
+                     SEMANTIC_CACHE_LOOKUPS_TOTAL)
+from semantic_cache import SemanticCache
+
+DEFAULT_LABELS = ["joy", "sadness", "fear", "anger"]
+
 
-model = SentenceTransformer('all-MiniLM-L6-v2')
 class Inference:
-        def __init__(self):
-            self.model_path = "model.onnx"
+        # Без аргументов модель и энкодер берутся из INFERENCE_*; аргументы передает бандл из registry.py
+        def __init__(self, model_path: str | None = None, encoder_backend: str | None = None,
+                     encoder_path: str | None = None, tokenizer_path: str | None = None,
+                     labels: list[str] | None = None):
+            self.model_path = resolve_model_path(model_path or os.environ.get('INFERENCE_MODEL_PATH', "model.onnx"))
+            self.word_to_number = {label: number for number, label in enumerate(labels or DEFAULT_LABELS)}
             self.__load_model()
-            self.word_to_number = {
-                "joy": 0,
-                "sadness": 1,
-                "fear": 2,
-                "anger": 3
-            }
+            self.encoder = create_encoder(encoder_backend, encoder_path, tokenizer_path)
 
             self.number_to_word = {v: k for k, v in self.word_to_number.items()}
+            self.encode_batch_size = int(os.environ.get('INFERENCE_ENCODE_BATCH_SIZE', 64))
+            self.__init_cache()
+            self.__init_semantic_cache()
+            self.__init_metrics()
             
+        # Настройки сессии из ORT_*, оптимизированный граф кэшируется на диске
         def __load_model(self):
-            self.NN = onnxruntime.InferenceSession( self.model_path)
+            self.NN = create_session(self.model_path)
+            self.input_name = self.NN.get_inputs()[0].name
+            # Ширина эмбеддинга из графа: у бандлов с другим энкодером она не 384
+            width = self.NN.get_inputs()[0].shape[-1]
+            self.embedding_dim = width if isinstance(width, int) else 384
+            output = self.NN.get_outputs()[0]
+            # Число классов тоже из графа: метки бандла должны совпадать с выходами модели
+            classes = output.shape[-1] if isinstance(output.shape[-1], int) else len(self.word_to_number)
+            if classes != len(self.word_to_number):
+                raise ValueError(f"У {self.model_path} {classes} выходов, а меток {len(self.word_to_number)}: "
+                                 f"{list(self.word_to_number)}")
+            self.bound_NN = BoundSession(self.NN, output.name, classes) if io_binding_enabled() else None
+
+        # Кэш по нормализованному тексту: готовые метки (labels) или эмбеддинги (embeddings)
+        def __init_cache(self):
+            self.cache_mode = os.environ.get('INFERENCE_CACHE_MODE', 'labels')
+            if self.cache_mode not in ('labels', 'embeddings', 'off'):
+                raise ValueError(f"Неизвестный режим кэша: {self.cache_mode}")
+
+            self.cache = None
+            if self.cache_mode != 'off':
+                ttl = float(os.environ.get('INFERENCE_CACHE_TTL_S', 0))
+                self.cache = LRUCache(
+                    max_entries=int(os.environ.get('INFERENCE_CACHE_SIZE', 100000)),
+                    max_bytes=int(float(os.environ.get('INFERENCE_CACHE_MAX_MB', 64)) * 1024 * 1024),
+                    ttl=ttl or None
+                )
         
 
+        # Метки по близости эмбеддингов (INFERENCE_SEMANTIC_CACHE=1): ловит перефразирования, которые точный кэш пропускает
+        # Экономит только классификатор после энкодера: окупается, если он заметно дороже поиска по буферу
+        def __init_semantic_cache(self):
+            self.semantic_cache = None
+            if os.environ.get('INFERENCE_SEMANTIC_CACHE', '0') == '1':
+                self.semantic_cache = SemanticCache(
+                    dim=self.embedding_dim,
+                    max_entries=int(os.environ.get('INFERENCE_SEMANTIC_CACHE_SIZE', 10000)),
+                    threshold=float(os.environ.get('INFERENCE_SEMANTIC_CACHE_THRESHOLD', 0.95))
+                )
+
+        # Гистограммы этапов, дочерние объекты берем один раз, чтобы не искать их на каждом батче
+        def __init_metrics(self):
+            self.stage_normalize = INFERENCE_STAGE_SECONDS.labels('normalize')
+            self.stage_cache = INFERENCE_STAGE_SECONDS.labels('cache_lookup')
+            self.stage_encode = INFERENCE_STAGE_SECONDS.labels('encode')
+            self.stage_onnx_run = INFERENCE_STAGE_SECONDS.labels('onnx_run')
+            self.stage_argmax = INFERENCE_STAGE_SECONDS.labels('argmax')
+            self.stage_semantic_cache = INFERENCE_STAGE_SECONDS.labels('semantic_cache')
+            self.semantic_hits = SEMANTIC_CACHE_LOOKUPS_TOTAL.labels('hit')
+            self.semantic_misses = SEMANTIC_CACHE_LOOKUPS_TOTAL.labels('miss')
+
         def fix_puntuation(self,text):
-            return re.sub("`","'",text)
+            return normalizer.fix_punctuation(text)
 
         # заменяем английские сокращения на слова "I'm" → "I am"
         def fix_contraction(self,text):
-            return contractions.fix(text)
+            return normalizer.fix_contractions(text)
 
         # Удаляем все символы, кроме английских букв
         def cleaning(self,text):
-            text = re.sub(r'[^a-zA-Z]|https?://\S+|www\.\S+|<.*?|0-9>', " ", text)
-            text = re.sub(r'\s+', ' ', text)
-            return text
+            return normalizer.clean(text)
+
+        # Вся цепочка нормализации за несколько проходов предкомпилированными выражениями
+        def normalize(self, text) -> str:
+            return normalizer.normalize(text)
+
+        def normalize_batch(self, texts: list[str]) -> list[str]:
+            return normalizer.normalize_batch(texts)
 
+        def encode(self, normalized: list[str]) -> np.ndarray:
+            with self.stage_encode.time():
+                return self.encoder.encode(normalized, batch_size=min(len(normalized), self.encode_batch_size))
 
         def preprocces(self,text):
-            text = str(text)
-            text = self.fix_puntuation(text)
-            text = self.fix_contraction(text)
-            text = self.cleaning(text)
-            text = text.lower()
-            self.embeddings = model.encode(text)
-            return self.embeddings
-        
-        def __call__(self, text: str) -> np.ndarray:
-            inputs = self.preprocces(text)
-            inputs = np.array(inputs, dtype=np.float32)
-            input_data = inputs.reshape(1, -1)  # (1, 384)
-
-            output = self.NN.run(None, {'inputs': input_data})[0]
-            predicted = np.argmax(output, axis=1)
-            return self.number_to_word[predicted[0]]
+            text = self.normalize(text)
+            return self.encode([text])[0]
+
+        # Классифицируем готовые эмбеддинги одним прогоном ONNX-сессии
+        def classify(self, embeddings: np.ndarray) -> list[str]:
+            input_data = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.embedding_dim)  # (N, 384)
+            with self.stage_onnx_run.time():
+                if self.bound_NN is not None:
+                    output = self.bound_NN.run({self.input_name: input_data})
+                else:
+                    output = self.NN.run(None, {self.input_name: input_data})[0]
+            with self.stage_argmax.time():
+                predicted = np.argmax(output, axis=1)
+                return [self.number_to_word[int(number)] for number in predicted]
+
+        # Классификатор только для эмбеддингов, которых нет в семантическом кэше
+        def classify_embeddings(self, embeddings: np.ndarray) -> list[str]:
+            if self.semantic_cache is None:
+                return self.classify(embeddings)
+
+            embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.embedding_dim)
+            with self.stage_semantic_cache.time():
+                cached = self.semantic_cache.lookup(embeddings)
+            missing = np.flatnonzero(cached < 0)
+            self.semantic_hits.inc(len(cached) - len(missing))
+            self.semantic_misses.inc(len(missing))
+
+            labels = [self.number_to_word[int(number)] if number >= 0 else None for number in cached]
+            if len(missing):
+                computed = self.classify(embeddings[missing])
+                evicted = self.semantic_cache.add(embeddings[missing], [self.word_to_number[label] for label in computed])
+                SEMANTIC_CACHE_EVICTIONS_TOTAL.inc(evicted)
+                for index, label in zip(missing, computed):
+                    labels[index] = label
+            return labels
+
+        # Один вызов энкодера и одна сессия ONNX на весь батч
+        def predict_batch(self, texts: list[str]) -> list[str]:
+            if not texts:
+                return []
+            INFERENCE_BATCH_SIZE.observe(len(texts))
+            with self.stage_normalize.time():
+                normalized = self.normalize_batch(texts)
+            if self.cache is None:
+                return self.classify_embeddings(self.encode(normalized))
+
+            with self.stage_cache.time():
+                cached = [self.cache.get(text) for text in normalized]
+            # Считаем только промахи, повторы внутри батча — один раз
+            missing = list(dict.fromkeys(text for text, value in zip(normalized, cached) if value is None))
+
+            if self.cache_mode == 'labels':
+                # Попадание в кэш пропускает и энкодер, и ONNX-классификатор
+                computed = dict(zip(missing, self.classify_embeddings(self.encode(missing)))) if missing else {}
+            else:
+                # Копия строки: вид на батч держал бы в памяти весь массив, и лимит кэша не соблюдался бы
+                computed = {text: np.array(row) for text, row in zip(missing, self.encode(missing))} if missing else {}
+
+            for text, value in computed.items():
+                self.cache.put(text, value)
+
+            values = [computed[text] if value is None else value for text, value in zip(normalized, cached)]
+            if self.cache_mode == 'labels':
+                return values
+            return self.classify_embeddings(np.stack(values))
+
+        # Прогон фиктивных текстов мимо кэша: первые вызовы энкодера и ONNX-сессии самые медленные
+        def warmup(self, batch_sizes: tuple[int, ...] = (1, 32)):
+            texts = ["i feel warm and ready", "warming up the model before traffic arrives"]
+            for batch_size in batch_sizes:
+                batch = [texts[i % len(texts)] for i in range(batch_size)]
+                self.classify(self.encode(self.normalize_batch(batch)))
+
+        def __call__(self, text: str) -> str:
+            return self.predict_batch([text])[0]
             
             
\ No newline at end of file
@@ -0,0 +1,459 @@
+"""Легковесные метрики в текстовом формате Prometheus.
+
+Горячий путь не берет блокировок: каждый поток пишет в собственный шард
+(threading.local), а сумма по шардам считается только при чтении /metrics.
+Блокировка нужна лишь при первом обращении нового потока или нового
+набора меток.
+"""
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин по умолчанию, секунды: от 100 мкс до 10 с
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _render_family(name: str, family: dict) -> list[str]:
+    """Строки текстового формата для метрики из snapshot()"""
+    documentation = family['documentation'].replace('\\', '\\\\').replace('\n', '\\n')
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {family["type"]}']
+    labelnames = tuple(family['labelnames'])
+    for key, totals in family['samples']:
+        key = tuple(key)
+        if family['type'] != 'histogram':
+            lines.append(f'{name}{_format_labels(labelnames, key)} {_format_value(totals[0])}')
+            continue
+        cumulative = 0.0
+        for bound, count in zip(tuple(family['buckets']) + (math.inf,), totals):
+            cumulative += count
+            labels = _format_labels(labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f'{name}_bucket{labels} {_format_value(cumulative)}')
+        labels = _format_labels(labelnames, key)
+        lines.append(f'{name}_sum{labels} {_format_value(totals[-2])}')
+        lines.append(f'{name}_count{labels} {_format_value(totals[-1])}')
+    return lines
+
+
+def _escape_label_value(value) -> str:
+    # Текстовый формат Prometheus: в значении метки экранируются обратная косая черта, кавычка и перевод строки
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    # Значения меток приходят и извне, например метки классов из bundle.yaml
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Child:
+    """Значение метрики для одного набора меток, разбитое на шарды по потокам"""
+
+    def __init__(self, shard_size: int):
+        self._shard_size = shard_size
+        self._local = threading.local()
+        self._shards: list[list[float]] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> list[float]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = [0.0] * self._shard_size
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _totals(self) -> list[float]:
+        with self._lock:
+            shards = list(self._shards)
+        totals = [0.0] * self._shard_size
+        for shard in shards:
+            for index, value in enumerate(shard):
+                totals[index] += value
+        return totals
+
+    def _reset(self):
+        # Только для однопоточных воркеров (см. drain)
+        with self._lock:
+            for shard in self._shards:
+                shard[:] = [0.0] * self._shard_size
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 registry: 'Registry | None' = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], _Child] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self) -> _Child:
+        raise NotImplementedError
+
+    def labels(self, *values) -> _Child:
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получено {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self) -> _Child:
+        return self.labels()
+
+    def _items(self) -> list[tuple[tuple[str, ...], _Child]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def samples(self) -> dict[tuple[str, ...], list[float]]:
+        """Текущие суммы по шардам для каждого набора меток"""
+        return {key: child._totals() for key, child in self._items()}
+
+    def snapshot(self) -> dict:
+        return {
+            'type': self.type_name,
+            'documentation': self.documentation,
+            'labelnames': list(self.labelnames),
+            'buckets': list(getattr(self, 'buckets', ())),
+            'samples': [[list(key), totals] for key, totals in self.samples().items()],
+        }
+
+    def render(self) -> list[str]:
+        return _render_family(self.name, self.snapshot())
+
+    def drain(self) -> dict[tuple[str, ...], list[float]]:
+        """Забирает накопленные значения и обнуляет их.
+
+        Используется в процессах-воркерах пула, где инференс идет в одном
+        потоке: значения передаются в основной процесс вместе с результатом.
+        """
+        drained = {}
+        for key, child in self._items():
+            totals = child._totals()
+            if any(totals):
+                drained[key] = totals
+                child._reset()
+        return drained
+
+    def merge(self, drained: dict[tuple[str, ...], list[float]]):
+        """Добавляет значения, полученные из drain() в другом процессе"""
+        for key, totals in drained.items():
+            shard = self.labels(*key)._shard()
+            for index, value in enumerate(totals):
+                shard[index] += value
+
+
+class _CounterChild(_Child):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: float = 1):
+        self._shard()[0] += amount
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+
+class _GaugeChild(_Child):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: float = 1):
+        self._shard()[0] += amount
+
+    def dec(self, amount: float = 1):
+        self._shard()[0] -= amount
+
+
+class Gauge(_Metric):
+    """Gauge из шардов (inc/dec) или из функции, которая вызывается при чтении"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 registry: 'Registry | None' = None, function: Callable[[], float] | None = None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._function = function
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    @contextmanager
+    def track_in_progress(self, *labelvalues):
+        child = self.labels(*labelvalues)
+        child.inc()
+        try:
+            yield
+        finally:
+            child.dec()
+
+    def samples(self) -> dict[tuple[str, ...], list[float]]:
+        if self._function is not None:
+            return {(): [float(self._function())]}
+        return super().samples()
+
+
+class _HistogramChild(_Child):
+    # Шард: счетчики корзин (последняя — +Inf), сумма, количество
+    def __init__(self, buckets: tuple[float, ...]):
+        self._buckets = buckets
+        super().__init__(len(buckets) + 3)
+
+    def observe(self, value: float):
+        shard = self._shard()
+        shard[bisect.bisect_left(self._buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 registry: 'Registry | None' = None, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def _all(self) -> list[_Metric]:
+        with self._lock:
+            return list(self._metrics)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._all():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        return {metric.name: metric.snapshot() for metric in self._all()}
+
+
+REGISTRY = Registry()
+
+# Каталог, через который процессы serve.py обмениваются метриками; пусто — один процесс
+MULTIPROCESS_DIR_ENV = 'METRICS_MULTIPROCESS_DIR'
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def write_snapshot(directory: str):
+    """Сохраняет метрики процесса в <pid>.json: запись во временный файл и переименование"""
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(REGISTRY.snapshot(), f)
+    os.replace(temp_path, path)
+
+
+def merge_snapshots(snapshots: list[tuple[int, dict]]) -> dict:
+    """Складывает метрики процессов. Gauge берутся только у живых процессов,
+    счетчики и гистограммы завершившихся воркеров продолжают учитываться."""
+    merged: dict[str, dict] = {}
+    for pid, snapshot in snapshots:
+        alive = _pid_alive(pid)
+        for name, family in snapshot.items():
+            if family['type'] == 'gauge' and not alive:
+                continue
+            target = merged.setdefault(name, {**family, 'samples': {}})
+            for key, totals in family['samples']:
+                key = tuple(key)
+                current = target['samples'].get(key)
+                target['samples'][key] = totals if current is None else [a + b for a, b in zip(current, totals)]
+    for family in merged.values():
+        family['samples'] = sorted(family['samples'].items())
+    return merged
+
+
+def _is_snapshot_file(name: str) -> bool:
+    # Только файлы, которые пишет write_snapshot: <pid>.json и <pid>.json.tmp
+    stem = name.removesuffix('.tmp')
+    return stem.endswith('.json') and stem[:-len('.json')].isdigit()
+
+
+def clear_snapshots(directory: str) -> int:
+    """Удаляет снимки прошлого запуска; чужие файлы в каталоге не трогает"""
+    removed = 0
+    for name in os.listdir(directory):
+        if _is_snapshot_file(name):
+            try:
+                os.remove(os.path.join(directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def read_snapshots(directory: str) -> list[tuple[int, dict]]:
+    snapshots = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json') or not _is_snapshot_file(name):
+            continue
+        try:
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                snapshots.append((int(name[:-len('.json')]), json.load(f)))
+        except (OSError, ValueError):
+            # Файл мог исчезнуть или быть поврежден при падении воркера
+            continue
+    return snapshots
+
+
+def render() -> str:
+    directory = os.environ.get(MULTIPROCESS_DIR_ENV)
+    if not directory:
+        return REGISTRY.render()
+
+    # Свой снимок пишем прямо перед чтением, снимки других воркеров обновляет start_snapshot_writer
+    write_snapshot(directory)
+    lines = []
+    for name, family in merge_snapshots(read_snapshots(directory)).items():
+        lines.extend(_render_family(name, family))
+    return '\n'.join(lines) + '\n'
+
+
+def start_snapshot_writer(interval: float | None = None):
+    """Фоновый поток, периодически сохраняющий метрики процесса для соседних воркеров"""
+    directory = os.environ.get(MULTIPROCESS_DIR_ENV)
+    if not directory:
+        return None
+    interval = interval or float(os.environ.get('METRICS_SNAPSHOT_INTERVAL_S', 1.0))
+
+    def write_forever():
+        while True:
+            try:
+                write_snapshot(directory)
+            except OSError as e:
+                print(f"❌ Не удалось сохранить метрики: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=write_forever, name='metrics-snapshot', daemon=True)
+    thread.start()
+    return thread
+
+
+# Метрики сервиса
+
+INFERENCE_STAGE_SECONDS = Histogram(
+    'inference_stage_seconds', 'Время этапа Inference.predict_batch на весь батч', ('stage',)
+)
+INFERENCE_BATCH_SIZE = Histogram(
+    'inference_batch_size', 'Число текстов в вызове Inference.predict_batch', buckets=SIZE_BUCKETS
+)
+PREDICTIONS_TOTAL = Counter('predictions_total', 'Число предсказаний по меткам', ('label',))
+MODEL_SWAPS_TOTAL = Counter('model_swaps_total', 'Переключения активной версии модели', ('model',))
+SEMANTIC_CACHE_LOOKUPS_TOTAL = Counter(
+    'semantic_cache_lookups_total', 'Поиск меток в семантическом кэше по эмбеддингам', ('result',)
+)
+SEMANTIC_CACHE_EVICTIONS_TOTAL = Counter('semantic_cache_evictions_total', 'Вытесненные записи семантического кэша')
+SHADOW_PREDICTIONS_TOTAL = Counter(
+    'shadow_predictions_total', 'Предсказания теневой версии: совпали, разошлись с основной или пропущены',
+    ('model', 'version', 'result')
+)
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP-запросы, которые обрабатываются сейчас')
+HTTP_REQUEST_SECONDS = Histogram('http_request_seconds', 'Полное время обработки HTTP-запроса', ('method',))
+LOG_MIDDLEWARE_SECONDS = Histogram('log_middleware_seconds', 'Время LogMiddleware после ответа обработчика')
+
+ADMISSION_IN_FLIGHT = Gauge('admission_in_flight', 'Запросы, допущенные к инференсу')
+ADMISSION_QUEUE_DEPTH = Gauge('admission_queue_depth', 'Запросы в очереди допуска')
+ADMISSION_QUEUE_WAIT_SECONDS = Histogram('admission_queue_wait_seconds', 'Ожидание в очереди допуска')
+ADMISSION_SHED_TOTAL = Counter('admission_shed_total', 'Отброшенные запросы по причинам', ('reason',))
+
+CLICKHOUSE_INSERT_SECONDS = Histogram('clickhouse_insert_seconds', 'Длительность вставки пачки логов в ClickHouse')
+CLICKHOUSE_INSERT_BATCH_SIZE = Histogram(
+    'clickhouse_insert_batch_size', 'Число записей в пачке логов для ClickHouse', buckets=SIZE_BUCKETS
+)
+CLICKHOUSE_INSERT_FAILURES = Counter('clickhouse_insert_failures_total', 'Неудачные попытки вставки логов')
+LOG_SHIPPER_QUEUE_DEPTH = Gauge('log_shipper_queue_depth', 'Записи логов, ожидающие отправки')
+
+
+class MetricsMiddleware:
+    """ASGI middleware: число запросов в обработке и полное время ответа"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        with HTTP_REQUESTS_IN_FLIGHT.track_in_progress(), HTTP_REQUEST_SECONDS.labels(scope['method']).time():
+            await self.app(scope, receive, send)
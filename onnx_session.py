@@ -0,0 +1,249 @@
+"""Создание сессий ONNX Runtime с настройками из окружения.
+
+Оптимизированный граф сохраняется на диск и переиспользуется при следующих
+запусках, выходы можно писать в заранее выделенные буферы через IOBinding.
+"""
+import hashlib
+import os
+import platform
+import tempfile
+import threading
+
+import numpy as np
+import onnxruntime
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+
+PRECISIONS = ('fp32', 'int8')
+# Переменная с точностью для каждого артефакта модели
+PRECISION_ENV = {'classifier': 'INFERENCE_PRECISION', 'encoder': 'INFERENCE_ENCODER_PRECISION'}
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+def default_intra_op_threads() -> int:
+    """Потоков на сессию: в режиме process ядра делятся между процессами пула.
+
+    0 — решает ONNX Runtime (по числу ядер), что при нескольких воркерах
+    на хосте приводит к переподписке.
+    """
+    if os.environ.get('INFERENCE_POOL_MODE', 'thread') != 'process':
+        return 0
+    workers = int(os.environ.get('INFERENCE_POOL_SIZE', 2))
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def optimization_level() -> str:
+    # extended, а не all: all добавляет только раскладки NCHWc для сверток, которых у нас нет,
+    # зато делает сохраненный граф зависимым от конкретного процессора
+    return os.environ.get('ORT_GRAPH_OPTIMIZATION', 'extended')
+
+
+def quantized_path(model_path: str) -> str:
+    """Путь INT8-версии модели рядом с исходной: model.onnx -> model.int8.onnx"""
+    base, extension = os.path.splitext(model_path)
+    return f'{base}.int8{extension}'
+
+
+def resolve_model_path(model_path: str, kind: str = 'classifier') -> str:
+    """Выбирает FP32 или INT8-файл модели по точности для своего артефакта.
+
+    Точность классификатора задает INFERENCE_PRECISION, энкодера —
+    INFERENCE_ENCODER_PRECISION: quantize_model.py по умолчанию квантует
+    только классификатор. INT8-версии он кладет рядом с исходными.
+    """
+    env = PRECISION_ENV[kind]
+    precision = os.environ.get(env, 'fp32')
+    if precision not in PRECISIONS:
+        raise ValueError(f"Неизвестная точность модели в {env}: {precision}")
+    path = model_path
+    if precision == 'int8':
+        path = quantized_path(model_path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Нет INT8-модели {path} ({env}=int8), запустите functions/quantize_model.py")
+    print(f"✅ {kind}: {path} ({precision})")
+    return path
+
+
+def session_options() -> onnxruntime.SessionOptions:
+    """SessionOptions из переменных окружения ORT_*"""
+    options = onnxruntime.SessionOptions()
+
+    level = optimization_level()
+    if level not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError(f"Неизвестный уровень оптимизации графа: {level}")
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[level]
+
+    mode = os.environ.get('ORT_EXECUTION_MODE', 'sequential')
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Неизвестный режим выполнения: {mode}")
+    options.execution_mode = EXECUTION_MODES[mode]
+
+    intra_op_threads = os.environ.get('ORT_INTRA_OP_THREADS')
+    options.intra_op_num_threads = int(intra_op_threads) if intra_op_threads else default_intra_op_threads()
+    options.inter_op_num_threads = int(os.environ.get('ORT_INTER_OP_THREADS', 0))
+
+    options.enable_cpu_mem_arena = _env_flag('ORT_ENABLE_CPU_MEM_ARENA', '1')
+    options.enable_mem_pattern = _env_flag('ORT_ENABLE_MEM_PATTERN', '1')
+    # Ожидание в активном цикле ускоряет короткие прогоны, но жжет ядра, занятые соседними воркерами
+    if not _env_flag('ORT_ALLOW_SPINNING', '1'):
+        options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+    return options
+
+
+def _optimized_model_path(model_path: str, level: str, cache_dir: str) -> str:
+    """Путь кэша: зависит от содержимого модели, уровня оптимизации, версии ORT и платформы"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    digest.update(f'{level}|{onnxruntime.__version__}|{platform.machine()}'.encode())
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f'{name}.{digest.hexdigest()[:16]}.onnx')
+
+
+class SharedWeights:
+    """Веса модели в памяти процесса, которые сессии берут без копирования.
+
+    Граф сериализуется без данных инициализаторов (они помечены внешними),
+    а сами тензоры передаются через SessionOptions.add_initializer. Если
+    загрузить веса в родительском процессе до fork, воркеры делят их
+    страницы copy-on-write: ONNX Runtime только читает эти буферы.
+    """
+
+    def __init__(self, model_path: str):
+        import onnx
+        from onnx import numpy_helper
+
+        model = onnx.load(model_path)
+        self.initializers: dict[str, np.ndarray] = {}
+        for initializer in model.graph.initializer:
+            self.initializers[initializer.name] = np.ascontiguousarray(numpy_helper.to_array(initializer))
+            # Данные уже скопированы в массив: освобождаем их в protobuf сразу, а не в конце
+            for field in ('raw_data', 'float_data', 'int32_data', 'int64_data', 'double_data'):
+                initializer.ClearField(field)
+            initializer.data_location = onnx.TensorProto.EXTERNAL
+            del initializer.external_data[:]
+            location = initializer.external_data.add()
+            location.key, location.value = 'location', 'shared-weights'
+        self.model_bytes = model.SerializeToString()
+        self.values = {name: onnxruntime.OrtValue.ortvalue_from_numpy(array) for name, array in self.initializers.items()}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.initializers.values())
+
+    def create_session(self, options: onnxruntime.SessionOptions) -> onnxruntime.InferenceSession:
+        # Предупаковка весов MatMul сделала бы приватную копию всех весов в каждом воркере
+        options.add_session_config_entry('session.disable_prepacking', '1')
+        # Сессия ссылается на OrtValue, а не копирует их: они живут столько же, сколько веса
+        for name, value in self.values.items():
+            options.add_initializer(name, value)
+        return onnxruntime.InferenceSession(self.model_bytes, options)
+
+
+# Веса, загруженные заранее (serve.py до fork), по абсолютному пути модели
+_shared_weights: dict[str, SharedWeights] = {}
+
+
+def preload_shared_weights(model_path: str) -> SharedWeights:
+    """Загружает веса модели один раз; create_session для этого пути будет использовать их"""
+    key = os.path.abspath(model_path)
+    if key not in _shared_weights:
+        _shared_weights[key] = SharedWeights(model_path)
+    return _shared_weights[key]
+
+
+def create_session(model_path: str) -> onnxruntime.InferenceSession:
+    """Создает сессию; оптимизированный граф берет из кэша или сохраняет в него.
+
+    Кэш в каталоге ORT_OPTIMIZED_MODEL_DIR (пустое значение отключает его).
+    Готовый граф загружается без повторной оптимизации. Для моделей с
+    заранее загруженными весами (preload_shared_weights) кэш не используется:
+    сессия строится поверх общих буферов.
+    """
+    options = session_options()
+    shared = _shared_weights.get(os.path.abspath(model_path))
+    if shared is not None:
+        return shared.create_session(options)
+    cache_dir = os.environ.get('ORT_OPTIMIZED_MODEL_DIR', 'onnx_cache')
+    level = optimization_level()
+    if not cache_dir or level == 'disable':
+        return onnxruntime.InferenceSession(model_path, options)
+
+    cached_path = _optimized_model_path(model_path, level, cache_dir)
+    if os.path.exists(cached_path):
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return onnxruntime.InferenceSession(cached_path, options)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Пишем во временный файл и переименовываем: воркеры, стартующие одновременно, не увидят половину файла
+    fd, temp_path = tempfile.mkstemp(suffix='.onnx', dir=cache_dir)
+    os.close(fd)
+    options.optimized_model_filepath = temp_path
+    try:
+        session = onnxruntime.InferenceSession(model_path, options)
+        os.replace(temp_path, cached_path)
+        print(f"✅ Оптимизированная модель сохранена в: {cached_path}")
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return session
+
+
+class BoundSession:
+    """Прогон сессии через IOBinding с выходным буфером, выделенным заранее.
+
+    Буфер свой у каждого потока и растет только при увеличении батча.
+    Результат — представление буфера: его нужно использовать до следующего
+    вызова run в том же потоке.
+    """
+
+    def __init__(self, session: onnxruntime.InferenceSession, output_name: str, output_width: int,
+                 initial_rows: int = 64):
+        self.session = session
+        self.output_name = output_name
+        self.output_width = output_width
+        self.initial_rows = initial_rows
+        self._local = threading.local()
+
+    def _buffers(self, rows: int):
+        local = self._local
+        if not hasattr(local, 'binding'):
+            local.binding = self.session.io_binding()
+            local.output = np.empty((self.initial_rows, self.output_width), dtype=np.float32)
+        if rows > local.output.shape[0]:
+            local.output = np.empty((max(rows, 2 * local.output.shape[0]), self.output_width), dtype=np.float32)
+        return local.binding, local.output
+
+    def run(self, feed: dict[str, np.ndarray]) -> np.ndarray:
+        rows = len(next(iter(feed.values())))
+        binding, output = self._buffers(rows)
+        # Первые rows строк C-непрерывного буфера — тоже непрерывный блок памяти
+        output = output[:rows]
+
+        binding.clear_binding_inputs()
+        binding.clear_binding_outputs()
+        for name, value in feed.items():
+            binding.bind_cpu_input(name, np.ascontiguousarray(value))
+        binding.bind_output(self.output_name, 'cpu', 0, np.float32, list(output.shape), output.ctypes.data)
+        self.session.run_with_iobinding(binding)
+        return output
+
+
+def io_binding_enabled() -> bool:
+    return _env_flag('INFERENCE_IO_BINDING', '1')
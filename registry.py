@@ -0,0 +1,470 @@
+"""Реестр моделей: именованные версии, горячая замена и теневой режим.
+
+Версия модели — бандл: каталог MODEL_BUNDLES_DIR/<имя>/<версия>/ с файлом
+bundle.yaml, где указаны классификатор, энкодер и метки:
+
+    classifier: model.onnx
+    encoder:
+      backend: onnx              # или sentence_transformers
+      path: encoder.onnx         # имя модели sentence-transformers или путь к ONNX-энкодеру
+      tokenizer: tokenizer.json
+    labels: [joy, sadness, fear, anger]
+
+Пути считаются от каталога бандла. Какая версия обслуживает трафик и
+какая получает теневую копию, задает MODEL_BUNDLES_DIR/<имя>/model.yaml:
+
+    active: "2"
+    shadow: {version: "3", sample_rate: 0.05}
+
+Без model.yaml активна старшая версия. Файл перечитывается раз в
+MODEL_REGISTRY_POLL_S секунд, поэтому замена, сделанная через API одного
+воркера serve.py, доходит и до остальных. Если каталога бандлов нет,
+в реестре одна модель default из переменных INFERENCE_*.
+
+Новая версия загружается и прогревается в фоне, затем подменяется одной
+операцией в event loop. Запросы, уже попавшие в старую версию, дорабатывают
+на ней; после этого ее пул останавливается и память освобождается.
+"""
+import asyncio
+import os
+import random
+import re
+import tempfile
+
+import yaml
+
+from batching import MicroBatcher
+from inference import DEFAULT_LABELS
+from metrics import MODEL_SWAPS_TOTAL, SHADOW_PREDICTIONS_TOTAL
+from workers import InferencePool, PoolOverloadedError
+
+BUNDLE_FILE = 'bundle.yaml'
+MODEL_FILE = 'model.yaml'
+DEFAULT_MODEL = 'default'
+# Имена моделей и версий приходят из API и становятся путями: только простые имена каталогов
+NAME_PATTERN = re.compile(r'^[\w][\w.-]*$')
+
+
+class ModelNotFoundError(LookupError):
+    """Запрошенной модели или версии нет в реестре"""
+
+
+def _version_key(version: str):
+    # Естественный порядок: 10 старше 9
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', version) if part]
+
+
+class ModelBundle:
+    """Описание версии модели: пути классификатора и энкодера, метки"""
+
+    def __init__(self, name: str, version: str, classifier: str | None = None,
+                 encoder_backend: str | None = None, encoder_path: str | None = None,
+                 tokenizer_path: str | None = None, labels: list[str] | None = None):
+        self.name = name
+        self.version = version
+        self.classifier = classifier
+        self.encoder_backend = encoder_backend
+        self.encoder_path = encoder_path
+        self.tokenizer_path = tokenizer_path
+        self.labels = labels
+
+    @classmethod
+    def from_dir(cls, path: str, name: str, version: str) -> 'ModelBundle':
+        with open(os.path.join(path, BUNDLE_FILE), 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f) or {}
+
+        def resolve(value: str | None) -> str | None:
+            # Имя модели sentence-transformers файлом не является и остается как есть
+            if value is None:
+                return None
+            candidate = os.path.join(path, value)
+            return candidate if os.path.exists(candidate) or value.endswith('.onnx') else value
+
+        encoder = config.get('encoder') or {}
+        if 'classifier' not in config:
+            raise ValueError(f"В {os.path.join(path, BUNDLE_FILE)} не указан classifier")
+        return cls(
+            name=name,
+            version=version,
+            classifier=resolve(config['classifier']),
+            encoder_backend=encoder.get('backend'),
+            encoder_path=resolve(encoder.get('path')),
+            tokenizer_path=resolve(encoder.get('tokenizer')),
+            labels=config.get('labels'),
+        )
+
+    def inference_kwargs(self) -> dict:
+        kwargs = {
+            'model_path': self.classifier,
+            'encoder_backend': self.encoder_backend,
+            'encoder_path': self.encoder_path,
+            'tokenizer_path': self.tokenizer_path,
+            'labels': self.labels,
+        }
+        return {key: value for key, value in kwargs.items() if value is not None}
+
+
+class ModelVersion:
+    """Загруженная версия: свой пул воркеров, свой микробатчер и счетчик запросов в работе"""
+
+    def __init__(self, bundle: ModelBundle):
+        self.bundle = bundle
+        self.pool = InferencePool(inference_kwargs=bundle.inference_kwargs())
+        # Батчер держит в пуле не больше size батчей, поэтому глубина очереди пула применяется к нему
+        self.batcher = MicroBatcher(self.pool.predict_batch, max_concurrent_batches=self.pool.size,
+                                    max_queued_batches=self.pool.queue_depth, timeout=self.pool.timeout)
+        self.in_flight = 0
+        # Выгруженная версия не принимает запросы: иначе пул и батчер запустились бы заново
+        self.closed = False
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    @property
+    def name(self) -> str:
+        return self.bundle.name
+
+    @property
+    def version(self) -> str:
+        return self.bundle.version
+
+    def acquire(self):
+        if self.closed:
+            raise ModelNotFoundError(f"Версия {self.name}/{self.version} выгружена")
+        self.in_flight += 1
+        self._drained.clear()
+
+    def release(self):
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self._drained.set()
+
+    async def close(self, timeout: float):
+        """Ждет запросы в работе (не дольше timeout) и освобождает модель"""
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"❌ Модель {self.name}/{self.version}: {self.in_flight} запросов не завершились за {timeout} с")
+        self.closed = True
+        await self.batcher.close()
+        self.pool.shutdown()
+
+
+class ModelRegistry:
+    """Загруженные версии моделей и маршрутизация запросов между ними"""
+
+    def __init__(self, bundles_dir: str | None = None, default_model: str | None = None,
+                 poll_interval: float | None = None):
+        self.bundles_dir = bundles_dir or os.environ.get('MODEL_BUNDLES_DIR', 'models')
+        self.default_model = default_model or os.environ.get('MODEL_DEFAULT')
+        self.poll_interval = poll_interval if poll_interval is not None else float(
+            os.environ.get('MODEL_REGISTRY_POLL_S', 5))
+        self.retire_timeout = float(os.environ.get('MODEL_RETIRE_TIMEOUT_S', 60))
+        self.shadow_max_in_flight = int(os.environ.get('MODEL_SHADOW_MAX_IN_FLIGHT', 4))
+
+        self.versions: dict[tuple[str, str], ModelVersion] = {}
+        self.active: dict[str, str] = {}
+        # Имя модели -> (версия-кандидат, доля копируемого трафика)
+        self.shadows: dict[str, tuple[str, float]] = {}
+
+        self._lock = asyncio.Lock()
+        self._loading: dict[tuple[str, str], asyncio.Task] = {}
+        self._background: set[asyncio.Task] = set()
+        self._shadow_in_flight = 0
+        self._poller: asyncio.Task | None = None
+        # Конфигурации, которые не удалось применить: не загружаем их заново на каждом опросе
+        self._failed: dict[str, dict] = {}
+
+    # Описание моделей на диске
+
+    def _uses_bundles(self) -> bool:
+        return os.path.isdir(self.bundles_dir)
+
+    def _bundle(self, name: str, version: str) -> ModelBundle:
+        if not NAME_PATTERN.match(name) or not NAME_PATTERN.match(version):
+            raise ModelNotFoundError(f"Некорректное имя модели или версии: {name}/{version}")
+        if not self._uses_bundles():
+            if name != DEFAULT_MODEL:
+                raise ModelNotFoundError(f"Модель {name} не найдена")
+            return ModelBundle(DEFAULT_MODEL, version)
+        path = os.path.join(self.bundles_dir, name, version)
+        if not os.path.isfile(os.path.join(path, BUNDLE_FILE)):
+            raise ModelNotFoundError(f"Бандл {name}/{version} не найден в {self.bundles_dir}")
+        return ModelBundle.from_dir(path, name, version)
+
+    def _read_config(self) -> dict[str, dict]:
+        """Желаемое состояние: для каждой модели активная версия и теневой кандидат"""
+        if not self._uses_bundles():
+            return {DEFAULT_MODEL: {'active': os.environ.get('MODEL_VERSION', '1')}}
+
+        config = {}
+        for name in sorted(os.listdir(self.bundles_dir)):
+            model_dir = os.path.join(self.bundles_dir, name)
+            if not os.path.isdir(model_dir):
+                continue
+            versions = [entry for entry in os.listdir(model_dir)
+                        if os.path.isfile(os.path.join(model_dir, entry, BUNDLE_FILE))]
+            if not versions:
+                continue
+            model_config = {}
+            model_file = os.path.join(model_dir, MODEL_FILE)
+            if os.path.exists(model_file):
+                with open(model_file, 'r', encoding='utf-8') as f:
+                    model_config = yaml.safe_load(f) or {}
+            active = model_config.get('active')
+            config[name] = {
+                'active': str(active) if active is not None else max(versions, key=_version_key),
+                'shadow': model_config.get('shadow'),
+            }
+        return config
+
+    def _write_config(self, name: str):
+        """Сохраняет активную и теневую версию в model.yaml: его подхватят остальные воркеры"""
+        if not self._uses_bundles():
+            return
+        config = {'active': self.active[name]}
+        if name in self.shadows:
+            version, sample_rate = self.shadows[name]
+            config['shadow'] = {'version': version, 'sample_rate': sample_rate}
+        model_dir = os.path.join(self.bundles_dir, name)
+        fd, temp_path = tempfile.mkstemp(suffix='.yaml', dir=model_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            yaml.safe_dump(config, f, allow_unicode=True)
+        os.replace(temp_path, os.path.join(model_dir, MODEL_FILE))
+
+    # Загрузка и замена
+
+    @property
+    def ready(self) -> bool:
+        """Модель по умолчанию загружена и прогрета"""
+        name = self.default_name()
+        target = self.versions.get((name, self.active.get(name)))
+        return target is not None and target.pool.ready
+
+    def default_name(self) -> str | None:
+        if self.default_model:
+            return self.default_model
+        if DEFAULT_MODEL in self.active or not self.active:
+            return DEFAULT_MODEL
+        return min(self.active)
+
+    async def load(self, name: str, version: str) -> ModelVersion:
+        """Загружает и прогревает версию, не переключая на нее трафик; повторный вызов ждет ту же загрузку"""
+        key = (name, version)
+        if key in self.versions:
+            return self.versions[key]
+        if key not in self._loading:
+            self._loading[key] = asyncio.create_task(self._load(name, version))
+        try:
+            return await asyncio.shield(self._loading[key])
+        finally:
+            task = self._loading.get(key)
+            if task is not None and task.done():
+                del self._loading[key]
+
+    async def _load(self, name: str, version: str) -> ModelVersion:
+        target = ModelVersion(self._bundle(name, version))
+        try:
+            await target.pool.start()
+        except Exception:
+            target.pool.shutdown()
+            raise
+        self.versions[(name, version)] = target
+        print(f"✅ Модель {name}/{version} загружена")
+        return target
+
+    async def activate(self, name: str, version: str, persist: bool = True):
+        """Переключает трафик модели на версию; прежняя выгружается, когда допишет свои запросы"""
+        target = await self.load(name, version)
+        async with self._lock:
+            previous = self.active.get(name)
+            if previous == version:
+                return
+            # Подмена без await: запрос видит либо старую версию, либо новую
+            self.active[name] = target.version
+            MODEL_SWAPS_TOTAL.labels(name).inc()
+            print(f"✅ Модель {name}: активна версия {version}" + (f" вместо {previous}" if previous else ''))
+            if self.shadows.get(name, (None,))[0] == version:
+                # Кандидат стал основной версией: сравнивать его не с чем
+                del self.shadows[name]
+            if persist:
+                self._write_config(name)
+            if previous is not None and self.shadows.get(name, (None,))[0] != previous:
+                self._retire(name, previous)
+
+    def set_shadow(self, name: str, version: str | None, sample_rate: float = 0.0, persist: bool = True):
+        """Копирует долю трафика модели в загруженную версию-кандидата; version=None отключает"""
+        previous = self.shadows.pop(name, (None,))[0]
+        if version is not None:
+            if (name, version) not in self.versions:
+                raise ModelNotFoundError(f"Версия {name}/{version} не загружена")
+            self.shadows[name] = (version, min(max(sample_rate, 0.0), 1.0))
+        if persist and name in self.active:
+            self._write_config(name)
+        if previous not in (None, version, self.active.get(name)):
+            self._retire(name, previous)
+
+    async def unload(self, name: str, version: str):
+        if self.active.get(name) == version:
+            raise ValueError(f"Версия {name}/{version} обслуживает трафик, сначала активируйте другую")
+        if (name, version) not in self.versions:
+            raise ModelNotFoundError(f"Версия {name}/{version} не загружена")
+        target = self.versions.pop((name, version))
+        if self.shadows.get(name, (None,))[0] == version:
+            # Версия уже снята с учета: set_shadow не будет выгружать ее в фоне второй раз
+            self.set_shadow(name, None)
+        await self._close(target)
+
+    def _retire(self, name: str, version: str):
+        # Новые запросы версию уже не найдут, в фоне ждем начатые и освобождаем память
+        target = self.versions.pop((name, version), None)
+        if target is not None:
+            self._spawn(self._close(target))
+
+    async def _close(self, target: ModelVersion):
+        await target.close(self.retire_timeout)
+        print(f"✅ Модель {target.name}/{target.version} выгружена")
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def sync(self):
+        """Приводит загруженные версии к model.yaml и каталогу бандлов"""
+        for name, config in self._read_config().items():
+            if self._failed.get(name) == config:
+                continue
+            try:
+                await self.activate(name, config['active'], persist=False)
+                shadow = config.get('shadow')
+                if shadow:
+                    shadow_version = str(shadow['version'])
+                    await self.load(name, shadow_version)
+                    self.set_shadow(name, shadow_version, float(shadow.get('sample_rate', 0.0)), persist=False)
+                elif name in self.shadows:
+                    self.set_shadow(name, None, persist=False)
+                self._failed.pop(name, None)
+            except Exception as e:
+                self._failed[name] = config
+                print(f"❌ Не удалось применить конфигурацию модели {name}: {e}")
+
+    async def start(self):
+        """Первая загрузка моделей и фоновое слежение за model.yaml"""
+        await self.sync()
+        if self.default_name() not in self.active:
+            raise ModelNotFoundError(f"Модель по умолчанию {self.default_name()} не загружена")
+        if self._uses_bundles() and self.poll_interval > 0 and self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.sync()
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        for task in list(self._loading.values()) + list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._loading.values(), *self._background, return_exceptions=True)
+        for target in list(self.versions.values()):
+            target.closed = True
+            await target.batcher.close()
+            target.pool.shutdown()
+        self.versions.clear()
+        self.active.clear()
+
+    # Маршрутизация
+
+    def resolve(self, name: str | None = None, version: str | None = None) -> ModelVersion:
+        """Версия для запроса: явно указанная или активная версия модели (по умолчанию — default)"""
+        name = name or self.default_name()
+        if version is None:
+            version = self.active.get(name)
+            if version is None:
+                raise ModelNotFoundError(f"Модель {name} не найдена")
+        target = self.versions.get((name, version))
+        if target is None:
+            raise ModelNotFoundError(f"Версия {name}/{version} не загружена")
+        return target
+
+    async def predict(self, text: str, target: ModelVersion, deadline: float | None = None) -> str:
+        """Одиночный запрос через микробатчер версии.
+
+        Вызывающий должен держать target.acquire() с момента resolve: иначе замена
+        версии в промежутке выгрузит ее, и запрос получит ModelNotFoundError.
+        """
+        target.acquire()
+        try:
+            label = await target.batcher.predict(text, deadline)
+        finally:
+            target.release()
+        self._mirror(target, [text], [label])
+        return label
+
+    async def predict_batch(self, texts: list[str], target: ModelVersion, deadline: float | None = None) -> list[str]:
+        target.acquire()
+        try:
+            labels = await target.pool.predict_batch(texts, deadline)
+        finally:
+            target.release()
+        self._mirror(target, texts, labels)
+        return labels
+
+    def _mirror(self, target: ModelVersion, texts: list[str], labels: list[str]):
+        """Копия запроса активной версии уходит кандидату в фоне, ответ клиенту ее не ждет"""
+        shadow = self.shadows.get(target.name)
+        if shadow is None or self.active.get(target.name) != target.version:
+            return
+        version, sample_rate = shadow
+        candidate = self.versions.get((target.name, version))
+        if candidate is None or random.random() >= sample_rate:
+            return
+        if self._shadow_in_flight >= self.shadow_max_in_flight:
+            # Кандидат не успевает: теневой трафик не должен копиться и отнимать ресурсы
+            SHADOW_PREDICTIONS_TOTAL.labels(target.name, version, 'dropped').inc(len(texts))
+            return
+        # Считаем задачу сразу: еще не запущенные задачи тоже занимают место под лимитом
+        self._shadow_in_flight += 1
+        self._spawn(self._shadow_predict(candidate, texts, labels))
+
+    async def _shadow_predict(self, candidate: ModelVersion, texts: list[str], labels: list[str]):
+        try:
+            try:
+                candidate.acquire()
+            except ModelNotFoundError:
+                # Кандидата выгрузили, пока задача ждала запуска
+                SHADOW_PREDICTIONS_TOTAL.labels(candidate.name, candidate.version, 'dropped').inc(len(texts))
+                return
+            try:
+                shadow_labels = await candidate.pool.predict_batch(texts)
+            except PoolOverloadedError:
+                SHADOW_PREDICTIONS_TOTAL.labels(candidate.name, candidate.version, 'dropped').inc(len(texts))
+                return
+            except Exception:
+                SHADOW_PREDICTIONS_TOTAL.labels(candidate.name, candidate.version, 'error').inc(len(texts))
+                return
+            finally:
+                candidate.release()
+        finally:
+            self._shadow_in_flight -= 1
+        matches = sum(label == shadow_label for label, shadow_label in zip(labels, shadow_labels))
+        SHADOW_PREDICTIONS_TOTAL.labels(candidate.name, candidate.version, 'match').inc(matches)
+        SHADOW_PREDICTIONS_TOTAL.labels(candidate.name, candidate.version, 'mismatch').inc(len(labels) - matches)
+
+    def describe(self) -> list[dict]:
+        models = []
+        for (name, version), target in sorted(self.versions.items()):
+            shadow = self.shadows.get(name)
+            models.append({
+                'model': name,
+                'version': version,
+                'active': self.active.get(name) == version,
+                'shadow_sample_rate': shadow[1] if shadow and shadow[0] == version else None,
+                'ready': target.pool.ready,
+                'in_flight': target.in_flight,
+                'labels': target.bundle.labels or DEFAULT_LABELS,
+            })
+        return models
@@ -1,17 +1,199 @@
-from fastapi import APIRouter,  HTTPException
-from starlette.responses import JSONResponse
-from schemas import Text
-from inference import Inference
+import math
+import os
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from pydantic import BaseModel, Field
+from starlette.responses import JSONResponse, Response
+import metrics
+from admission import AdmissionRejectedError, admission, deadline_from_timeout
+from schemas import Text, Texts
+from database.logger import log_prediction
+from registry import ModelNotFoundError, ModelRegistry, ModelVersion
+from workers import DeadlineExceededError, PoolOverloadedError
+from streaming import NDJSONPredictionResponse
 
 router = APIRouter()
-inference = Inference()
+registry = ModelRegistry()
+
+# Без токена управление моделями открыто, как и остальные эндпоинты
+MODEL_ADMIN_TOKEN = os.environ.get('MODEL_ADMIN_TOKEN')
+
+
+def resolve_target(model: str | None = None, version: str | None = None) -> ModelVersion:
+    """Версия модели для запроса: ?model=<имя>&version=<версия>, по умолчанию активная версия default"""
+    try:
+        return registry.resolve(model, version)
+    except ModelNotFoundError as e:
+        # Пока реестр загружает модели при старте, это не ошибка клиента
+        raise HTTPException(status_code=404 if registry.active else 503, detail=str(e))
+
+
+async def resolve_model(model: str | None = None, version: str | None = None) -> AsyncIterator[ModelVersion]:
+    """Версия модели, занятая на все время запроса.
+
+    acquire() сразу после resolve, без await между ними: замена версии, пока
+    запрос ждет допуска, не выгрузит ее из-под него.
+    """
+    target = resolve_target(model, version)
+    target.acquire()
+    try:
+        yield target
+    finally:
+        target.release()
+
+
+def model_headers(target: ModelVersion) -> dict[str, str]:
+    return {'X-Model': target.name, 'X-Model-Version': target.version}
+
+
+def request_deadline(x_request_timeout_ms: float | None = Header(default=None, gt=0)) -> float | None:
+    """Срок запроса из X-Request-Timeout-Ms: после него работа отбрасывается, не дойдя до модели"""
+    return deadline_from_timeout(x_request_timeout_ms)
 
 
+def shed(reason: str, error: Exception) -> HTTPException:
+    """Быстрый отказ при перегрузке: клиент повторит запрос через Retry-After"""
+    metrics.ADMISSION_SHED_TOTAL.labels(reason).inc()
+    return HTTPException(status_code=503, detail=str(error),
+                         headers={'Retry-After': str(math.ceil(admission.retry_after))})
+
+
+def deadline_exceeded(error: Exception) -> HTTPException:
+    metrics.ADMISSION_SHED_TOTAL.labels('deadline').inc()
+    return HTTPException(status_code=504, detail=str(error))
+
 
 @router.post('/predict')
-async def predict_endpoint(request: Text):
+async def predict_endpoint(request: Text, http_request: Request, target: ModelVersion = Depends(resolve_model),
+                           deadline: float | None = Depends(request_deadline)):
+    try:
+        async with admission.admit(deadline):
+            exported_model_output = await registry.predict(request.text, target, deadline)
+        log_prediction(http_request, exported_model_output, request.text)
+        metrics.PREDICTIONS_TOTAL.labels(exported_model_output).inc()
+        return JSONResponse(content={'predicted_tip': exported_model_output}, headers=model_headers(target))
+    except AdmissionRejectedError as e:
+        raise shed(e.reason, e)
+    except PoolOverloadedError as e:
+        raise shed('pool_full', e)
+    except DeadlineExceededError as e:
+        raise deadline_exceeded(e)
+    except ModelNotFoundError as e:
+        # Версия выгружена по таймауту замены, пока запрос ждал: клиент повторит на новой
+        raise HTTPException(status_code=503, detail=str(e))
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Превышено время ожидания предсказания")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка предсказания: {str(e)}")
+
+@router.post('/predict_batch')
+async def predict_batch_endpoint(request: Texts, target: ModelVersion = Depends(resolve_model),
+                                 deadline: float | None = Depends(request_deadline)):
     try:
-        exported_model_output = inference(request.text)
-        return JSONResponse(content={'predicted_tip': exported_model_output})
+        # Весь список уходит в модель целиком, без разбиения на отдельные запросы
+        async with admission.admit(deadline):
+            exported_model_output = await registry.predict_batch(request.texts, target, deadline)
+        for label in exported_model_output:
+            metrics.PREDICTIONS_TOTAL.labels(label).inc()
+        return JSONResponse(content={'predicted_tips': exported_model_output}, headers=model_headers(target))
+    except AdmissionRejectedError as e:
+        raise shed(e.reason, e)
+    except PoolOverloadedError as e:
+        raise shed('pool_full', e)
+    except DeadlineExceededError as e:
+        raise deadline_exceeded(e)
+    except ModelNotFoundError as e:
+        # Версия выгружена по таймауту замены, пока запрос ждал: клиент повторит на новой
+        raise HTTPException(status_code=503, detail=str(e))
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Превышено время ожидания предсказания")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка предсказания: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Ошибка предсказания: {str(e)}")
+
+
+@router.post('/predict_stream')
+async def predict_stream_endpoint(model: str | None = None, version: str | None = None):
+    resolve_target(model, version)
+
+    # Версия выбирается на каждый батч: после замены модели поток продолжается на новой
+    async def predict_batch(texts: list[str]) -> list[str]:
+        return await registry.predict_batch(texts, registry.resolve(model, version))
+
+    # Тело не объявлено параметром: его построчно читает сам ответ, не дожидаясь конца загрузки
+    return NDJSONPredictionResponse(predict_batch)
+
+
+@router.get('/metrics')
+async def metrics_endpoint():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def check_admin_token(x_admin_token: str | None = Header(default=None)):
+    if MODEL_ADMIN_TOKEN and x_admin_token != MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Неверный X-Admin-Token")
+
+
+models_router = APIRouter(prefix='/models', dependencies=[Depends(check_admin_token)])
+
+
+class Shadow(BaseModel):
+    version: str
+    sample_rate: float = Field(ge=0, le=1)
+
+
+@models_router.get('')
+async def models_endpoint():
+    return {'default': registry.default_name(), 'models': registry.describe()}
+
+
+@models_router.post('/{name}/{version}/load')
+async def load_model_endpoint(name: str, version: str):
+    """Загружает и прогревает версию, не переключая на нее трафик"""
+    try:
+        await registry.load(name, version)
+    except ModelNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка загрузки модели: {str(e)}")
+    return {'models': registry.describe()}
+
+
+@models_router.post('/{name}/{version}/activate')
+async def activate_model_endpoint(name: str, version: str):
+    """Загружает версию (если нужно) и переключает на нее трафик модели"""
+    try:
+        await registry.activate(name, version)
+    except ModelNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка загрузки модели: {str(e)}")
+    return {'models': registry.describe()}
+
+
+@models_router.put('/{name}/shadow')
+async def set_shadow_endpoint(name: str, shadow: Shadow):
+    """Копирует долю трафика активной версии в загруженную версию-кандидата"""
+    try:
+        await registry.load(name, shadow.version)
+        registry.set_shadow(name, shadow.version, shadow.sample_rate)
+    except ModelNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {'models': registry.describe()}
+
+
+@models_router.delete('/{name}/shadow')
+async def delete_shadow_endpoint(name: str):
+    registry.set_shadow(name, None)
+    return {'models': registry.describe()}
+
+
+@models_router.delete('/{name}/{version}')
+async def unload_model_endpoint(name: str, version: str):
+    try:
+        await registry.unload(name, version)
+    except ModelNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {'models': registry.describe()}
@@ -1,14 +1,41 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 
-from database.logger import LogMiddleware
-from routers import router as inference_router
+from database.logger import LogMiddleware, connect_database, log_shipper
+from health import router as health_router
+from metrics import MetricsMiddleware, start_snapshot_writer
+from routers import models_router, registry, router as inference_router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # В serve.py метрики воркеров сводятся через общий каталог
+    start_snapshot_writer()
+    await log_shipper.start()
+    # Модели и ClickHouse загружаются в фоне параллельно: сервер сразу отвечает на /health/live,
+    # а /health/ready вернет 200, когда модель по умолчанию прогрета
+    background = [asyncio.create_task(registry.start()), asyncio.create_task(connect_database())]
+    yield
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    # Досылаем в ClickHouse все, что накопилось в очереди логов
+    await log_shipper.stop()
+    await registry.close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(inference_router)
+app.include_router(models_router)
+app.include_router(health_router)
 app.add_middleware(LogMiddleware)
+# Добавленный последним middleware — внешний: время и in-flight с учетом логирования
+app.add_middleware(MetricsMiddleware)
 #./venv/Scripts/activate
 if __name__ == '__main__':
     print("📚 Documentation: http://127.0.0.1:8000/docs")
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -1,6 +1,20 @@
 import datetime
 import re
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
+
+
+def validate_text(text: str) -> str:
+    if not text or not text.strip():
+        raise ValueError('Текст не должен быть пустым')
+
+    if not re.search(r'[a-zA-Zа-яА-Я]', text):
+        raise ValueError('Текст должен содержать буквы')
+    
+
+    if len(text.strip()) < 2:
+        raise ValueError('Текст должен содержать минимум 2 символа')
+    
+    return text.strip()
 
 
 class Text(BaseModel):
@@ -8,15 +22,12 @@ class Text(BaseModel):
     
     @field_validator('text')
     def text_validator(cls, text):
+        return validate_text(text)
 
-        if not text or not text.strip():
-            raise ValueError('Текст не должен быть пустым')
 
-        if not re.search(r'[a-zA-Zа-яА-Я]', text):
-            raise ValueError('Текст должен содержать буквы')
-        
+class Texts(BaseModel):
+    texts: list[str] = Field(min_length=1)
 
-        if len(text.strip()) < 2:
-            raise ValueError('Текст должен содержать минимум 2 символа')
-        
-        return text.strip()
\ No newline at end of file
+    @field_validator('texts')
+    def texts_validator(cls, texts):
+        return [validate_text(text) for text in texts]
\ No newline at end of file
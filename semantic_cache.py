@@ -0,0 +1,104 @@
+import threading
+
+import numpy as np
+
+
+class SemanticCache:
+    """Кэш меток по близости эмбеддингов: перефразированный текст получает метку похожего.
+
+    Нормированные эмбеддинги и номера меток лежат в кольцевом буфере
+    фиксированного размера, поэтому память ограничена max_entries * dim * 4
+    байт, а при заполнении вытесняются самые старые записи. Поиск — одно
+    матричное умножение батча на весь буфер: косинусная близость ближайшего
+    соседа сравнивается с threshold. Порог подбирается скриптом
+    functions/evaluate_semantic_cache.py.
+
+    Кэш стоит после энкодера и экономит только классификатор, а поиск по
+    буферу растет с max_entries: 32 запроса к 10 000 записей — это миллисекунды,
+    дороже линейного классификатора поверх эмбеддингов. Включать его имеет
+    смысл, только когда классификатор заметно дороже поиска; скрипт оценки
+    показывает обе величины.
+    """
+
+    def __init__(self, dim: int = 384, max_entries: int = 10000, threshold: float = 0.95):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.threshold = threshold
+
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._labels = np.full(max_entries, -1, dtype=np.int32)
+        self._size = 0
+        # Позиция следующей записи в кольцевом буфере
+        self._next = 0
+        # Номер add(), записавшего слот: поиск вне блокировки отбрасывает слоты, перезаписанные за время умножения
+        self._version = 0
+        self._stamps = np.zeros(max_entries, dtype=np.int64)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        return self._vectors.nbytes + self._labels.nbytes + self._stamps.nbytes
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def lookup(self, embeddings: np.ndarray) -> np.ndarray:
+        """Номера меток ближайших соседей для строк embeddings; -1 — промах"""
+        queries = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            size, version = self._size, self._version
+
+        if size == 0:
+            result = np.full(len(queries), -1, dtype=np.int32)
+        else:
+            # Умножение — основная работа, под блокировкой оно выстроило бы потоки пула в очередь
+            similarity = queries @ self._vectors[:size].T
+            nearest = np.argmax(similarity, axis=1)
+            best = similarity[np.arange(len(queries)), nearest]
+
+        with self._lock:
+            if size:
+                fresh = self._stamps[nearest] <= version
+                result = np.where((best >= self.threshold) & fresh, self._labels[nearest], -1)
+            hits = int(np.count_nonzero(result >= 0))
+            self.hits += hits
+            self.misses += len(result) - hits
+        return result
+
+    def add(self, embeddings: np.ndarray, labels: list[int]) -> int:
+        """Добавляет эмбеддинги с номерами меток; возвращает число вытесненных записей"""
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        labels = np.asarray(labels, dtype=np.int32)
+        count = len(vectors)
+        if count > self.max_entries:
+            # В буфер попадут только последние записи, остальные сразу считаются вытесненными
+            vectors, labels = vectors[-self.max_entries:], labels[-self.max_entries:]
+
+        with self._lock:
+            evicted = max(0, self._size + count - self.max_entries)
+            positions = (self._next + np.arange(len(vectors))) % self.max_entries
+            self._version += 1
+            self._stamps[positions] = self._version
+            self._vectors[positions] = vectors
+            self._labels[positions] = labels
+            self._next = (self._next + len(vectors)) % self.max_entries
+            self._size = min(self._size + len(vectors), self.max_entries)
+            self.evictions += evicted
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            self._next = 0
+            # Поиски, начатые до очистки, не вернут старые метки
+            self._version += 1
+            self._stamps[:] = self._version
@@ -0,0 +1,177 @@
+"""Запуск в несколько процессов с общими весами модели (prefork).
+
+Родительский процесс один раз загружает веса классификатора и энкодера,
+импортирует приложение, замораживает сборщик мусора и делает fork
+воркеров. Веса достаются воркерам copy-on-write: ONNX Runtime только
+читает их, поэтому страницы не копируются. Сессии ONNX Runtime и потоки
+создаются уже в воркерах (они не переживают fork). Упавший воркер
+перезапускается, метрики всех воркеров сводятся в /metrics.
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+
+def threads_per_worker(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def configure_parent_env(workers: int, threads: int):
+    """Настройки, которые должны быть видны воркерам до создания сессий и пулов потоков"""
+    # В воркере работает пул потоков, а не процессов: процессы здесь уже дает fork
+    if os.environ.get('INFERENCE_POOL_MODE', 'thread') != 'thread':
+        raise ValueError('serve.py работает только с INFERENCE_POOL_MODE=thread')
+    os.environ.setdefault('ORT_INTRA_OP_THREADS', str(threads))
+    os.environ.setdefault('OMP_NUM_THREADS', str(threads))
+    os.environ.setdefault('MKL_NUM_THREADS', str(threads))
+    # Оптимизированный граф из кэша не нужен: сессии строятся поверх общих весов
+    os.environ.setdefault('ORT_OPTIMIZED_MODEL_DIR', '')
+
+
+def preload_model():
+    """Загружает веса до fork; сами сессии создаст каждый воркер в lifespan"""
+    from encoders import preload_encoder
+    from onnx_session import preload_shared_weights, resolve_model_path
+
+    classifier = preload_shared_weights(resolve_model_path(os.environ.get('INFERENCE_MODEL_PATH', 'model.onnx')))
+    preload_encoder()
+    print(f"✅ Веса загружены в родительском процессе: классификатор {classifier.nbytes / 1024 / 1024:.1f} МБ")
+
+
+def pin_worker(index: int, workers: int, threads: int):
+    """Привязывает воркер к своему набору ядер (SERVE_PIN_CPUS=1)"""
+    if os.environ.get('SERVE_PIN_CPUS', '0') != '1' or not hasattr(os, 'sched_setaffinity'):
+        return
+    cpus = sorted(os.sched_getaffinity(0))
+    start = (index * threads) % len(cpus)
+    os.sched_setaffinity(0, cpus[start:start + threads] or cpus)
+
+
+def run_worker(index: int, workers: int, threads: int, sock: socket.socket, wal_dir: str):
+    """Тело дочернего процесса: свой журнал логов, свои потоки, общий сокет"""
+    import uvicorn
+
+    # Обработчики сигналов родителя не нужны: uvicorn ставит свои
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # Номер воркера стабилен между перезапусками: журнал недоставленных логов дочитает его преемник
+    os.environ['LOG_WAL_DIR'] = os.path.join(wal_dir, f'worker-{index}')
+    pin_worker(index, workers, threads)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+
+    from run import app
+
+    config = uvicorn.Config(app, lifespan='on', log_level=os.environ.get('SERVE_LOG_LEVEL', 'info'))
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """Родительский процесс: fork воркеров, перезапуск упавших, остановка по сигналу"""
+
+    def __init__(self, workers: int, threads: int, sock: socket.socket, wal_dir: str):
+        self.workers = workers
+        self.threads = threads
+        self.sock = sock
+        self.wal_dir = wal_dir
+        self.children: dict[int, int] = {}
+        self.stopping = False
+
+    def spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(index, self.workers, self.threads, self.sock, self.wal_dir)
+            except BaseException as e:
+                print(f"❌ Воркер {index} завершился с ошибкой: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+        print(f"✅ Воркер {index} запущен, pid {pid}")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = self.children.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            print(f"❌ Воркер {index} (pid {pid}) завершился, код {os.waitstatus_to_exitcode(status)}; перезапуск")
+            # Пауза не дает уйти в цикл быстрых падений
+            time.sleep(1)
+            self.spawn(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Запуск приложения в несколько процессов с общими весами модели')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVE_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--host', default=os.environ.get('SERVE_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SERVE_PORT', 8000)))
+    parser.add_argument('--threads-per-worker', type=int, default=None, help='По умолчанию ядра / воркеры')
+    parser.add_argument('--wal-dir', default=os.environ.get('LOG_WAL_DIR', 'logs_wal'))
+    args = parser.parse_args()
+
+    threads = args.threads_per_worker or threads_per_worker(args.workers)
+    configure_parent_env(args.workers, threads)
+
+    # Каталог для сведения метрик воркеров; снимки прошлого запуска не нужны.
+    # Заданный каталог может быть чужим: из него удаляются только наши снимки
+    metrics_dir = os.environ.get('METRICS_MULTIPROCESS_DIR')
+    if metrics_dir:
+        from metrics import clear_snapshots
+
+        os.makedirs(metrics_dir, exist_ok=True)
+        clear_snapshots(metrics_dir)
+    else:
+        metrics_dir = tempfile.mkdtemp(prefix='serve_metrics_')
+    os.environ['METRICS_MULTIPROCESS_DIR'] = metrics_dir
+
+    preload_model()
+    # Импорт приложения до fork: модули и их объекты тоже общие для воркеров
+    import run  # noqa: F401
+
+    sock = socket.socket(socket.AF_INET6 if ':' in args.host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Объекты, созданные до fork, больше не обходятся сборщиком мусора:
+    # иначе он трогал бы их заголовки и копировал страницы в каждый воркер
+    gc.collect()
+    gc.freeze()
+
+    print(f"📚 Documentation: http://{args.host}:{args.port}/docs "
+          f"({args.workers} воркеров по {threads} потоков)")
+    Supervisor(args.workers, threads, sock, args.wal_dir).run()
+
+
+if __name__ == '__main__':
+    main()
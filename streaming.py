@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from metrics import PREDICTIONS_TOTAL
+from schemas import validate_text
+from workers import PoolOverloadedError
+
+# Конец входного потока в очереди между чтением тела и предсказаниями
+_END = object()
+
+
+class NDJSONPredictionResponse(Response):
+    """Потоковые предсказания для NDJSON-тела: одна строка с полем text на входе,
+    одна строка с результатом на выходе, в том же порядке.
+
+    Тело читается из receive напрямую и параллельно с предсказаниями: первые
+    результаты уходят клиенту, пока загрузка еще идет. Между чтением и
+    моделью стоит ограниченная очередь, поэтому память не зависит от размера
+    тела: когда модель не успевает, чтение останавливается и срабатывает
+    обратное давление TCP. StreamingResponse здесь не подходит: при ASGI
+    spec_version < 2.4 (uvicorn сообщает 2.3) он сам слушает receive
+    в ожидании отключения и забрал бы куски тела.
+    """
+
+    media_type = 'application/x-ndjson'
+
+    def __init__(self, predict_batch: Callable[[list[str]], Awaitable[list[str]]],
+                 batch_size: int | None = None, queue_size: int | None = None,
+                 max_line_bytes: int | None = None, overload_timeout: float | None = None):
+        # Как в StreamingResponse: без тела, иначе Response выставит content-length: 0
+        self.status_code = 200
+        self.background = None
+        self.init_headers()
+        self.predict_batch = predict_batch
+        self.batch_size = batch_size or int(os.environ.get('STREAM_BATCH_SIZE', 64))
+        self.queue_size = queue_size or int(os.environ.get('STREAM_QUEUE_SIZE', 1024))
+        self.max_line_bytes = max_line_bytes or int(os.environ.get('STREAM_MAX_LINE_BYTES', 64 * 1024))
+        if overload_timeout is None:
+            overload_timeout = float(os.environ.get('STREAM_OVERLOAD_TIMEOUT_S', 5))
+        self.overload_timeout = overload_timeout
+
+    def _parse(self, number: int, line: bytes) -> dict:
+        """Разбирает строку в задачу: текст для модели или готовую ошибку"""
+        item = {'line': number}
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError('ожидается JSON-объект')
+            if 'id' in data:
+                item['id'] = data['id']
+            if not isinstance(data.get('text'), str):
+                raise ValueError('поле text должно быть строкой')
+            item['text'] = validate_text(data['text'])
+        except ValueError as e:
+            item['error'] = f'Некорректная строка: {e}'
+        return item
+
+    async def _read_lines(self, receive: Receive, queue: asyncio.Queue):
+        try:
+            await self._split_body(receive, queue)
+        except Exception as e:
+            await queue.put({'line': None, 'error': f'Ошибка чтения тела: {e}'})
+        await queue.put(_END)
+
+    async def _split_body(self, receive: Receive, queue: asyncio.Queue):
+        """Режет тело на строки по мере поступления кусков и кладет задачи в очередь"""
+        buffer = b''
+        number = 0
+        skipping = False
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            buffer += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+            lines = buffer.split(b'\n')
+            buffer = lines.pop()
+            for line in lines:
+                if skipping:
+                    # Хвост слишком длинной строки, ошибка по ней уже выдана
+                    skipping = False
+                    continue
+                if line.strip():
+                    await queue.put(self._parse(number, line))
+                    number += 1
+
+            if len(buffer) > self.max_line_bytes:
+                if not skipping:
+                    await queue.put({'line': number, 'error': f'Строка длиннее {self.max_line_bytes} байт'})
+                    number += 1
+                skipping = True
+                buffer = b''
+
+        if buffer.strip() and not skipping:
+            await queue.put(self._parse(number, buffer))
+
+    async def _predict(self, texts: list[str]) -> list[str]:
+        """Поток не должен обрываться из-за кратковременной перегрузки пула: повторяем
+        до overload_timeout, затем батч получает строки с ошибкой, а поток идет дальше"""
+        deadline = time.monotonic() + self.overload_timeout
+        delay = 0.01
+        while True:
+            try:
+                return await self.predict_batch(texts)
+            except PoolOverloadedError:
+                if time.monotonic() + delay > deadline:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.5)
+
+    async def _write_predictions(self, queue: asyncio.Queue, send: Send):
+        finished = False
+        while not finished:
+            # Ждем первую задачу, остальные забираем без ожидания: батч растет, пока модель занята
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            if batch[-1] is _END:
+                batch.pop()
+                finished = True
+
+            texts = [item['text'] for item in batch if 'text' in item]
+            if texts:
+                try:
+                    labels = iter(await self._predict(texts))
+                except Exception as e:
+                    labels = None
+                    error = f'Ошибка предсказания: {e}'
+                for item in batch:
+                    if 'text' not in item:
+                        continue
+                    del item['text']
+                    if labels is None:
+                        item['error'] = error
+                        continue
+                    item['predicted_tip'] = next(labels)
+                    PREDICTIONS_TOTAL.labels(item['predicted_tip']).inc()
+
+            if batch:
+                body = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in batch)
+                await send({'type': 'http.response.body', 'body': body.encode('utf-8'), 'more_body': True})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        reader = asyncio.create_task(self._read_lines(receive, queue))
+        try:
+            await self._write_predictions(queue, send)
+        finally:
+            reader.cancel()
+            try:
+                await reader
+            except asyncio.CancelledError:
+                pass
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
@@ -9,43 +9,113 @@ import plotly.express as px
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 from database.database import ClickHouse
+from cache import LRUCache
 
 PREDICTED_TIP = 'predicted_tip'
 WORDS_COUNT = 'words_count'
 PREDICTION_LOGS_TABLE = 'model_logs2.ModelLogs'
+# Агрегаты по минутам, которые наполняют материализованные представления ModelLogs
+LABELS_ROLLUP_TABLE = 'model_logs2.ModelLogsLabelsPerMinute'
+WORDS_COUNT_ROLLUP_TABLE = 'model_logs2.ModelLogsWordsCountPerMinute'
 
 database = ClickHouse()
 
+# Результаты агрегирующих запросов живут DASH_CACHE_TTL_S секунд и сбрасываются при появлении новых данных
+query_cache = LRUCache(max_entries=256, ttl=float(os.environ.get('DASH_CACHE_TTL_S', 60)))
+# Версию данных тоже не проверяем чаще, чем раз в DASH_VERSION_CHECK_S секунд
+version_cache = LRUCache(max_entries=1, ttl=float(os.environ.get('DASH_VERSION_CHECK_S', 5)))
+
+
+def get_data_version() -> tuple:
+    """Дешевый маркер новых данных: число строк и частей ModelLogs из system.tables"""
+    version = version_cache.get('version')
+    if version is not None:
+        return version
+
+    database_name, table_name = PREDICTION_LOGS_TABLE.split('.')
+    result = database.execute_query(
+        "SELECT total_rows, total_bytes FROM system.tables WHERE database = %(database)s AND name = %(table)s",
+        {'database': database_name, 'table': table_name}
+    )
+    version = tuple(result.iloc[0]) if result is not None and not result.empty else ()
+    version_cache.put('version', version)
+    return version
+
+
+def cached_query(query: str, parameters: dict | None = None) -> pd.DataFrame:
+    """Выполняет запрос или берет результат из кэша по (запрос, параметры, версия данных)"""
+    key = (query, tuple(sorted((parameters or {}).items())), get_data_version())
+    result = query_cache.get(key)
+    if result is None:
+        result = database.execute_query(query, parameters)
+        if result is None:
+            return pd.DataFrame()
+        query_cache.put(key, result)
+    return result
+
+# Считаем распределение по rollup-таблице: в Python приходят только агрегаты
+def get_distribution(column_name: str) -> pd.DataFrame:
+    if column_name == WORDS_COUNT:
+        query = f"""
+        SELECT {WORDS_COUNT}, sum(requests) AS requests
+        FROM {WORDS_COUNT_ROLLUP_TABLE}
+        GROUP BY {WORDS_COUNT}
+        ORDER BY {WORDS_COUNT}
+        """
+    else:
+        query = f"""
+        SELECT {PREDICTED_TIP}, sum(requests) AS requests
+        FROM {LABELS_ROLLUP_TABLE}
+        GROUP BY {PREDICTED_TIP}
+        ORDER BY requests DESC
+        """
+    return cached_query(query)
+
+
+# Статистика считается в ClickHouse по rollup-таблице, точно по всем данным
+def get_words_count_summary() -> pd.DataFrame:
+    query = f"""
+    SELECT
+        sum(requests) AS total,
+        min({WORDS_COUNT}) AS min_value,
+        max({WORDS_COUNT}) AS max_value,
+        avgWeighted({WORDS_COUNT}, requests) AS mean,
+        quantilesExactWeighted(0.5, 0.9, 0.99)({WORDS_COUNT}, requests) AS quantiles,
+        sqrt(
+            (sum(requests * {WORDS_COUNT} * {WORDS_COUNT}) - sum(requests) * pow(avgWeighted({WORDS_COUNT}, requests), 2))
+            / greatest(sum(requests) - 1, 1)
+        ) AS std
+    FROM {WORDS_COUNT_ROLLUP_TABLE}
+    """
+    return cached_query(query)
+
 #Строим гистограмму
 def plot_distribution(column_name: str) -> go.Figure | None:
-    dataframe = database.execute_query(
-        f'select {column_name} from {PREDICTION_LOGS_TABLE}'
-    )
+    distribution = get_distribution(column_name)
     
-    if len(dataframe) == 0:
+    if len(distribution) == 0:
         return None
-    data = dataframe[column_name]
-    
-    numeric_data = pd.to_numeric(data, errors='coerce')
-    is_numeric = not numeric_data.isna().all()
     
-    if is_numeric:
+    if column_name == WORDS_COUNT:
+        # Корзина rollup-таблицы — точное число слов, поэтому столбцы шириной 1
         fig = go.Figure()
-        fig.add_trace(go.Histogram(
-            x=numeric_data.dropna(),
+        fig.add_trace(go.Bar(
+            x=distribution[WORDS_COUNT],
+            y=distribution['requests'],
+            width=1,
             name="Длина предложения",
             opacity=1.0
         ))
         fig.update_layout(
             xaxis_title="Количество слов в запросе",
-            yaxis_title='Количество запросов'
+            yaxis_title='Количество запросов',
+            bargap=0
         )
     else:
-        value_counts = data.value_counts()
         fig = go.Figure()
         fig.add_trace(go.Bar(
-            x=value_counts.index,
-            y=value_counts.values,
+            x=distribution[PREDICTED_TIP],
+            y=distribution['requests'],
             name="Предсказания"
         ))
         fig.update_layout(
@@ -168,9 +238,6 @@ def toggle_modal(n1, n2, is_open):
     Input(component_id='column-selector', component_property='value')
 )
 def update_distribution(selected_column):
-    if df.empty:
-        return go.Figure()
-    
     fig = plot_distribution(selected_column)
     if fig is None:
         return go.Figure()
@@ -202,45 +269,49 @@ def update_table(selected_column):
     Input(component_id='column-selector', component_property='value')
 )
 def update_summary(selected_column):
-    if df.empty or selected_column not in df.columns:
-        return "Нет доступных данных"
-    
-    data = df[selected_column]
-    
-    # Проверяем тип данных
-    numeric_data = pd.to_numeric(data, errors='coerce')
-    is_numeric = not numeric_data.isna().all()
-    
-    if is_numeric:
+    if selected_column == WORDS_COUNT:
+        summary = get_words_count_summary()
+        if summary.empty or not summary['total'].iloc[0]:
+            return "Нет доступных данных"
+
+        row = summary.iloc[0]
+        median, p90, p99 = row['quantiles']
         # Статистика для числовых данных
-        valid_data = numeric_data.dropna()
         stats = [
             html.H5(f"Статистика для {selected_column.replace('_', ' ').title()}"),
-            html.P(f"Всего записей: {len(data):,}"),
-            html.P(f"Валидных числовых записей: {len(valid_data):,}"),
-            html.P(f"Среднее значение: {valid_data.mean():.2f}"),
-            html.P(f"Медиана: {valid_data.median():.2f}"),
-            html.P(f"Стандартное отклонение: {valid_data.std():.2f}"),
-            html.P(f"Минимальное значение: {valid_data.min():.2f}"),
-            html.P(f"Максимальное значение: {valid_data.max():.2f}"),
-            html.P(f"Пропущенные значения: {numeric_data.isnull().sum()}"),
-            html.P(f"Тип данных: {data.dtype}")
+            html.P(f"Всего записей: {int(row['total']):,}"),
+            html.P(f"Среднее значение: {row['mean']:.2f}"),
+            html.P(f"Медиана: {median:.2f}"),
+            html.P(f"90-й перцентиль: {p90:.2f}"),
+            html.P(f"99-й перцентиль: {p99:.2f}"),
+            html.P(f"Стандартное отклонение: {row['std']:.2f}"),
+            html.P(f"Минимальное значение: {row['min_value']:.2f}"),
+            html.P(f"Максимальное значение: {row['max_value']:.2f}"),
+            html.P("Тип данных: UInt16")
         ]
     else:
-        # Статистика для категориальных данных
-        unique_values = data.unique()
-        value_counts = data.value_counts()
+        # Распределение классов уже посчитано GROUP BY в ClickHouse
+        value_counts = get_distribution(PREDICTED_TIP)
+        if value_counts.empty:
+            return "Нет доступных данных"
+
+        total = int(value_counts['requests'].sum())
+        missing = int(value_counts.loc[value_counts[PREDICTED_TIP] == '', 'requests'].sum())
+        top = value_counts.iloc[0]
         stats = [
             html.H5(f"Статистика для {selected_column.replace('_', ' ').title()}"),
-            html.P(f"Всего записей: {len(data):,}"),
-            html.P(f"Уникальных классов: {len(unique_values)}"),
-            html.P(f"Самый частый класс: '{value_counts.index[0]}' ({value_counts.iloc[0]} вхождений)"),
-            html.P(f"Пропущенные значения: {data.isnull().sum()}"),
-            html.P(f"Тип данных: {data.dtype}"),
+            html.P(f"Всего записей: {total:,}"),
+            html.P(f"Уникальных классов: {len(value_counts)}"),
+            html.P(f"Самый частый класс: '{top[PREDICTED_TIP]}' ({int(top['requests'])} вхождений)"),
+            html.P(f"Пропущенные значения: {missing}"),
+            html.P("Тип данных: String"),
             html.P(html.Strong("Все уникальные классы:")),
-            html.Ul([html.Li(f"{cls}") for cls in sorted(unique_values)]),
+            html.Ul([html.Li(f"{cls}") for cls in sorted(value_counts[PREDICTED_TIP])]),
             html.P(html.Strong("Распределение классов:")),
-            html.Ul([html.Li(f"{cls}: {count} вхождений") for cls, count in value_counts.head(10).items()])
+            html.Ul([
+                html.Li(f"{cls}: {int(count)} вхождений")
+                for cls, count in value_counts.head(10)[[PREDICTED_TIP, 'requests']].itertuples(index=False)
+            ])
         ]
     
     return stats
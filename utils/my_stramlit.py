@@ -11,6 +11,10 @@ from database.database import ClickHouse
 PREDICTED_TIP = 'predicted_tip'
 WORDS_COUNT = 'words_count'
 PREDICTION_LOGS_TABLE = 'model_logs2.ModelLogs'
+# Агрегаты по минутам, которые наполняют материализованные представления ModelLogs
+LABELS_ROLLUP_TABLE = 'model_logs2.ModelLogsLabelsPerMinute'
+WORDS_COUNT_ROLLUP_TABLE = 'model_logs2.ModelLogsWordsCountPerMinute'
+ROLLUP_TABLES = {PREDICTED_TIP: LABELS_ROLLUP_TABLE, WORDS_COUNT: WORDS_COUNT_ROLLUP_TABLE}
 
 
 @st.cache_resource
@@ -18,20 +22,50 @@ def get_database() -> ClickHouse:
     return ClickHouse()
 
 
-@st.cache_data
+# Сколько секунд результаты агрегирующих запросов живут в кэше между перезапусками скрипта
+CACHE_TTL_SECONDS = 60
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
 def get_min_date(_database: ClickHouse) -> datetime.date:
-    """Fetches the minimum datetime from the ModelLogs table."""
-    result = _database.execute_query(f"SELECT MIN(datetime) as min_value FROM {PREDICTION_LOGS_TABLE}")
-    if not result.empty and 'min_value' in result and pd.notna(result['min_value'][0]):
+    """Минимальная дата из поминутного rollup по меткам."""
+    result = _database.execute_query(f"SELECT MIN(minute) as min_value FROM {LABELS_ROLLUP_TABLE}")
+    if result is not None and not result.empty and pd.notna(result['min_value'][0]):
         return result['min_value'][0].date()
     return datetime.date.today()
 
 
+def get_date_bounds(date_range) -> tuple[datetime.datetime, datetime.datetime]:
+    """Превращает значение выбора дат в интервал [start, end)."""
+    if isinstance(date_range, (tuple, list)):
+        start_date = date_range[0] if date_range else datetime.date.today()
+        end_date = date_range[1] if len(date_range) > 1 else start_date
+    else:
+        start_date = end_date = date_range
+    start = datetime.datetime.combine(start_date, datetime.time.min)
+    end = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min)
+    return start, end
+
+
+def build_filters(column_name: str, time_column: str, start: datetime.datetime, end: datetime.datetime,
+                  value_range: tuple[float, float]) -> tuple[str, dict]:
+    """Параметризованное условие WHERE для диапазона дат и фильтра значений."""
+    conditions = [f"{time_column} >= %(start)s AND {time_column} < %(end)s"]
+    params = {'start': start, 'end': end}
+    if column_name == WORDS_COUNT:
+        conditions.append(f"{column_name} BETWEEN %(min_value)s AND %(max_value)s")
+        params.update(min_value=value_range[0], max_value=value_range[1])
+    return 'WHERE ' + ' AND '.join(conditions), params
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
 def get_value_range(_database: ClickHouse, column_name: str) -> Optional[tuple[float, float]]:
-    """Fetches the min and max values for a given column."""
-    query = f"SELECT MIN({column_name}) as min_value, MAX({column_name}) as max_value FROM {PREDICTION_LOGS_TABLE}"
+    """Минимум и максимум числовой колонки из ее rollup-таблицы."""
+    if column_name != WORDS_COUNT:
+        return None
+    query = f"SELECT MIN({column_name}) as min_value, MAX({column_name}) as max_value FROM {WORDS_COUNT_ROLLUP_TABLE}"
     result = _database.execute_query(query)
-    if not result.empty and pd.notna(result['min_value'][0]) and pd.notna(result['max_value'][0]):
+    if result is not None and not result.empty and pd.notna(result['min_value'][0]) and pd.notna(result['max_value'][0]):
         return float(result['min_value'][0]), float(result['max_value'][0])
     return None
 
@@ -53,40 +87,94 @@ def update_slider_range(_database: ClickHouse, selected_columns: list[str]) -> t
     return min_value, max_value, (min_value, max_value)
 
 
-def plot_distribution(_database: ClickHouse, column_name: str, bin_range: tuple[float, float]) -> go.Figure:
-    """Generates a histogram for the selected column within a given range."""
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def get_distribution(_database: ClickHouse, column_name: str, start: datetime.datetime, end: datetime.datetime,
+                     value_range: tuple[float, float]) -> pd.DataFrame:
+    """Число запросов на каждое значение колонки внутри фильтров, агрегация в ClickHouse."""
+    where, params = build_filters(column_name, 'minute', start, end, value_range)
+    query = f"""
+        SELECT {column_name}, sum(requests) AS requests FROM {ROLLUP_TABLES[column_name]}
+        {where}
+        GROUP BY {column_name}
+        ORDER BY {column_name}
+    """
+    result = _database.execute_query(query, params)
+    return result if result is not None else pd.DataFrame()
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def get_statistics(_database: ClickHouse, column_name: str, start: datetime.datetime, end: datetime.datetime,
+                   value_range: tuple[float, float]) -> dict:
+    """Точная статистика по всем отфильтрованным данным одним агрегирующим запросом."""
+    where, params = build_filters(column_name, 'minute', start, end, value_range)
+
+    if column_name == WORDS_COUNT:
+        query = f"""
+            SELECT
+                sum(requests) AS total,
+                avgWeighted({column_name}, requests) AS mean,
+                quantileExactWeighted(0.5)({column_name}, requests) AS median,
+                sqrt(
+                    (sum(requests * {column_name} * {column_name}) - sum(requests) * pow(avgWeighted({column_name}, requests), 2))
+                    / greatest(sum(requests) - 1, 1)
+                ) AS std,
+                min({column_name}) AS min_value,
+                max({column_name}) AS max_value
+            FROM {WORDS_COUNT_ROLLUP_TABLE}
+            {where}
+        """
+        result = _database.execute_query(query, params)
+        if result is None or result.empty or not result['total'][0]:
+            return {}
+        return result.iloc[0].to_dict()
+
     query = f"""
-        SELECT {column_name} FROM {PREDICTION_LOGS_TABLE}
-        WHERE {column_name} >= %(min_value)s AND {column_name} <= %(max_value)s
+        SELECT {column_name}, sum(requests) AS requests FROM {LABELS_ROLLUP_TABLE}
+        {where}
+        GROUP BY {column_name}
+        ORDER BY requests DESC
     """
-    params = {'min_value': bin_range[0], 'max_value': bin_range[1]}
-    dataframe = _database.execute_query(query, params)
+    result = _database.execute_query(query, params)
+    if result is None or result.empty:
+        return {}
+    return {
+        'total': int(result['requests'].sum()),
+        'unique': len(result),
+        'top_value': result[column_name][0],
+        'top_count': int(result['requests'][0]),
+        'missing': int(result.loc[result[column_name] == '', 'requests'].sum()),
+    }
+
+
+def plot_distribution(_database: ClickHouse, column_name: str, start: datetime.datetime, end: datetime.datetime,
+                      bin_range: tuple[float, float]) -> go.Figure:
+    """Гистограмма выбранной колонки внутри фильтров дат и значений."""
+    dataframe = get_distribution(_database, column_name, start, end, bin_range)
     
     if dataframe.empty:
         return go.Figure().update_layout(title='Нет данных для отображения')
     
-    data = dataframe[column_name]
-    numeric_data = pd.to_numeric(data, errors='coerce')
-    is_numeric = not numeric_data.isna().all()
-    
     fig = go.Figure()
     
-    if is_numeric:
-        fig.add_trace(go.Histogram(
-            x=numeric_data.dropna(),
+    if column_name == WORDS_COUNT:
+        # Корзина rollup-таблицы — точное число слов, поэтому столбцы шириной 1
+        fig.add_trace(go.Bar(
+            x=dataframe[column_name],
+            y=dataframe['requests'],
+            width=1,
             name="Длина предложения",
             opacity=1.0
         ))
         fig.update_layout(
             xaxis_title="Количество слов в запросе",
             yaxis_title='Количество запросов',
+            bargap=0,
             title=f'Распределение для {column_name.replace("_", " ").title()}'
         )
     else:
-        value_counts = data.value_counts()
         fig.add_trace(go.Bar(
-            x=value_counts.index,
-            y=value_counts.values,
+            x=dataframe[column_name],
+            y=dataframe['requests'],
             name="Предсказания"
         ))
         fig.update_layout(
@@ -98,51 +186,43 @@ def plot_distribution(_database: ClickHouse, column_name: str, bin_range: tuple[
     return fig
 
 
-def get_data_summary(_database: ClickHouse, selected_column: str) -> str:
-    """Generates summary statistics for the selected column."""
-    query = f"SELECT {selected_column} FROM {PREDICTION_LOGS_TABLE} LIMIT 1000"
-    dataframe = _database.execute_query(query)
-    
-    if dataframe.empty or selected_column not in dataframe.columns:
+def get_data_summary(statistics: dict, selected_column: str) -> str:
+    """Текст со статистикой выбранной колонки."""
+    if not statistics:
         return "Нет доступных данных"
     
-    data = dataframe[selected_column]
-    numeric_data = pd.to_numeric(data, errors='coerce')
-    is_numeric = not numeric_data.isna().all()
-    
-    if is_numeric:
-        valid_data = numeric_data.dropna()
+    if selected_column == WORDS_COUNT:
         summary = f"""
         **Статистика для {selected_column.replace('_', ' ').title()}**
         
-        Всего записей: {len(data):,}
-        Валидных числовых записей: {len(valid_data):,}
-        Среднее значение: {valid_data.mean():.2f}
-        Медиана: {valid_data.median():.2f}
-        Стандартное отклонение: {valid_data.std():.2f}
-        Минимальное значение: {valid_data.min():.2f}
-        Максимальное значение: {valid_data.max():.2f}
-        Пропущенные значения: {numeric_data.isnull().sum()}
+        Всего записей: {int(statistics['total']):,}
+        Среднее значение: {statistics['mean']:.2f}
+        Медиана: {statistics['median']:.2f}
+        Стандартное отклонение: {statistics['std']:.2f}
+        Минимальное значение: {statistics['min_value']:.2f}
+        Максимальное значение: {statistics['max_value']:.2f}
         """
     else:
-        unique_values = data.unique()
-        value_counts = data.value_counts()
         summary = f"""
         **Статистика для {selected_column.replace('_', ' ').title()}**
         
-        Всего записей: {len(data):,}
-        Уникальных классов: {len(unique_values)}
-        Самый частый класс: '{value_counts.index[0]}' ({value_counts.iloc[0]} вхождений)
-        Пропущенные значения: {data.isnull().sum()}
+        Всего записей: {statistics['total']:,}
+        Уникальных классов: {statistics['unique']}
+        Самый частый класс: '{statistics['top_value']}' ({statistics['top_count']} вхождений)
+        Пропущенные значения: {statistics['missing']}
         """
     
     return summary
 
 
-def get_sample_data(_database: ClickHouse, selected_column: str, limit: int = 1000) -> pd.DataFrame:
-    """Fetches sample data from the database."""
-    query = f"SELECT {selected_column} FROM {PREDICTION_LOGS_TABLE} LIMIT {limit}"
-    return _database.execute_query(query)
+@st.cache_data(ttl=CACHE_TTL_SECONDS)
+def get_sample_data(_database: ClickHouse, selected_column: str, start: datetime.datetime, end: datetime.datetime,
+                    value_range: tuple[float, float], limit: int = 1000) -> pd.DataFrame:
+    """Выборка исходных строк внутри фильтров дат и значений."""
+    where, params = build_filters(selected_column, 'datetime', start, end, value_range)
+    query = f"SELECT {selected_column} FROM {PREDICTION_LOGS_TABLE} {where} LIMIT {int(limit)}"
+    result = _database.execute_query(query, params)
+    return result if result is not None else pd.DataFrame()
 
 
 def main():
@@ -179,22 +259,26 @@ def main():
         min_value=min_date,
         max_value=today
     )
+    start, end = get_date_bounds(date_range)
+
+    # Вся статистика считается одним агрегирующим запросом по отфильтрованным данным
+    statistics = get_statistics(database, selected_column, start, end, value_range)
 
     # Основная часть дашборда
     col1, col2 = st.columns([2, 1])
 
     with col1:
         st.header("Распределение данных")
-        st.plotly_chart(plot_distribution(database, selected_column, value_range), use_container_width=True)
+        st.plotly_chart(plot_distribution(database, selected_column, start, end, value_range), use_container_width=True)
 
     with col2:
         st.header("Общая информация")
-        summary = get_data_summary(database, selected_column)
+        summary = get_data_summary(statistics, selected_column)
         st.markdown(summary)
 
     # Таблица с данными
     st.header("Пример данных")
-    sample_data = get_sample_data(database, selected_column)
+    sample_data = get_sample_data(database, selected_column, start, end, value_range)
     if not sample_data.empty:
         st.dataframe(sample_data, use_container_width=True)
     else:
@@ -202,19 +286,15 @@ def main():
 
     # Дополнительная статистика
     st.header("Детальная статистика")
-    if not sample_data.empty and selected_column in sample_data.columns:
-        data = sample_data[selected_column]
-        numeric_data = pd.to_numeric(data, errors='coerce')
+    if selected_column == WORDS_COUNT and statistics:
+        col1, col2, col3 = st.columns(3)
         
-        if not numeric_data.isna().all():
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                st.metric("Среднее значение", f"{numeric_data.mean():.2f}")
-            with col2:
-                st.metric("Медиана", f"{numeric_data.median():.2f}")
-            with col3:
-                st.metric("Стандартное отклонение", f"{numeric_data.std():.2f}")
+        with col1:
+            st.metric("Среднее значение", f"{statistics['mean']:.2f}")
+        with col2:
+            st.metric("Медиана", f"{statistics['median']:.2f}")
+        with col3:
+            st.metric("Стандартное отклонение", f"{statistics['std']:.2f}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.queues import Queue as ProcessQueue
+
+from inference import Inference
+from metrics import (INFERENCE_BATCH_SIZE, INFERENCE_STAGE_SECONDS, SEMANTIC_CACHE_EVICTIONS_TOTAL,
+                     SEMANTIC_CACHE_LOOKUPS_TOTAL)
+
+# Метрики, которые Inference пишет в процессе-воркере и которые сводятся в основной процесс
+WORKER_METRICS = (INFERENCE_STAGE_SECONDS, INFERENCE_BATCH_SIZE, SEMANTIC_CACHE_LOOKUPS_TOTAL,
+                  SEMANTIC_CACHE_EVICTIONS_TOTAL)
+
+
+class PoolOverloadedError(RuntimeError):
+    """Очередь пула заполнена, новая задача не принята"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """Срок запроса истек до запуска модели, работа не выполнялась"""
+
+
+def _check_deadline(deadline: float | None):
+    # time.monotonic на Linux общий для всех процессов хоста, срок можно сравнивать и в воркере
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceededError('Срок запроса истек в очереди пула')
+
+
+def _predict_before_deadline(inference: Inference, texts: list[str], deadline: float | None) -> list[str]:
+    _check_deadline(deadline)
+    return inference.predict_batch(texts)
+
+
+# Экземпляр модели внутри процесса-воркера (только для режима process)
+_worker_inference: Inference | None = None
+
+
+def _init_process_worker(inference_kwargs: dict | None = None, ready: ProcessQueue | None = None):
+    """Загружает и прогревает модель в процессе-воркере и сообщает об этом основному процессу"""
+    global _worker_inference
+    try:
+        _worker_inference = Inference(**(inference_kwargs or {}))
+        _worker_inference.warmup()
+    except BaseException as e:
+        if ready is not None:
+            ready.put((os.getpid(), f'{type(e).__name__}: {e}'))
+        raise
+    if ready is not None:
+        ready.put((os.getpid(), None))
+
+
+def _process_predict_batch(texts: list[str], deadline: float | None = None) -> tuple[list[str], list[dict]]:
+    _check_deadline(deadline)
+    predictions = _worker_inference.predict_batch(texts)
+    # Метрики воркера уходят в основной процесс вместе с результатом
+    return predictions, [metric.drain() for metric in WORKER_METRICS]
+
+
+class InferencePool:
+    """Пул воркеров, в котором выполняется блокирующий инференс вне event loop"""
+
+    def __init__(self, mode: str | None = None, size: int | None = None,
+                 queue_depth: int | None = None, timeout: float | None = None,
+                 inference_kwargs: dict | None = None):
+        # Аргументы Inference (модель, энкодер, метки); в режиме process уходят в воркеры через pickle
+        self.inference_kwargs = inference_kwargs or {}
+        self.mode = mode or os.environ.get('INFERENCE_POOL_MODE', 'thread')
+        self.size = size or int(os.environ.get('INFERENCE_POOL_SIZE', 2))
+        self.queue_depth = queue_depth if queue_depth is not None else int(os.environ.get('INFERENCE_POOL_QUEUE_DEPTH', 64))
+        self.timeout = timeout or float(os.environ.get('INFERENCE_TIMEOUT_S', 30))
+        # Сколько ждать загрузки модели во всех процессах пула
+        self.start_timeout = float(os.environ.get('INFERENCE_POOL_START_TIMEOUT_S', 300))
+
+        if self.mode not in ('thread', 'process'):
+            raise ValueError(f"Неизвестный режим пула: {self.mode}")
+
+        self._executor: Executor | None = None
+        # Процессы-воркеры пишут сюда свой pid, когда модель загружена и прогрета
+        self._ready_queue: ProcessQueue | None = None
+        self._inference: Inference | None = None
+        # Задачи, которые выполняются или ждут свободного воркера
+        self._pending = 0
+        # Задача освобождает место в очереди, когда воркер ее завершил, а не когда вызывающий перестал ждать
+        self._pending_lock = threading.Lock()
+        self._starting: asyncio.Task | None = None
+        self.ready = False
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == 'process':
+                context = multiprocessing.get_context()
+                self._ready_queue = context.Queue()
+                self._executor = ProcessPoolExecutor(max_workers=self.size, mp_context=context,
+                                                     initializer=_init_process_worker,
+                                                     initargs=(self.inference_kwargs, self._ready_queue))
+            else:
+                # Потоки делят одну модель: ONNX Runtime и torch отпускают GIL внутри своих ядер
+                if self._inference is None:
+                    self._inference = Inference(**self.inference_kwargs)
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='inference')
+        return self._executor
+
+    async def start(self):
+        """Загружает модель и прогревает ее вне event loop; повторные вызовы ждут ту же загрузку"""
+        # После неудачной загрузки следующий вызов пробует заново
+        if self._starting is None or (self._starting.done() and not self.ready):
+            self._starting = asyncio.create_task(self._load())
+        await asyncio.shield(self._starting)
+
+    async def _load(self):
+        try:
+            await self._load_workers()
+        except Exception as e:
+            print(f"❌ Не удалось загрузить модель: {e}")
+            if self.mode == 'process' and self._executor is not None:
+                # Пул с упавшим инициализатором сломан, следующая попытка создаст новый
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._ready_queue = None
+            raise
+        self.ready = True
+        print("✅ Модель загружена и прогрета")
+
+    async def _load_workers(self):
+        loop = asyncio.get_running_loop()
+        if self.mode == 'process':
+            executor = self._get_executor()
+            # По задаче на воркер: при методе запуска spawn процессы создаются только под задачи
+            for _ in range(self.size):
+                executor.submit(os.getpid)
+            await loop.run_in_executor(None, self._wait_workers, self._ready_queue)
+        else:
+            self._inference = await loop.run_in_executor(None, lambda: Inference(**self.inference_kwargs))
+            await loop.run_in_executor(None, self._inference.warmup)
+            self._get_executor()
+
+    def _wait_workers(self, ready: ProcessQueue):
+        """Ждет отчета от size разных процессов; ошибка или таймаут загрузки — исключение"""
+        workers = set()
+        deadline = time.monotonic() + self.start_timeout
+        while len(workers) < self.size:
+            try:
+                pid, error = ready.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError(f"За {self.start_timeout} с модель загрузили {len(workers)} "
+                                   f"из {self.size} процессов пула")
+            if error is not None:
+                raise RuntimeError(f"Процесс пула {pid} не загрузил модель: {error}")
+            workers.add(pid)
+
+    async def predict_batch(self, texts: list[str], deadline: float | None = None) -> list[str]:
+        """Выполняет предсказание для батча в пуле с ограничением очереди и таймаутом.
+
+        deadline (по time.monotonic) проверяется в воркере перед прогоном модели:
+        батч, простоявший в очереди пула дольше срока, не считается.
+        """
+        if self._pending >= self.size + self.queue_depth:
+            raise PoolOverloadedError('Очередь инференса переполнена')
+
+        if not self.ready:
+            await self.start()
+        executor = self._get_executor()
+        with self._pending_lock:
+            self._pending += 1
+        try:
+            if self.mode == 'process':
+                future = executor.submit(_process_predict_batch, texts, deadline)
+            else:
+                future = executor.submit(_predict_before_deadline, self._inference, texts, deadline)
+        except BaseException:
+            self._task_done()
+            raise
+        future.add_done_callback(self._task_done)
+
+        timeout = self.timeout
+        if deadline is not None:
+            timeout = min(timeout, max(deadline - time.monotonic(), 0))
+        result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+        if self.mode == 'process':
+            result, drained = result
+            for metric, values in zip(WORKER_METRICS, drained):
+                metric.merge(values)
+        return result
+
+    def _task_done(self, future: Future | None = None):
+        # Вызывается из потока воркера или потока управления ProcessPoolExecutor
+        with self._pending_lock:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._ready_queue = None
+        # Без ссылки на модель ее сессии и веса освобождаются
+        self._inference = None
+        self._starting = None
+        self.ready = False